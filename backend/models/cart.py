@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime
+from sqlalchemy import Column, Integer, String, JSON, DateTime, Float, ForeignKey, UniqueConstraint, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from datetime import datetime
 
 Base = declarative_base()
@@ -9,6 +10,55 @@ class Cart(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, unique=True, index=True)
-    items = Column(JSON, default=[])
+    # Pre-cart_items JSON line list; emptied (NULL) once init_db has moved it into cart_items.
+    legacy_items = Column("items", JSON, default=None)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # cart TTL scans
+    version = Column(Integer, default=0, server_default=text("0"))  # bumped by every cart write
+
+    lines = relationship("CartItem", order_by="CartItem.id", lazy="selectin", passive_deletes=True)
+
+    @property
+    def items(self):
+        """Cart lines in the shape the API has always returned."""
+        return [line.to_dict() for line in self.lines]
+
+
+class CartItem(Base):
+    __tablename__ = "cart_items"
+    __table_args__ = (UniqueConstraint("cart_id", "variant_id", name="uq_cart_items_cart_variant"),)
+
+    id = Column(Integer, primary_key=True)
+    cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(String, nullable=False)
+    variant_id = Column(String, nullable=False)   # variant GID, as stored on the product
+    name = Column(String)
+    price = Column(Float, default=0.0)
+    quantity = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "product_id": self.product_id,
+            "variant_id": self.variant_id,
+            "name": self.name,
+            "price": self.price,
+            "quantity": self.quantity,
+        }
+
+
+class CartLogEntry(Base):
+    """
+    One change to an in-memory cart (CART_BACKEND=memory), appended by its
+    periodic flush. A cart is its carts / cart_items snapshot with its log
+    entries replayed on top, in id order; compaction folds entries into the
+    snapshot and deletes them.
+    """
+    __tablename__ = "cart_log"
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    version = Column(Integer, nullable=False)  # the cart's version after this change
+    changes = Column(JSON, nullable=False)     # {variant GID: line, or null once removed}
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
@@ -109,8 +109,11 @@ class GangSheet(GangSheetBase):
 
     def calculate_total_price(self):
         """Calculate total price based on base price + design count"""
-        design_count = sum(design.quantity for design in self.designs)
-        self.total_price = self.base_price + (design_count * 0.50)
+        from services.pricing import get_pricing_engine
+
+        self.total_price = get_pricing_engine().price_gang_sheet(
+            self.base_price, (design.quantity for design in self.designs)
+        )
         return self.total_price
 
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, JSON, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, Float, JSON, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -10,6 +10,7 @@ class Product(Base):
     id = Column(Integer, primary_key=True, index=True)
     shopify_id = Column(String, unique=True, index=True)
     name = Column(String, nullable=False)
+    handle = Column(String)
     category = Column(String, default="dtf-transfers")
     price = Column(Float, nullable=False)
     image = Column(String)
@@ -17,4 +18,21 @@ class Product(Base):
     description = Column(String, default="")
     variants = Column(JSON, default=[])
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    shopify_updated_at = Column(DateTime)
+    content_hash = Column(String)  # sha1 of the synced fields; unchanged rows are not rewritten
+    deleted_at = Column(DateTime, index=True)  # tombstone: set when the product is deleted in Shopify
+
+
+class ProductVariant(Base):
+    """Variants of live products, one row each, kept in step with the product upsert for point lookups."""
+    __tablename__ = "product_variants"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # numeric Shopify variant ID
+    shopify_id = Column(String, nullable=False)                   # variant GID
+    product_id = Column(String, nullable=False, index=True)       # product GID (products.shopify_id)
+    product_name = Column(String)
+    title = Column(String)
+    price = Column(Float, default=0.0)
+    available = Column(Boolean)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, String, JSON, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+Base = declarative_base()
+
+class ShopifyCart(Base):
+    __tablename__ = "shopify_carts"
+
+    session_id = Column(String, primary_key=True)  # our x-session-id
+    purpose = Column(String, primary_key=True)     # "cart" (mirrors the local cart) | "buy_now"
+    cart_id = Column(String, nullable=False)        # Storefront Cart GID
+    checkout_url = Column(String, nullable=False)
+    lines = Column(JSON, default={})                # {variant_gid: {"id": cart line GID, "quantity": n}}
+    verified_at = Column(DateTime, nullable=True)   # last time Shopify returned this cart (so it was still open)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+Base = declarative_base()
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    name = Column(String, primary_key=True)  # e.g. "products"
+    watermark = Column(DateTime)             # newest Shopify updatedAt fully synced
+    cursor = Column(String)                  # endCursor of the last committed page of an unfinished run
+    mode = Column(String)
+    products_synced = Column(Integer, default=0)
+    last_started_at = Column(DateTime)
+    last_completed_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,9 +1,24 @@
+from typing import Dict, List, Literal, Optional
+
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from services.cart_service import get_cart_service
+from services.cart_service import CART_BACKEND, CartConflictError, get_cart_service
+from services.pricing import get_pricing_engine
+from services.shopify_cart_service import SHOPIFY_CHECKOUT_MODE, get_shopify_cart_service
+from services.shopify_client import ShopifyCircuitOpenError, ShopifyError, ShopifyUserError
 
 router = APIRouter(prefix="/api/cart", tags=["cart"])
 
+def _priced(cart: Dict) -> Dict:
+    """The cart with each line's tiered unit_price / line_total and the cart subtotal."""
+    pricing = get_pricing_engine().price_cart(cart["items"])
+    items = [
+        {**item, "unit_price": line["unit_price"], "line_total": line["line_total"], "tier_min_quantity": line["tier_min_quantity"]}
+        for item, line in zip(cart["items"], pricing["lines"])
+    ]
+    return {**cart, "items": items, "subtotal": pricing["subtotal"]}
+
+
 class AddToCartRequest(BaseModel):
     product_id: str
     variant_id: str
@@ -15,70 +30,142 @@ async def add_to_cart(request: Request, body: AddToCartRequest):
     session_id = request.headers.get("x-session-id")
     if not session_id:
         raise HTTPException(status_code=400, detail="x-session-id header missing")
+    if body.quantity < 1:
+        raise HTTPException(status_code=400, detail="quantity must be at least 1")
 
     cart_service = get_cart_service()
-    cart = await cart_service.add_item_to_cart(
-        session_id,
-        body.product_id,
-        body.variant_id,
-        body.quantity
-    )
+    try:
+        cart = await cart_service.add_item_to_cart(
+            session_id,
+            body.product_id,
+            body.variant_id,
+            body.quantity
+        )
+    except CartConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     if cart is None:
         raise HTTPException(status_code=404, detail="Product or variant not found in database")
 
+    # Mirror the change into the session's Shopify cart now, so checkout is instant.
+    get_shopify_cart_service().schedule_sync(session_id)
+
     return {
         "status": "success",
         "message": f"{body.quantity} item(s) added to cart",
-        "cart": {
-            "id": cart.id,
-            "session_id": cart.session_id,
-            "items": cart.items,
-            "created_at": cart.created_at,
-            "updated_at": cart.updated_at
-        }
+        "cart": _priced(cart),
+    }
+
+
+class CartOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    variant_id: str
+    quantity: Optional[int] = None  # missing: 1 for "add", 0 (remove the line) for "set"
+    product_id: Optional[str] = None
+
+
+class BatchCartRequest(BaseModel):
+    operations: List[CartOperation]
+    version: Optional[int] = None  # only apply on top of this cart version (409 otherwise)
+
+
+@router.post("/items/batch")
+async def batch_update_cart(request: Request, body: BatchCartRequest):
+    """
+    Apply many add / set / remove operations in one request, atomically.
+
+    "set" replaces a line's quantity (0 removes it). Either every operation is
+    applied or, if any variant is unknown, none are. With "version", the
+    operations are only applied if the cart is still at that version.
+    """
+    session_id = request.headers.get("x-session-id")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="x-session-id header missing")
+
+    try:
+        cart = await get_cart_service().apply_operations(
+            session_id, [op.model_dump() for op in body.operations], expected_version=body.version
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CartConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    get_shopify_cart_service().schedule_sync(session_id)
+    return {
+        "status": "success",
+        "message": f"{len(body.operations)} cart operation(s) applied",
+        "cart": _priced(cart),
     }
 
 
 @router.get("/items/{session_id}")
 async def get_cart_items(session_id: str):
-    cart_service = get_cart_service()
-    cart = await cart_service.get_or_create_cart(session_id)
+    # Read-only: a session without a cart gets an empty one, but no row is created for it.
+    cart = await get_cart_service().get_cart(session_id)
+    if cart is None:
+        cart = {"id": None, "items": [], "created_at": None, "updated_at": None}
+    cart = _priced(cart)
     return {
         "session_id": session_id,
         "cart": {
-            "id": cart.id,
-            "items": cart.items,
-            "created_at": cart.created_at,
-            "updated_at": cart.updated_at
+            "id": cart["id"],
+            "items": cart["items"],
+            "subtotal": cart["subtotal"],
+            "created_at": cart["created_at"],
+            "updated_at": cart["updated_at"]
         }
     }
 
 
 @router.delete("/items/{session_id}")
 async def clear_cart(session_id: str):
-    cart_service = get_cart_service()
-    cart = await cart_service.get_or_create_cart(session_id)
-    cart.items = []
-    cart.updated_at = cart.updated_at
-    async with cart_service.get_cart_service() as session:
-        session.add(cart)
-        await session.flush()
-        await session.commit()
+    await get_cart_service().clear_cart(session_id)
     return {"status": "success", "message": "Cart cleared"}
 
 
+class CheckoutRequest(BaseModel):
+    mode: str = SHOPIFY_CHECKOUT_MODE  # "cart" | "permalink"
+    attributes: Dict[str, str] = {}
+    discount_codes: List[str] = []
+
+
+@router.post("/checkout")
+async def checkout_cart(request: Request, body: Optional[CheckoutRequest] = None):
+    """
+    Checkout URL for the session's cart.
+
+    "cart" mode reuses the session's Shopify cart and only sends line diffs;
+    "permalink" mode builds the URL locally when availability is fresh for every
+    variant. Attributes or discount codes force a one-off cartCreate.
+    """
+    session_id = request.headers.get("x-session-id")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="x-session-id header missing")
+    body = body or CheckoutRequest()
+
+    try:
+        result = await get_shopify_cart_service().checkout(
+            session_id,
+            mode=body.mode,
+            attributes=body.attributes,
+            discount_codes=body.discount_codes,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ShopifyUserError as e:
+        raise HTTPException(status_code=400, detail=e.user_errors)
+    except ShopifyCircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+    except ShopifyError as e:
+        raise HTTPException(status_code=502, detail=f"Shopify checkout failed: {e}")
+    return {"session_id": session_id, **result}
+
+
 @router.get("/debug/{session_id}")
 async def debug_cart(session_id: str):
     cart_service = get_cart_service()
-    cart = await cart_service.get_or_create_cart(session_id)
-    return {
-        "session_id": session_id,
-        "cart": {
-            "id": cart.id,
-            "session_id": cart.session_id,
-            "items": cart.items,
-            "created_at": cart.created_at,
-            "updated_at": cart.updated_at
-        }
-    }
+    cart = await cart_service.get_cart(session_id)
+    if cart is None:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return {"session_id": session_id, "cart": _priced(cart), "backend": CART_BACKEND, "stats": cart_service.stats}
@@ -3,17 +3,33 @@ import os
 import time
 import base64
 import asyncio
+import hashlib
 import logging
-import requests
-from datetime import datetime
-from fastapi import APIRouter, UploadFile, Form, HTTPException, Request
+from typing import Optional
+
+import httpx
+from fastapi import APIRouter, UploadFile, Form, HTTPException, Request, Response
 from dotenv import load_dotenv
-from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
-from services.database import SessionLocal
+from services.catalog_cache import get_catalog_cache
+from services.catalog_store import save_products
 from services.cart_service import get_cart_service
-from models.product import Product
+from services.shopify_cart_service import get_shopify_cart_service
+from services.idempotency_service import get_idempotency_service, request_fingerprint
+from services.shopify_client import (
+    ShopifyCircuitOpenError,
+    ShopifyError,
+    ShopifyGraphQLError,
+    ShopifyThrottledError,
+    ShopifyUserError,
+    build_variant_gid_from_numeric,
+    get_shopify_client,
+    numeric_id_from_gid,
+    raise_for_user_errors,
+    shopify_base_url,
+)
+from services.shopify_throttle import Priority
 
 # ------------------------------------------------------------------
 # Setup
@@ -35,63 +51,57 @@ if not SHOPIFY_ACCESS_TOKEN or not SHOPIFY_STORE:
 if not SHOPIFY_STOREFRONT_TOKEN:
     logger.warning("⚠️ SHOPIFY_STOREFRONT_TOKEN not set. cartCreate (checkout) will fail until provided.")
 
-SHOPIFY_GRAPHQL_ADMIN = f"https://{SHOPIFY_STORE}/admin/api/2025-01/graphql.json"
-SHOPIFY_GRAPHQL_STOREFRONT = f"https://{SHOPIFY_STORE}/api/2025-01/graphql.json"
-SHOPIFY_REST_BASE = f"https://{SHOPIFY_STORE}/admin/api/2025-01"
-
 # ------------------------------------------------------------------
-# Helpers
+# Third-party HTTP (ImgBB, image URLs): kept off the Shopify pool
 # ------------------------------------------------------------------
-def numeric_id_from_gid(gid: str) -> str:
-    return gid.split("/")[-1] if gid else None
+_http: Optional[httpx.AsyncClient] = None
+
+
+def get_gang_sheet_http() -> httpx.AsyncClient:
+    """Return the client for ImgBB uploads and image fetches, creating it on first use."""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0, connect=5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            follow_redirects=True,
+        )
+    return _http
 
-def build_variant_gid_from_numeric(numeric_id: int) -> str:
-    return f"gid://shopify/ProductVariant/{numeric_id}"
+
+async def close_gang_sheet_http():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
 
 # ------------------------------------------------------------------
 # DB upsert
 # ------------------------------------------------------------------
-async def upsert_product_local(shopify_gid: str, product_data: dict):
-    async with SessionLocal() as db:
-        try:
-            result = await db.execute(select(Product).where(Product.shopify_id == shopify_gid))
-            prod = result.scalars().first()
-            if prod:
-                prod.name = product_data.get("name", prod.name)
-                prod.description = product_data.get("description", prod.description)
-                prod.price = product_data.get("price", prod.price)
-                prod.image = product_data.get("image", prod.image)
-                prod.variants = product_data.get("variants", prod.variants)
-                prod.updated_at = datetime.utcnow()
-            else:
-                prod = Product(
-                    shopify_id=shopify_gid,
-                    name=product_data.get("name"),
-                    description=product_data.get("description", ""),
-                    price=product_data.get("price", 0),
-                    image=product_data.get("image"),
-                    variants=product_data.get("variants", []),
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow(),
-                )
-                db.add(prod)
-            await db.commit()
-            await db.refresh(prod)
-            logger.info(f"💾 Product upserted locally: {prod.name}")
-            return prod
-        except SQLAlchemyError as e:
-            logger.error(f"❌ Database error in upsert_product_local: {e}")
-            await db.rollback()
-            return None
+async def upsert_product_local(shopify_gid: str, product_data: dict) -> bool:
+    image = product_data.get("image")
+    try:
+        await save_products([{
+            "shopify_id": shopify_gid,
+            "images": [image] if image else [],
+            **product_data,
+        }])
+    except SQLAlchemyError as e:
+        logger.error(f"❌ Database error in upsert_product_local: {e}")
+        return False
+    get_catalog_cache().invalidate()
+    logger.info(f"💾 Product upserted locally: {product_data.get('name')}")
+    return True
 
 # ------------------------------------------------------------------
 # ImgBB upload with retry
 # ------------------------------------------------------------------
-def upload_to_imgbb_with_retry(encoded_image: str, max_retries: int = 3, delay: int = 2) -> str:
+async def upload_to_imgbb_with_retry(encoded_image: str, max_retries: int = 3, delay: int = 2) -> str:
+    http = get_gang_sheet_http()
     for attempt in range(1, max_retries + 1):
         try:
             logger.info(f"🖼️ Uploading image to ImgBB (Attempt {attempt}/{max_retries})...")
-            resp = requests.post(
+            resp = await http.post(
                 "https://api.imgbb.com/1/upload",
                 params={"key": IMGBB_API_KEY},
                 data={"image": encoded_image},
@@ -105,13 +115,13 @@ def upload_to_imgbb_with_retry(encoded_image: str, max_retries: int = 3, delay:
         except Exception as e:
             logger.error(f"❌ ImgBB upload error (attempt {attempt}): {e}")
         if attempt < max_retries:
-            time.sleep(delay)
+            await asyncio.sleep(delay)
     raise HTTPException(status_code=400, detail="Image upload failed after multiple retries.")
 
 # ------------------------------------------------------------------
 # Poll Storefront to confirm variant exists / is available
 # ------------------------------------------------------------------
-def wait_for_variant_in_storefront(variant_gid: str, timeout: int = 20, interval: int = 2) -> bool:
+async def wait_for_variant_in_storefront(variant_gid: str, timeout: int = 20, interval: int = 2) -> bool:
     """
     Poll the storefront API for the variant node to appear.
     Returns True if variant appears within timeout, False otherwise.
@@ -130,36 +140,32 @@ def wait_for_variant_in_storefront(variant_gid: str, timeout: int = 20, interval
       }
     }
     """
-    headers = {
-        "Content-Type": "application/json",
-        "X-Shopify-Storefront-Access-Token": SHOPIFY_STOREFRONT_TOKEN,
-    }
-    end_at = time.time() + timeout
+    client = get_shopify_client()
+    end_at = time.monotonic() + timeout
     attempt = 0
-    while time.time() < end_at:
+    while time.monotonic() < end_at:
         attempt += 1
         try:
             logger.debug("Storefront node query attempt %s for %s", attempt, variant_gid)
-            r = requests.post(SHOPIFY_GRAPHQL_STOREFRONT, json={"query": query, "variables": {"id": variant_gid}}, headers=headers, timeout=10)
-            data = r.json()
-            # If GraphQL returned errors, log but continue retry (transient possible).
-            if "errors" in data:
-                logger.debug("Storefront node errors: %s", data["errors"])
-            node = data.get("data", {}).get("node")
+            data = await client.storefront_graphql(query, {"id": variant_gid}, timeout=10)
+            node = data.get("node")
             if node:
                 logger.info("✅ Variant visible in Storefront: %s (availableForSale=%s)", node.get("id"), node.get("availableForSale"))
                 return True
-        except Exception as e:
-            logger.debug("Storefront poll exception (ignored): %s", e)
+        except ShopifyError as e:
+            # Transient errors are possible while the product propagates; keep polling.
+            logger.debug("Storefront poll error (ignored): %s", e)
         logger.info("Variant not yet visible in Storefront, waiting %s seconds...", interval)
-        time.sleep(interval)
+        await asyncio.sleep(interval)
     logger.warning("Timed out waiting for variant to appear in Storefront.")
     return False
 
 # ------------------------------------------------------------------
 # Create Shopify cart (Storefront API) -> returns checkoutUrl
 # ------------------------------------------------------------------
-def create_shopify_checkout(variant_gid: str, quantity: int, max_retries: int = 2) -> str:
+async def create_shopify_checkout(variant_gid: str, quantity: int, max_retries: int = 2) -> str:
+    # Always a brand-new variant, so cartCreate is already the single round trip;
+    # the session's reusable cart is synced separately once the item is in the local cart.
     if not SHOPIFY_STOREFRONT_TOKEN:
         raise HTTPException(status_code=500, detail="Missing SHOPIFY_STOREFRONT_TOKEN for Storefront API (cartCreate).")
 
@@ -172,41 +178,38 @@ def create_shopify_checkout(variant_gid: str, quantity: int, max_retries: int =
     }
     """
     variables = {"input": {"lines": [{"quantity": quantity, "merchandiseId": variant_gid}]}}
-    headers = {
-        "Content-Type": "application/json",
-        "X-Shopify-Storefront-Access-Token": SHOPIFY_STOREFRONT_TOKEN,
-    }
+    client = get_shopify_client()
 
     last_err = None
     for attempt in range(1, max_retries + 1):
         try:
             logger.info("🛒 Creating cart via Storefront API (attempt %s/%s)...", attempt, max_retries)
-            r = requests.post(SHOPIFY_GRAPHQL_STOREFRONT, json={"query": mutation, "variables": variables}, headers=headers, timeout=20)
-            data = r.json()
-            if "errors" in data:
-                last_err = data["errors"]
-                logger.error("GraphQL errors from Storefront API: %s", last_err)
-                # don't retry on client side errors like invalid GID -> raise
-                raise HTTPException(status_code=400, detail=last_err)
-            payload = data.get("data", {}).get("cartCreate", {})
-            user_errors = payload.get("userErrors") or []
-            if user_errors:
-                last_err = user_errors
-                logger.error("Storefront userErrors: %s", user_errors)
-                raise HTTPException(status_code=400, detail=user_errors)
+            data = await client.storefront_graphql(mutation, variables, priority=Priority.CHECKOUT)
+            payload = data.get("cartCreate", {})
+            raise_for_user_errors(payload)
             cart = payload.get("cart")
             if cart and cart.get("checkoutUrl"):
                 logger.info("✅ Checkout URL obtained: %s", cart["checkoutUrl"])
                 return cart["checkoutUrl"]
             last_err = f"No checkoutUrl returned: {data}"
             logger.warning(last_err)
-        except HTTPException:
-            raise
-        except Exception as e:
+        except ShopifyGraphQLError as e:
+            logger.error("GraphQL errors from Storefront API: %s", e.errors)
+            # don't retry on client side errors like invalid GID -> raise
+            raise HTTPException(status_code=400, detail=e.errors)
+        except ShopifyUserError as e:
+            logger.error("Storefront userErrors: %s", e.user_errors)
+            raise HTTPException(status_code=400, detail=e.user_errors)
+        except ShopifyThrottledError:
+            raise HTTPException(status_code=503, detail="Shopify is rate limiting checkout; try again shortly.")
+        except ShopifyCircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+        except ShopifyError as e:
+            # Throttling is already waited out inside the client; only transport failures get here.
             last_err = str(e)
             logger.error("Error calling Storefront cartCreate: %s", e)
         if attempt < max_retries:
-            time.sleep(2)
+            await asyncio.sleep(0.25 * 2 ** (attempt - 1))
     raise HTTPException(status_code=500, detail=f"Failed to create checkout via Storefront API: {last_err}")
 
 # ------------------------------------------------------------------
@@ -215,19 +218,53 @@ def create_shopify_checkout(variant_gid: str, quantity: int, max_retries: int =
 @router.post("/create-gang-sheet")
 async def create_custom_gang_sheet(
     request: Request,
+    response: Response,
     name: str = Form(...),
     description: str = Form(...),
     price: float = Form(...),
     image: UploadFile = None,
     image_url: str = Form(None),
     quantity: int = Form(1),
+):
+    session_id = request.headers.get("x-session-id")
+    image_bytes = await image.read() if image else None
+
+    async def work():
+        return await _create_gang_sheet(session_id, name, description, price, image_bytes, image_url, quantity)
+
+    idempotency_key = request.headers.get("idempotency-key")
+    if not idempotency_key:
+        return await work()
+
+    fingerprint = request_fingerprint(
+        session_id=session_id,
+        name=name,
+        description=description,
+        price=price,
+        image_url=image_url,
+        image_sha256=hashlib.sha256(image_bytes).hexdigest() if image_bytes else None,
+        quantity=quantity,
+    )
+    result, replayed = await get_idempotency_service().run(idempotency_key, fingerprint, work)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def _create_gang_sheet(
+    session_id: str,
+    name: str,
+    description: str,
+    price: float,
+    image_bytes: bytes,
+    image_url: str,
+    quantity: int,
 ):
     logger.info(f"🚀 Creating gang sheet '{name}' (${price}) qty={quantity}")
-
-    headers_admin = {
-        "Content-Type": "application/json",
-        "X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN,
-    }
+    client = get_shopify_client()
+    # With an Idempotency-Key, what an earlier failed attempt already did (else empty).
+    idempotency = get_idempotency_service()
+    progress = idempotency.progress()
 
     # 1) Create product (Admin GraphQL)
     mutation_create = """
@@ -246,58 +283,60 @@ async def create_custom_gang_sheet(
             "status": "ACTIVE",
         }
     }
-    resp = requests.post(SHOPIFY_GRAPHQL_ADMIN, headers=headers_admin, json={"query": mutation_create, "variables": variables}, timeout=30)
-    try:
-        data = resp.json()
-    except Exception:
-        logger.exception("Failed to parse Shopify product create response")
-        raise HTTPException(status_code=500, detail="Invalid response from Shopify product create")
-
-    if "errors" in data:
-        raise HTTPException(status_code=400, detail=data["errors"])
-
-    product_payload = data.get("data", {}).get("productCreate", {})
-    user_errors = product_payload.get("userErrors") or []
-    if user_errors:
-        raise HTTPException(status_code=400, detail=user_errors)
-
-    product = product_payload.get("product")
-    if not product:
-        raise HTTPException(status_code=500, detail="Product not returned after creation")
-
-    product_gid = product["id"]
-    product_handle = product.get("handle")
+    product_gid = progress.get("product_id")
+    if product_gid:
+        logger.info("♻️ Reusing product %s from an earlier attempt", product_gid)
+    else:
+        try:
+            data = await client.admin_graphql(mutation_create, variables, timeout=30)
+            product_payload = data.get("productCreate", {})
+            raise_for_user_errors(product_payload)
+        except ShopifyGraphQLError as e:
+            raise HTTPException(status_code=400, detail=e.errors)
+        except ShopifyUserError as e:
+            raise HTTPException(status_code=400, detail=e.user_errors)
+        except ShopifyError:
+            logger.exception("Shopify product create failed")
+            raise HTTPException(status_code=500, detail="Invalid response from Shopify product create")
+
+        product = product_payload.get("product")
+        if not product:
+            raise HTTPException(status_code=500, detail="Product not returned after creation")
+
+        product_gid = product["id"]
+        logger.info("✅ Product created on Shopify: %s", product_gid)
+        # Before anything else can fail: a retry must reuse this product, not create another.
+        await idempotency.checkpoint(product_id=product_gid)
     numeric_id = numeric_id_from_gid(product_gid)
-    logger.info("✅ Product created on Shopify: %s", product_gid)
 
     # 2) Get or create variant
-    v_query = f"""
-    {{
-      product(id: "{product_gid}") {{
-        variants(first: 10) {{
-          edges {{ node {{ id title price availableForSale }} }}
-        }}
-      }}
-    }}
+    v_query = """
+    query productVariants($id: ID!) {
+      product(id: $id) {
+        variants(first: 10) {
+          edges { node { id title price availableForSale } }
+        }
+      }
+    }
     """
-    v_resp = requests.post(SHOPIFY_GRAPHQL_ADMIN, headers=headers_admin, json={"query": v_query}, timeout=20)
-    try:
-        v_data = v_resp.json()
-    except Exception:
-        logger.exception("Failed to parse Shopify variant query response")
-        raise HTTPException(status_code=500, detail="Invalid response from Shopify variant query")
+    variant_gid = progress.get("variant_id")
+    if not variant_gid:
+        try:
+            v_data = await client.admin_graphql(v_query, {"id": product_gid})
+        except ShopifyError:
+            logger.exception("Shopify variant query failed")
+            raise HTTPException(status_code=500, detail="Invalid response from Shopify variant query")
 
-    edges = v_data.get("data", {}).get("product", {}).get("variants", {}).get("edges", [])
-    variant_gid = edges[0]["node"]["id"] if edges else None
+        edges = (v_data.get("product") or {}).get("variants", {}).get("edges", [])
+        variant_gid = edges[0]["node"]["id"] if edges else None
 
     if not variant_gid:
-        rest_url = f"{SHOPIFY_REST_BASE}/products/{numeric_id}/variants.json"
         v_payload = {"variant": {"price": str(price), "option1": "Default Title"}}
-        rest = requests.post(rest_url, headers={"X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN}, json=v_payload, timeout=20)
         try:
+            rest = await client.rest("POST", f"products/{numeric_id}/variants.json", json=v_payload)
             rest_json = rest.json()
-        except Exception:
-            logger.exception("Failed to parse REST variant create response")
+        except (ShopifyError, ValueError):
+            logger.exception("Shopify REST variant create failed")
             raise HTTPException(status_code=500, detail="Invalid response from Shopify variant create")
         variant_num = rest_json.get("variant", {}).get("id")
         if not variant_num:
@@ -306,6 +345,8 @@ async def create_custom_gang_sheet(
         variant_gid = build_variant_gid_from_numeric(variant_num)
 
     logger.info("✅ Variant ready: %s", variant_gid)
+    if variant_gid != progress.get("variant_id"):
+        await idempotency.checkpoint(variant_id=variant_gid)
 
     # 3) Publish product to Online Store (publicationId)
     if SHOPIFY_ONLINE_CHANNEL_ID:
@@ -316,47 +357,42 @@ async def create_custom_gang_sheet(
           }
         }
         """
-        pub_resp = requests.post(
-            SHOPIFY_GRAPHQL_ADMIN,
-            headers=headers_admin,
-            json={
-                "query": publish_mutation,
-                "variables": {"productId": product_gid, "publicationId": SHOPIFY_ONLINE_CHANNEL_ID},
-            },
-            timeout=15,
-        )
         try:
-            pub_data = pub_resp.json()
-        except Exception:
-            logger.exception("Failed to parse publish response")
+            pub_data = await client.admin_graphql(
+                publish_mutation,
+                {"productId": product_gid, "publicationId": SHOPIFY_ONLINE_CHANNEL_ID},
+                timeout=15,
+            )
+        except ShopifyError:
+            logger.exception("Failed to publish product")
             pub_data = {}
-        errs = pub_data.get("data", {}).get("publishablePublish", {}).get("userErrors")
+        errs = pub_data.get("publishablePublish", {}).get("userErrors")
         if errs:
             logger.warning("⚠️ Publish userErrors: %s", errs)
         else:
             logger.info("🌐 Product published to Online Store (publicationId=%s)", SHOPIFY_ONLINE_CHANNEL_ID)
         # short delay to let Shopify propagate
-        time.sleep(3)
+        await asyncio.sleep(3)
     else:
         logger.warning("No SHOPIFY_ONLINE_CHANNEL_ID provided; product may not be visible in storefront.")
 
     # 4) Image upload
-    image_url_final = None
-    image_bytes = None
-    if image_url and not image:
+    image_url_final = progress.get("image_url")
+    if image_url_final:
+        image_bytes = None
+    elif image_url and not image_bytes:
         try:
-            img_resp = requests.get(image_url, timeout=10)
+            img_resp = await get_gang_sheet_http().get(image_url, timeout=10)
             img_resp.raise_for_status()
             image_bytes = img_resp.content
         except Exception as e:
             logger.exception("Image URL fetch failed")
             raise HTTPException(status_code=400, detail=f"Image URL fetch failed: {e}")
-    elif image:
-        image_bytes = await image.read()
 
     if image_bytes:
         encoded = base64.b64encode(image_bytes).decode()
-        image_url_final = upload_to_imgbb_with_retry(encoded)
+        image_url_final = await upload_to_imgbb_with_retry(encoded)
+        await idempotency.checkpoint(image_url=image_url_final)
 
     # 5) Upsert locally
     try:
@@ -374,9 +410,11 @@ async def create_custom_gang_sheet(
         logger.exception("Non-fatal: failed to upsert locally")
 
     # 6) Optionally add to local cart (session)
-    session_id = request.headers.get("x-session-id")
     cart_data = None
-    if session_id:
+    if session_id and progress.get("added_to_cart"):
+        # An earlier attempt added the line already; adding again would double the quantity.
+        cart_data = await get_cart_service().get_cart(session_id)
+    elif session_id:
         cart_service = get_cart_service()
         for attempt in range(1, 3):
             try:
@@ -386,23 +424,25 @@ async def create_custom_gang_sheet(
                 cart = None
             if cart:
                 cart_data = cart
+                await idempotency.checkpoint(added_to_cart=True)
+                get_shopify_cart_service().schedule_sync(session_id)
                 break
             await asyncio.sleep(2)
 
     # 7) Ensure storefront sees the variant before calling cartCreate
-    visible = wait_for_variant_in_storefront(variant_gid, timeout=1000, interval=2)
+    visible = await wait_for_variant_in_storefront(variant_gid, timeout=1000, interval=2)
     if not visible:
         # Try a second publish or longer wait before failing (optional)
         logger.warning("Variant not visible in Storefront after initial wait; sleeping extra 5s and retrying check.")
-        time.sleep(5)
-        visible = wait_for_variant_in_storefront(variant_gid, timeout=20, interval=2)
+        await asyncio.sleep(5)
+        visible = await wait_for_variant_in_storefront(variant_gid, timeout=20, interval=2)
     if not visible:
         raise HTTPException(status_code=500, detail="Variant not visible in Storefront; cannot create checkout yet.")
 
     # 8) Create checkout via cartCreate
     checkout_url = None
     try:
-        checkout_url = create_shopify_checkout(variant_gid, int(quantity), max_retries=3)
+        checkout_url = await create_shopify_checkout(variant_gid, int(quantity), max_retries=3)
     except HTTPException as e:
         logger.error("Failed to create checkout: %s", e.detail)
         raise
@@ -415,6 +455,6 @@ async def create_custom_gang_sheet(
         "price": price,
         "checkout_url": checkout_url,
         "image_url": image_url_final,
-        "admin_url": f"https://{SHOPIFY_STORE}/admin/products/{numeric_id}",
+        "admin_url": f"{shopify_base_url(SHOPIFY_STORE)}/admin/products/{numeric_id}",
         "cart": cart_data,
     }
@@ -1,21 +1,25 @@
-import os
 import logging
-from typing import Any, Dict, List
-
-import httpx
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import select
-from services.database import SessionLocal
-from models.product import Product
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException, Request
+from services.catalog_cache import get_catalog_cache
+from services.shopify_cart_service import SHOPIFY_CHECKOUT_MODE, desired_lines, get_shopify_cart_service, line_quantity, to_variant_gid
+from services.shopify_client import (
+    SHOPIFY_STORE,
+    SHOPIFY_STOREFRONT_TOKEN,
+    ShopifyCircuitOpenError,
+    ShopifyError,
+    ShopifyUserError,
+    get_shopify_client,
+    raise_for_user_errors,
+)
+from services.shopify_throttle import Priority
+from services.variant_availability import get_variant_availability
 
 # ========== SETUP ==========
 logger = logging.getLogger("shopify")
 logging.basicConfig(level=logging.INFO)
 
-SHOPIFY_STORE = os.getenv("SHOPIFY_STORE", "presmtechnologies.myshopify.com")
-SHOPIFY_STOREFRONT_TOKEN = os.getenv("SHOPIFY_STOREFRONT_TOKEN", "")
-SHOPIFY_GRAPHQL_URL = f"https://{SHOPIFY_STORE}/api/2024-10/graphql.json"
-
 if not SHOPIFY_STOREFRONT_TOKEN:
     logger.warning("⚠️ Shopify token not set. Sync will not work.")
 else:
@@ -23,115 +27,21 @@ else:
 
 router = APIRouter(prefix="/shopify", tags=["Shopify"])
 
-# Helper for headers
-def shopify_headers() -> Dict[str, str]:
-    return {
-        "X-Shopify-Storefront-Access-Token": SHOPIFY_STOREFRONT_TOKEN,
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
-
 # =====================================================
 # 🛍️  GET PRODUCTS
 # =====================================================
 @router.get("/products")
 async def get_shopify_products() -> Dict[str, Any]:
-    query = """
-    {
-      products(first: 20) {
-        edges {
-          node {
-            id
-            title
-            handle
-            description
-            images(first: 3) {
-              edges { node { url } }
-            }
-            variants(first: 5) {
-              edges {
-                node {
-                  id
-                  title
-                  priceV2 { amount currencyCode }
-                  availableForSale
-                }
-              }
-            }
-          }
-        }
-      }
-    }
-    """
+    """Serves the local catalog from cache; Shopify is only consulted in the background (or on a cold, empty DB)."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                SHOPIFY_GRAPHQL_URL, headers=shopify_headers(), json={"query": query}, timeout=20.0
-            )
-
-        if response.status_code >= 400:
-            logger.error("Shopify products HTTP %s: %s", response.status_code, response.text)
-            raise HTTPException(status_code=502, detail="Shopify API error")
-
-        data = response.json()
-        if "errors" in data:
-            logger.error("Shopify GraphQL errors: %s", data.get("errors"))
-            raise HTTPException(status_code=502, detail="Shopify GraphQL error")
-
-        product_edges = data.get("data", {}).get("products", {}).get("edges", [])
-        products: List[Dict[str, Any]] = []
-
-        for edge in product_edges:
-            node = edge.get("node", {})
-            images = [img["node"]["url"] for img in node.get("images", {}).get("edges", [])]
-            variants = [
-                {
-                    "shopify_id": v["node"]["id"],
-                    "title": v["node"]["title"],
-                    "price": float(v["node"]["priceV2"]["amount"]),
-                    "available": v["node"]["availableForSale"],
-                }
-                for v in node.get("variants", {}).get("edges", [])
-            ]
-            products.append(
-                {
-                    "shopify_id": node["id"],
-                    "name": node["title"],
-                    "description": node.get("description", ""),
-                    "price": variants[0]["price"] if variants else 0.0,
-                    "image": images[0] if images else None,
-                    "images": images,
-                    "variants": variants,
-                }
-            )
-
-        # Save or update DB records
-        async with SessionLocal() as session:
-            async with session.begin():
-                for p in products:
-                    result = await session.execute(select(Product).where(Product.shopify_id == p["shopify_id"]))
-                    existing = result.scalars().first()
-                    if existing:
-                        existing.name = p["name"]
-                        existing.description = p["description"]
-                        existing.price = p["price"]
-                        existing.image = p["image"]
-                        existing.images = p["images"]
-                        existing.variants = p["variants"]
-                    else:
-                        new = Product(
-                            shopify_id=p["shopify_id"],
-                            name=p["name"],
-                            description=p["description"],
-                            price=p["price"],
-                            image=p["image"],
-                            images=p["images"],
-                            variants=p["variants"],
-                        )
-                        session.add(new)
-
+        products = await get_catalog_cache().get_products()
         return {"count": len(products), "products": products}
 
+    except ShopifyCircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+    except ShopifyError as e:
+        logger.error("Shopify products request failed: %s", e)
+        raise HTTPException(status_code=502, detail="Shopify API error")
     except Exception as e:
         logger.exception("Error fetching Shopify products")
         raise HTTPException(status_code=500, detail=f"Failed to fetch products: {e}")
@@ -143,8 +53,14 @@ async def get_shopify_products() -> Dict[str, Any]:
 # 🛒  CREATE CART (supports multiple items)
 # =====================================================
 @router.post("/cart/create")
-async def create_cart(payload: dict) -> Dict[str, Any]:
-    """Creates a Shopify cart with one or more items and returns the checkout URL."""
+async def create_cart(payload: dict, request: Request) -> Dict[str, Any]:
+    """
+    Returns a checkout URL for one or more items.
+
+    With an x-session-id header the session's buy-now cart is reused and only
+    the line changes are sent (or, in "permalink" mode, a cart permalink is
+    built locally); without one a new Shopify cart is created.
+    """
     if not SHOPIFY_STOREFRONT_TOKEN:
         raise HTTPException(status_code=503, detail="Shopify token not configured")
 
@@ -152,18 +68,56 @@ async def create_cart(payload: dict) -> Dict[str, Any]:
     items = payload.get("items")
     if items and isinstance(items, list):
         # Multiple products format
-        line_items = [
-            {"quantity": item.get("quantity", 1), "merchandiseId": item["variant_id"]}
-            for item in items
-            if "variant_id" in item
-        ]
+        requested = [item for item in items if isinstance(item, dict) and "variant_id" in item]
     else:
         # Single product fallback
-        variant_id = payload.get("variant_id")
-        quantity = payload.get("quantity", 1)
-        if not variant_id:
+        if not payload.get("variant_id"):
             raise HTTPException(status_code=400, detail="variant_id or items[] is required")
-        line_items = [{"quantity": quantity, "merchandiseId": variant_id}]
+        requested = [payload]
+
+    # Validated here, so neither the reused cart nor cartCreate ever sees a null, zero or negative quantity.
+    line_items = []
+    for item in requested:
+        try:
+            quantity = line_quantity(item.get("quantity", 1))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if quantity < 1:
+            raise HTTPException(status_code=400, detail="quantity must be at least 1")
+        line_items.append({"quantity": quantity, "merchandiseId": item["variant_id"]})
+
+    attributes = payload.get("attributes")
+    if attributes is not None and not (
+        isinstance(attributes, dict) and all(isinstance(v, str) for v in attributes.values())
+    ):
+        raise HTTPException(status_code=400, detail="attributes must be an object of strings")
+    discount_codes = payload.get("discount_codes")
+    if discount_codes is not None and not (
+        isinstance(discount_codes, list) and all(isinstance(code, str) for code in discount_codes)
+    ):
+        raise HTTPException(status_code=400, detail="discount_codes must be a list of strings")
+
+    session_id = request.headers.get("x-session-id")
+    if session_id:
+        try:
+            lines = desired_lines({"variant_id": l["merchandiseId"], "quantity": l["quantity"]} for l in line_items)
+            result = await get_shopify_cart_service().checkout(
+                session_id,
+                lines,
+                mode=payload.get("mode", SHOPIFY_CHECKOUT_MODE),
+                attributes=attributes,
+                discount_codes=discount_codes,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ShopifyUserError as e:
+            raise HTTPException(status_code=400, detail=e.user_errors)
+        except ShopifyCircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+        except ShopifyError as e:
+            logger.error("Shopify cart sync failed: %s", e)
+            raise HTTPException(status_code=502, detail=f"Cart creation failed: {e}")
+        return result
 
     query = """
     mutation cartCreate($input: CartInput!) {
@@ -187,30 +141,25 @@ async def create_cart(payload: dict) -> Dict[str, Any]:
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                SHOPIFY_GRAPHQL_URL,
-                headers=shopify_headers(),
-                json={"query": query, "variables": variables},
-                timeout=20.0,
-            )
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-
-        data = response.json()
+        await get_variant_availability().require_available(to_variant_gid(l["merchandiseId"]) for l in line_items)
+        data = await get_shopify_client().storefront_graphql(query, variables, priority=Priority.CHECKOUT)
         logger.info("🛒 Shopify cartCreate response: %s", data)
 
-        user_errors = data.get("data", {}).get("cartCreate", {}).get("userErrors", [])
-        if user_errors:
-            raise HTTPException(status_code=400, detail=user_errors)
+        cart_payload = data.get("cartCreate", {})
+        raise_for_user_errors(cart_payload)
 
-        cart = data.get("data", {}).get("cartCreate", {}).get("cart", {})
+        cart = cart_payload.get("cart", {})
         if not cart or not cart.get("checkoutUrl"):
             raise HTTPException(status_code=500, detail="Cart creation failed: no checkoutUrl")
 
         return {"checkout_url": cart["checkoutUrl"], "cart_id": cart["id"]}
 
+    except ShopifyUserError as e:
+        raise HTTPException(status_code=400, detail=e.user_errors)
+    except ShopifyCircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_in) + 1)})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error creating cart")
         raise HTTPException(status_code=500, detail=f"Cart creation failed: {str(e)}")
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, HTTPException, Request
+import os
+import hmac
+import base64
+import hashlib
+import json
+import logging
+
+from services.catalog_sync import normalize_rest_product
+from services.catalog_updater import get_catalog_updater
+from services.shopify_client import build_product_gid_from_numeric
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/webhooks/shopify", tags=["webhooks"])
+
+# Webhooks created by an app are signed with the app's API secret; ones created
+# in the Shopify admin use the secret shown there.
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET") or os.getenv("SHOPIFY_API_SECRET", "")
+
+PRODUCT_UPSERT_TOPICS = {"products/create", "products/update"}
+PRODUCT_DELETE_TOPIC = "products/delete"
+
+if not SHOPIFY_WEBHOOK_SECRET:
+    logger.warning("SHOPIFY_WEBHOOK_SECRET is not set; Shopify webhooks will be rejected")
+
+
+def verify_webhook_hmac(body: bytes, signature: str) -> bool:
+    """Check X-Shopify-Hmac-Sha256 (base64 HMAC-SHA256 of the raw request body)."""
+    if not SHOPIFY_WEBHOOK_SECRET or not signature:
+        return False
+    digest = hmac.new(SHOPIFY_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+@router.post("/products")
+async def product_webhook(request: Request):
+    """
+    Receives products/create, products/update and products/delete.
+
+    Register all three topics against this URL. Events are queued for the
+    catalog updater and acknowledged immediately; Shopify retries anything
+    that doesn't get a 2xx within 5 seconds.
+    """
+    # Verify against the exact bytes Shopify signed, before any JSON parsing.
+    body = await request.body()
+    if not verify_webhook_hmac(body, request.headers.get("x-shopify-hmac-sha256", "")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    topic = request.headers.get("x-shopify-topic", "")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not valid JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Webhook body is not a JSON object")
+
+    updater = get_catalog_updater()
+    if topic in PRODUCT_UPSERT_TOPICS:
+        if not payload.get("id") and not payload.get("admin_graphql_api_id"):
+            raise HTTPException(status_code=400, detail="Product webhook has no id")
+        updater.submit_upsert(normalize_rest_product(payload))
+    elif topic == PRODUCT_DELETE_TOPIC:
+        product_id = payload.get("id")
+        if not product_id:
+            raise HTTPException(status_code=400, detail="Product webhook has no id")
+        updater.submit_delete(build_product_gid_from_numeric(product_id))
+    else:
+        logger.info("Ignoring webhook topic %s", topic)
+    return {"status": "accepted"}
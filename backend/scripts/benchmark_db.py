@@ -0,0 +1,111 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from services.database import DB_PROFILES, make_engine
+from models.cart import Base as CartBase, Cart, CartItem
+
+# Plain aiosqlite defaults: rollback journal, no pragmas (what the app ran with before profiles).
+BASELINE = {"echo": False, "pool_size": 5, "max_overflow": 10, "pragmas": {}}
+CARTS = Cart.__table__
+CART_ITEMS = CartItem.__table__
+
+
+async def cart_write(Session, session_id: str, variant: int):
+    """One cart add, shaped like CartService.add_item_to_cart: cart upsert + line upsert in one transaction."""
+    now = datetime.utcnow()
+    async with Session() as session:
+        async with session.begin():
+            cart_insert = sqlite_insert(CARTS).values(session_id=session_id, created_at=now, updated_at=now, version=1)
+            cart_id = (await session.execute(
+                cart_insert.on_conflict_do_update(
+                    index_elements=[CARTS.c.session_id],
+                    set_={"updated_at": now, "version": func.coalesce(CARTS.c.version, 0) + 1},
+                ).returning(CARTS.c.id)
+            )).scalar_one()
+            line_insert = sqlite_insert(CART_ITEMS).values(
+                cart_id=cart_id, product_id="gid://shopify/Product/1",
+                variant_id=f"gid://shopify/ProductVariant/{variant}", name="Bench", price=9.99,
+                quantity=1, created_at=now, updated_at=now,
+            )
+            await session.execute(line_insert.on_conflict_do_update(
+                index_elements=[CART_ITEMS.c.cart_id, CART_ITEMS.c.variant_id],
+                set_={"quantity": CART_ITEMS.c.quantity + 1, "updated_at": now},
+            ))
+
+
+async def cart_read(Session, session_id: str):
+    async with Session() as session:
+        cart = (await session.execute(select(Cart).where(Cart.session_id == session_id))).scalars().first()
+        return cart.items if cart is not None else []
+
+
+async def run_profile(name: str, settings: dict, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"db-bench-{name}-")
+    engine = make_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}", {**settings, "echo": False})
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(CartBase.metadata.create_all)
+
+    sessions = [f"bench-{n}" for n in range(args.carts)]
+    rng = random.Random(42)
+    counts = {"writes": 0, "reads": 0}
+
+    async def worker():
+        for _ in range(args.ops):
+            session_id = rng.choice(sessions)
+            if rng.random() < args.write_ratio:
+                await cart_write(Session, session_id, rng.randrange(20))
+                counts["writes"] += 1
+            else:
+                await cart_read(Session, session_id)
+                counts["reads"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return {
+        "profile": name,
+        "seconds": elapsed,
+        "ops_per_second": (counts["writes"] + counts["reads"]) / elapsed,
+        "writes_per_second": counts["writes"] / elapsed,
+        "reads_per_second": counts["reads"] / elapsed,
+    }
+
+
+async def main(args):
+    profiles = {"baseline": BASELINE, **DB_PROFILES}
+    names = args.profiles.split(",") if args.profiles else list(profiles)
+    results = []
+    for name in names:
+        results.append(await run_profile(name, profiles[name], args))
+        print(f"   {name}: {results[-1]['ops_per_second']:.0f} ops/s")
+
+    print(f"📊 {args.concurrency} workers x {args.ops} ops, {args.write_ratio:.0%} writes, {args.carts} carts "
+          "(statement logging off in every profile)")
+    print(f"{'profile':<10} {'ops/s':>10} {'writes/s':>10} {'reads/s':>10} {'seconds':>9}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['ops_per_second']:>10.0f} {r['writes_per_second']:>10.0f} "
+              f"{r['reads_per_second']:>10.0f} {r['seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cart read/write throughput across database profiles.")
+    parser.add_argument("--profiles", help="comma-separated profiles (default: baseline and every DB_PROFILES entry)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="operations per worker")
+    parser.add_argument("--write-ratio", type=float, default=0.5)
+    parser.add_argument("--carts", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import subprocess
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PRODUCT_ID = "gid://shopify/Product/900001"
+VARIANT_IDS = [f"gid://shopify/ProductVariant/9000{n:02d}" for n in range(1, 4)]
+
+
+async def seed(database_url: str):
+    """Fresh database with one product and a few variants to add to carts."""
+    os.environ["DATABASE_URL"] = database_url
+    from services.catalog_store import save_products
+    from services.database import engine, init_db, read_engine, write_engine
+    from services.db_writer import get_db_writer
+
+    engine.echo = False
+    try:
+        await init_db()
+        await save_products([{
+            "shopify_id": PRODUCT_ID,
+            "name": "Concurrency Check Tee",
+            "description": "",
+            "price": 10.0,
+            "variants": [
+                {"shopify_id": gid, "title": f"Size {n}", "price": 10.0, "available": True}
+                for n, gid in enumerate(VARIANT_IDS, 1)
+            ],
+        }])
+    finally:
+        # Every pool make_engine opened for this URL, or aiosqlite's threads keep the process alive.
+        await get_db_writer().stop()
+        for db_engine in {engine, read_engine, write_engine}:
+            await db_engine.dispose()
+
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("server did not come up")
+
+
+async def fire(base_url: str, requests: int, concurrency: int, batch_every: int):
+    """Send concurrent adds (every `batch_every`-th one through the batch endpoint) to one cart."""
+    session_id = f"concurrency-{int(time.time())}"
+    headers = {"x-session-id": session_id}
+    expected = {gid: 0 for gid in VARIANT_IDS}
+    statuses = {}
+    limit = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_until_up(client)
+
+        async def add(n: int):
+            gid = VARIANT_IDS[n % len(VARIANT_IDS)]
+            async with limit:
+                if batch_every and n % batch_every == 0:
+                    ops = [{"op": "add", "variant_id": gid, "quantity": 1}, {"op": "add", "variant_id": gid, "quantity": 1}]
+                    response = await client.post("/api/cart/items/batch", json={"operations": ops}, headers=headers)
+                    amount = 2
+                else:
+                    body = {"product_id": PRODUCT_ID, "variant_id": gid, "quantity": 1}
+                    response = await client.post("/api/cart/items", json=body, headers=headers)
+                    amount = 1
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                expected[gid] += amount
+
+        started = time.perf_counter()
+        await asyncio.gather(*(add(n) for n in range(requests)))
+        elapsed = time.perf_counter() - started
+        cart = (await client.get(f"/api/cart/items/{session_id}")).json()["cart"]
+
+    actual = {item["variant_id"]: item["quantity"] for item in cart["items"]}
+    return expected, actual, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fire concurrent cart adds at several uvicorn workers and check no quantity is lost."
+    )
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--requests", type=int, default=400, help="add requests to send")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at once")
+    parser.add_argument("--batch-every", type=int, default=5, help="send every Nth add through /items/batch (0: never)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cart-concurrency-")
+    database_url = f"sqlite+aiosqlite:///{os.path.join(workdir, 'carts.db')}"
+    asyncio.run(seed(database_url))
+
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SHOPIFY_STORE": os.getenv("SHOPIFY_STORE", "127.0.0.1:9"),
+        "SHOPIFY_ACCESS_TOKEN": os.getenv("SHOPIFY_ACCESS_TOKEN", "check"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(workdir, "server.log"), "w"),
+    )
+    try:
+        expected, actual, statuses, elapsed = asyncio.run(
+            fire(f"http://127.0.0.1:{args.port}", args.requests, args.concurrency, args.batch_every)
+        )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    print(f"📊 {args.requests} requests over {args.workers} workers in {elapsed:.2f}s, statuses: {statuses}")
+    lost = {gid: (qty, actual.get(gid, 0)) for gid, qty in expected.items() if actual.get(gid, 0) != qty}
+    if lost:
+        for gid, (want, got) in lost.items():
+            print(f"❌ {gid}: expected {want}, cart has {got}")
+        print(f"   server log: {os.path.join(workdir, 'server.log')}")
+        sys.exit(1)
+    print(f"✅ No lost updates: {sum(expected.values())} units across {len(expected)} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+"""
+Local stand-in for the parts of Shopify this backend talks to, for offline load tests.
+
+Serves the Admin GraphQL, Storefront GraphQL and Admin REST endpoints at the
+same paths Shopify uses, with configurable latency, error injection, leaky
+bucket throttling (with cost reporting) and a delay before new products
+become visible to the Storefront API. Point the backend at it with:
+
+    SHOPIFY_STORE=http://127.0.0.1:8900 SHOPIFY_ACCESS_TOKEN=sim SHOPIFY_STOREFRONT_TOKEN=sim
+
+Operations are matched on their root field, not parsed as GraphQL, so only the
+queries this codebase sends are understood. Responses include a superset of the
+fields those queries select.
+"""
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+ADMIN_GRAPHQL = "/admin/api/{version}/graphql.json"
+STOREFRONT_GRAPHQL = "/api/{version}/graphql.json"
+
+
+# ------------------------------------------------------------------
+# Behaviour knobs
+# ------------------------------------------------------------------
+@dataclass
+class SimConfig:
+    products: int = 200
+    variants: int = 3
+    latency_ms: float = 60.0          # median of a lognormal per-request latency
+    latency_sigma: float = 0.5        # 0 = fixed latency; ~1 gives a heavy tail
+    error_rate: float = 0.0           # share of requests answered with a 503
+    admin_bucket: float = 1000.0
+    max_query_cost: int = 1000        # single-query limit; more is answered with MAX_COST_EXCEEDED
+    admin_restore: float = 50.0
+    rest_bucket: float = 40.0
+    rest_restore: float = 2.0
+    storefront_delay: float = 5.0     # seconds from publish until the Storefront API sees a product
+    auto_publish: bool = True         # productCreate publishes immediately (no SHOPIFY_ONLINE_CHANNEL_ID needed)
+    bulk_seconds: float = 3.0         # how long a bulk operation stays RUNNING
+    seed: int = 1
+
+
+class Bucket:
+    """Shopify-style leaky bucket: `take()` fails instead of waiting."""
+
+    def __init__(self, capacity: float, restore_rate: float):
+        self.capacity = capacity
+        self.restore_rate = restore_rate
+        self.available = capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.restore_rate)
+        self.updated = now
+        return self.available
+
+    def take(self, cost: float) -> bool:
+        if self.refill() < cost:
+            return False
+        self.available -= cost
+        return True
+
+    def refund(self, amount: float):
+        self.available = min(self.capacity, self.available + amount)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@dataclass
+class SimProduct:
+    id: int
+    title: str
+    handle: str
+    description: str
+    variants: List[Dict[str, Any]]
+    images: List[str]
+    created_at: datetime
+    updated_at: datetime
+    visible_at: Optional[datetime] = None   # Storefront visibility; None = unpublished
+    status: str = "ACTIVE"                  # Admin status: ACTIVE, DRAFT or ARCHIVED
+
+    def gid(self) -> str:
+        return f"gid://shopify/Product/{self.id}"
+
+    def storefront_visible(self) -> bool:
+        return self.status == "ACTIVE" and self.visible_at is not None and _now() >= self.visible_at
+
+
+@dataclass
+class SimState:
+    config: SimConfig
+    products: Dict[int, SimProduct] = field(default_factory=dict)
+    variant_index: Dict[int, Tuple[SimProduct, Dict[str, Any]]] = field(default_factory=dict)
+    carts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    bulk_ops: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    next_id: int = 1000
+    stats: Dict[str, int] = field(default_factory=lambda: {"requests": 0, "throttled": 0, "errors": 0})
+
+    def new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def add_product(self, title: str, price: float, variants: int = 1, description: str = "", visible_at=None) -> SimProduct:
+        now = _now()
+        pid = self.new_id()
+        product = SimProduct(
+            id=pid,
+            title=title,
+            handle=re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-") or str(pid),
+            description=description,
+            variants=[],
+            images=[f"https://cdn.example.com/{pid}.png"],
+            created_at=now,
+            updated_at=now,
+            visible_at=visible_at,
+        )
+        for n in range(variants):
+            variant = {"id": self.new_id(), "title": "Default Title" if variants == 1 else f"Size {n + 1}",
+                       "price": f"{price:.2f}", "available": True}
+            product.variants.append(variant)
+            self.variant_index[variant["id"]] = (product, variant)
+        self.products[pid] = product
+        return product
+
+    def seed(self):
+        rng = random.Random(self.config.seed)
+        start = _now() - timedelta(days=30)
+        for n in range(self.config.products):
+            product = self.add_product(f"DTF Transfer {n + 1}", rng.choice([4.99, 9.99, 14.5, 24.0]),
+                                       self.config.variants, "Seeded product", visible_at=start)
+            product.created_at = product.updated_at = start + timedelta(minutes=n)
+
+
+# ------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------
+def _numeric(gid: Any) -> int:
+    return int(str(gid).rsplit("/", 1)[-1])
+
+
+def _root_field(query: str) -> str:
+    """Name of the first field inside the operation's selection set."""
+    match = re.match(r"\s*(\w+)", query[query.index("{") + 1:]) if "{" in query else None
+    return match.group(1) if match else ""
+
+
+def _updated_since(search: Optional[str]) -> Optional[datetime]:
+    match = re.search(r"updated_at:>'?([0-9T:\-]+Z?)'?", search or "")
+    if not match:
+        return None
+    return datetime.fromisoformat(match.group(1).replace("Z", "+00:00"))
+
+
+def _page(products: List[SimProduct], first: int, after: Optional[str]) -> Tuple[List[SimProduct], Dict[str, Any]]:
+    start = int(after) if after else 0
+    chunk = products[start:start + first]
+    end = start + len(chunk)
+    return chunk, {"hasNextPage": end < len(products), "endCursor": str(end) if chunk else after}
+
+
+def _graphql_error(message: str, code: str, cost: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    body: Dict[str, Any] = {"errors": [{"message": message, "extensions": {"code": code}}]}
+    if cost:
+        body["extensions"] = {"cost": cost}
+    return body
+
+
+# ------------------------------------------------------------------
+# App
+# ------------------------------------------------------------------
+def create_app(config: Optional[SimConfig] = None) -> FastAPI:
+    config = config or SimConfig()
+    state = SimState(config)
+    state.seed()
+    admin_bucket = Bucket(config.admin_bucket, config.admin_restore)
+    rest_bucket = Bucket(config.rest_bucket, config.rest_restore)
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Shopify simulator")
+    app.state.sim = state
+
+    @app.middleware("http")
+    async def latency_and_faults(request: Request, call_next):
+        if request.url.path.startswith("/sim/"):
+            return await call_next(request)
+        state.stats["requests"] += 1
+        median = config.latency_ms / 1000.0
+        if median > 0:
+            await asyncio.sleep(median * math.exp(rng.gauss(0, config.latency_sigma)) if config.latency_sigma else median)
+        if config.error_rate and rng.random() < config.error_rate:
+            state.stats["errors"] += 1
+            return JSONResponse({"errors": "Service Unavailable"}, status_code=503)
+        return await call_next(request)
+
+    # --- variant / product shapes ---
+    def admin_variant(v):
+        return {"id": f"gid://shopify/ProductVariant/{v['id']}", "title": v["title"], "price": v["price"],
+                "availableForSale": v["available"]}
+
+    def storefront_variant(p, v):
+        return {"id": f"gid://shopify/ProductVariant/{v['id']}", "title": v["title"],
+                "price": {"amount": v["price"], "currencyCode": "USD"},
+                "availableForSale": v["available"], "product": {"id": p.gid()}}
+
+    def product_node(p, variants_first, images_first, storefront=False):
+        variant_nodes = [storefront_variant(p, v) if storefront else admin_variant(v) for v in p.variants]
+        return {
+            "id": p.gid(), "title": p.title, "handle": p.handle, "description": p.description,
+            "updatedAt": _iso(p.updated_at), "status": p.status, "publishedOnPublication": p.visible_at is not None,
+            "images": {"nodes": [{"url": u} for u in p.images[:images_first]]},
+            "variants": {
+                "pageInfo": {"hasNextPage": len(variant_nodes) > variants_first, "endCursor": str(variants_first)},
+                "nodes": variant_nodes[:variants_first],
+                "edges": [{"node": n} for n in variant_nodes[:variants_first]],
+            },
+        }
+
+    def variant_page(p, v, storefront=False):
+        """product(id) { variants(first, after) } for the follow-up variant pages."""
+        chunk, page_info = _page(p.variants, int(v.get("first", 10)), v.get("after"))
+        nodes = [storefront_variant(p, x) if storefront else admin_variant(x) for x in chunk]
+        return {"id": p.gid(), "variants": {"pageInfo": page_info, "nodes": nodes, "edges": [{"node": n} for n in nodes]}}
+
+    def product_list(search: Optional[str], storefront: bool) -> List[SimProduct]:
+        since = _updated_since(search)
+        products = [p for p in state.products.values()
+                    if (not storefront or p.storefront_visible()) and (since is None or p.updated_at > since)]
+        return sorted(products, key=lambda p: (p.updated_at, p.id))
+
+    def cart_json(cart_id: str, base: str) -> Dict[str, Any]:
+        cart = state.carts[cart_id]
+        return {
+            "id": cart_id,
+            "checkoutUrl": f"{base}/checkouts/cn/{cart['token']}",
+            "lines": {"nodes": [
+                {"id": line_id, "quantity": qty, "merchandise": {"id": f"gid://shopify/ProductVariant/{vid}"}}
+                for line_id, (vid, qty) in cart["lines"].items()
+            ]},
+        }
+
+    def check_merchandise(lines) -> List[Dict[str, Any]]:
+        errors = []
+        for n, line in enumerate(lines):
+            entry = state.variant_index.get(_numeric(line["merchandiseId"]))
+            if entry is None or not entry[0].storefront_visible():
+                errors.append({"field": ["input", "lines", str(n), "merchandiseId"],
+                               "message": "The merchandise with id %s does not exist." % line["merchandiseId"]})
+            elif not entry[1]["available"]:
+                errors.append({"field": ["input", "lines", str(n), "quantity"],
+                               "message": "The product is already sold out."})
+        return errors
+
+    # --- Admin GraphQL ---
+    def admin_cost(root: str, variables: Dict[str, Any]) -> int:
+        """Requested cost as Shopify computes it: a connection is 2 + first x (cost of one node)."""
+        if root == "products":
+            node = 1 + (2 + int(variables.get("variantsFirst", 100))) + (2 + int(variables.get("imagesFirst", 10)))
+            return 2 + int(variables.get("first", 50)) * node
+        if root == "product":
+            return 1 + 2 + int(variables.get("first", 0))
+        if root == "deletionEvents":
+            return 2 + int(variables.get("first", 0))
+        if root == "node":
+            return 1
+        return 10
+
+    def admin_resolve(root: str, v: Dict[str, Any], base: str) -> Dict[str, Any]:
+        if root == "productCreate":
+            data = v["input"]
+            product = state.add_product(data.get("title") or "Untitled", 0.0, 1, data.get("descriptionHtml") or "")
+            if config.auto_publish:
+                product.visible_at = _now() + timedelta(seconds=config.storefront_delay)
+            return {"productCreate": {"product": {"id": product.gid(), "title": product.title, "handle": product.handle,
+                                                  "status": "ACTIVE"}, "userErrors": []}}
+        if root == "publishablePublish":
+            product = state.products.get(_numeric((v.get("input") or v).get("id") or v.get("productId")))
+            if product is None:
+                return {"publishablePublish": {"userErrors": [{"field": ["id"], "message": "Product not found"}]}}
+            if product.visible_at is None:
+                product.visible_at = _now() + timedelta(seconds=config.storefront_delay)
+            return {"publishablePublish": {"userErrors": []}}
+        if root == "product":
+            product = state.products.get(_numeric(v["id"]))
+            return {"product": variant_page(product, v) if product else None}
+        if root == "products":
+            chunk, page_info = _page(product_list(v.get("query"), False), int(v.get("first", 50)), v.get("after"))
+            nodes = [product_node(p, int(v.get("variantsFirst", 100)), int(v.get("imagesFirst", 10))) for p in chunk]
+            return {"products": {"pageInfo": page_info, "nodes": nodes}}
+        if root == "deletionEvents":
+            return {"deletionEvents": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "nodes": []}}
+        if root == "bulkOperationRunQuery":
+            op_id = f"gid://shopify/BulkOperation/{state.new_id()}"
+            state.bulk_ops[op_id] = {"started": time.monotonic(), "query": v.get("query", "")}
+            return {"bulkOperationRunQuery": {"bulkOperation": {"id": op_id, "status": "CREATED"}, "userErrors": []}}
+        if root == "node":
+            op = state.bulk_ops.get(v["id"])
+            if op is None:
+                return {"node": None}
+            done = time.monotonic() - op["started"] >= config.bulk_seconds
+            return {"node": {
+                "id": v["id"], "status": "COMPLETED" if done else "RUNNING", "errorCode": None,
+                "objectCount": str(sum(1 + len(p.images) + len(p.variants) for p in state.products.values())),
+                "url": f"{base}/sim/bulk/{_numeric(v['id'])}.jsonl" if done else None, "partialDataUrl": None,
+            }}
+        raise KeyError(root)
+
+    @app.post(ADMIN_GRAPHQL)
+    async def admin_graphql(version: str, request: Request):
+        body = await request.json()
+        query, variables = body.get("query", ""), body.get("variables") or {}
+        root = _root_field(query)
+        cost = admin_cost(root, variables)
+        throttle = {"maximumAvailable": admin_bucket.capacity, "restoreRate": admin_bucket.restore_rate}
+        if cost > config.max_query_cost:
+            state.stats["errors"] += 1
+            return _graphql_error(
+                f"Query cost is {cost}, which exceeds the single query max cost limit ({config.max_query_cost}).",
+                "MAX_COST_EXCEEDED",
+                {"requestedQueryCost": cost, "actualQueryCost": None,
+                 "throttleStatus": {**throttle, "currentlyAvailable": int(admin_bucket.available)}},
+            )
+        if not admin_bucket.take(cost):
+            state.stats["throttled"] += 1
+            return _graphql_error("Throttled", "THROTTLED", {
+                "requestedQueryCost": cost, "actualQueryCost": None,
+                "throttleStatus": {**throttle, "currentlyAvailable": int(admin_bucket.available)},
+            })
+        try:
+            data = admin_resolve(root, variables, str(request.base_url).rstrip("/"))
+        except KeyError:
+            admin_bucket.refund(cost)
+            return _graphql_error(f"Simulator does not handle '{root}'", "UNSUPPORTED")
+        actual = max(1, cost // 2) if root == "products" else cost
+        admin_bucket.refund(cost - actual)
+        return {"data": data, "extensions": {"cost": {
+            "requestedQueryCost": cost, "actualQueryCost": actual,
+            "throttleStatus": {**throttle, "currentlyAvailable": int(admin_bucket.available)},
+        }}}
+
+    @app.get("/sim/bulk/{op_id}.jsonl")
+    async def bulk_result(op_id: int):
+        def lines():
+            for p in sorted(state.products.values(), key=lambda p: p.id):
+                yield json.dumps({"id": p.gid(), "title": p.title, "handle": p.handle,
+                                  "description": p.description, "updatedAt": _iso(p.updated_at),
+                                  "status": p.status, "publishedOnPublication": p.visible_at is not None}) + "\n"
+                for url in p.images:
+                    yield json.dumps({"url": url, "__parentId": p.gid()}) + "\n"
+                for v in p.variants:
+                    yield json.dumps({**admin_variant(v), "__parentId": p.gid()}) + "\n"
+        return StreamingResponse(lines(), media_type="application/jsonl")
+
+    # --- Storefront GraphQL ---
+    @app.post(STOREFRONT_GRAPHQL)
+    async def storefront_graphql(version: str, request: Request):
+        body = await request.json()
+        query, v = body.get("query", ""), body.get("variables") or {}
+        root = _root_field(query)
+        base = str(request.base_url).rstrip("/")
+
+        if root == "products":
+            chunk, page_info = _page(product_list(v.get("query"), True), int(v.get("first", 50)), v.get("after"))
+            nodes = [product_node(p, int(v.get("variantsFirst", 100)), int(v.get("imagesFirst", 10)), True) for p in chunk]
+            return {"data": {"products": {"pageInfo": page_info, "nodes": nodes}}}
+        if root == "product":
+            product = state.products.get(_numeric(v["id"]))
+            visible = product is not None and product.storefront_visible()
+            return {"data": {"product": variant_page(product, v, True) if visible else None}}
+        if root in ("node", "nodes"):
+            ids = [v["id"]] if root == "node" else v.get("ids", [])
+            found = []
+            for gid in ids:
+                entry = state.variant_index.get(_numeric(gid)) if "ProductVariant" in str(gid) else None
+                found.append(storefront_variant(*entry) if entry and entry[0].storefront_visible() else None)
+            return {"data": {root: found[0] if root == "node" else found}}
+        if root == "cart":
+            return {"data": {"cart": cart_json(v["id"], base) if v.get("id") in state.carts else None}}
+        if root == "cartCreate":
+            lines = (v.get("input") or {}).get("lines", [])
+            errors = check_merchandise(lines)
+            if errors:
+                return {"data": {"cartCreate": {"cart": None, "userErrors": errors}}}
+            cart_id = f"gid://shopify/Cart/{uuid.uuid4().hex}"
+            state.carts[cart_id] = {"token": uuid.uuid4().hex, "lines": {}}
+            for line in lines:
+                state.carts[cart_id]["lines"][f"gid://shopify/CartLine/{uuid.uuid4().hex}"] = (
+                    _numeric(line["merchandiseId"]), int(line.get("quantity", 1)))
+            return {"data": {"cartCreate": {"cart": cart_json(cart_id, base), "userErrors": []}}}
+        if root in ("cartLinesAdd", "cartLinesUpdate", "cartLinesRemove"):
+            cart = state.carts.get(v.get("cartId"))
+            if cart is None:
+                return {"data": {root: {"cart": None, "userErrors": [
+                    {"field": ["cartId"], "message": "The specified cart does not exist."}]}}}
+            if root == "cartLinesAdd":
+                errors = check_merchandise(v.get("lines", []))
+                if errors:
+                    return {"data": {root: {"cart": None, "userErrors": errors}}}
+                for line in v.get("lines", []):
+                    cart["lines"][f"gid://shopify/CartLine/{uuid.uuid4().hex}"] = (
+                        _numeric(line["merchandiseId"]), int(line.get("quantity", 1)))
+            elif root == "cartLinesUpdate":
+                for line in v.get("lines", []):
+                    if line["id"] in cart["lines"]:
+                        cart["lines"][line["id"]] = (cart["lines"][line["id"]][0], int(line["quantity"]))
+            else:
+                for line_id in v.get("lineIds", []):
+                    cart["lines"].pop(line_id, None)
+            return {"data": {root: {"cart": cart_json(v["cartId"], base), "userErrors": []}}}
+        return _graphql_error(f"Simulator does not handle '{root}'", "UNSUPPORTED")
+
+    # --- Admin REST ---
+    def rest_response(payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+        used = math.ceil(rest_bucket.capacity - rest_bucket.refill())
+        headers = {**(headers or {}), "X-Shopify-Shop-Api-Call-Limit": f"{used}/{int(rest_bucket.capacity)}"}
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    def rest_throttled() -> Optional[Response]:
+        if rest_bucket.take(1):
+            return None
+        state.stats["throttled"] += 1
+        return JSONResponse({"errors": "Exceeded 2 calls per second for api client. Reduce request rates to resume uninterrupted service."},
+                            status_code=429, headers={"Retry-After": "1.0"})
+
+    def rest_product(p: SimProduct) -> Dict[str, Any]:
+        return {
+            "id": p.id, "admin_graphql_api_id": p.gid(), "title": p.title, "handle": p.handle,
+            "body_html": p.description, "updated_at": _iso(p.updated_at),
+            "status": p.status.lower(), "published_at": _iso(p.visible_at) if p.visible_at else None,
+            "images": [{"src": u} for u in p.images],
+            "variants": [{"id": v["id"], "admin_graphql_api_id": f"gid://shopify/ProductVariant/{v['id']}",
+                          "title": v["title"], "price": v["price"], "inventory_management": None} for v in p.variants],
+        }
+
+    @app.get("/admin/api/{version}/products.json")
+    async def rest_products(version: str, request: Request, limit: int = 50, page_info: Optional[str] = None):
+        throttled = rest_throttled()
+        if throttled:
+            return throttled
+        chunk, info = _page(product_list(None, False), min(limit, 250), page_info)
+        headers = {}
+        if info["hasNextPage"]:
+            url = str(request.url.include_query_params(limit=limit, page_info=info["endCursor"]))
+            headers["Link"] = f'<{url}>; rel="next"'
+        return rest_response({"products": [rest_product(p) for p in chunk]}, headers=headers)
+
+    @app.get("/admin/api/{version}/products/{product_id}/variants.json")
+    async def rest_list_variants(version: str, product_id: int):
+        throttled = rest_throttled()
+        if throttled:
+            return throttled
+        product = state.products.get(product_id)
+        if product is None:
+            return rest_response({"errors": "Not Found"}, status=404)
+        return rest_response({"variants": rest_product(product)["variants"]})
+
+    @app.post("/admin/api/{version}/products/{product_id}/variants.json")
+    async def rest_create_variant(version: str, product_id: int, request: Request):
+        throttled = rest_throttled()
+        if throttled:
+            return throttled
+        product = state.products.get(product_id)
+        if product is None:
+            return rest_response({"errors": "Not Found"}, status=404)
+        data = (await request.json()).get("variant") or {}
+        variant = {"id": state.new_id(), "title": data.get("option1") or "Default Title",
+                   "price": str(data.get("price", "0.00")), "available": True}
+        product.variants.append(variant)
+        product.updated_at = _now()
+        state.variant_index[variant["id"]] = (product, variant)
+        return rest_response({"variant": {"id": variant["id"], "title": variant["title"], "price": variant["price"]}},
+                             status=201)
+
+    # --- simulator controls ---
+    @app.get("/sim/stats")
+    async def sim_stats():
+        return {**state.stats, "products": len(state.products), "carts": len(state.carts),
+                "admin_bucket_available": round(admin_bucket.refill(), 1)}
+
+    @app.post("/sim/variants/{variant_id}")
+    async def sim_set_variant(variant_id: int, available: bool = True):
+        """Flip a variant's availableForSale, e.g. to exercise sold-out checkouts."""
+        entry = state.variant_index.get(variant_id)
+        if entry is None:
+            return JSONResponse({"errors": "Not Found"}, status_code=404)
+        entry[1]["available"] = available
+        entry[0].updated_at = _now()
+        return {"id": variant_id, "available": available}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    defaults = SimConfig()
+    for name, value in vars(defaults).items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            parser.add_argument(flag, type=lambda s: s.lower() in ("1", "true", "yes"), default=value)
+        else:
+            parser.add_argument(flag, type=type(value), default=value)
+    args = parser.parse_args()
+    config = SimConfig(**{name: getattr(args, name) for name in vars(defaults)})
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
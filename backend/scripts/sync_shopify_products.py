@@ -1,77 +1,106 @@
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import requests
+import argparse
 import asyncio
-from sqlalchemy import select
-from services.database import SessionLocal
-from models.product import Product
+from services.bulk_sync import BULK_BATCH_SIZE, run_bulk_sync
+from services.catalog_sync import (
+    PRODUCT_PAGE_SIZE,
+    REST_PAGE_SIZE,
+    SYNC_TRANSFORM_WORKERS,
+    SYNC_WRITE_BATCH_SIZE,
+    run_rest_sync,
+    run_sync,
+)
+from services.database import engine, init_db, read_engine, write_engine
+from services.db_writer import get_db_writer
+from services.shopify_client import ShopifyError, close_shopify_client, get_shopify_client
 
-SHOPIFY_STORE = "presmtechnologies.myshopify.com"
-SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
+MODES = ("delta", "full", "rest", "bulk")
 
 
-async def sync_shopify_products():
-    """Fetch all products from Shopify and store/update them in the local DB."""
-    url = f"https://{SHOPIFY_STORE}/admin/api/2024-10/products.json?limit=250"
-    headers = {
-        "X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN,
-        "Content-Type": "application/json"
-    }
+async def sync_shopify_products(
+    mode: str = "delta",
+    concurrency: int = SYNC_TRANSFORM_WORKERS,
+    batch_size: int = SYNC_WRITE_BATCH_SIZE,
+    prefetch: int = 2,
+    page_size: int = None,
+    resume: bool = True,
+):
+    """
+    Sync products from Shopify into the local DB.
 
-    print("📦 Fetching products from Shopify...")
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        print("❌ Failed to fetch products:", response.text)
-        return
+    delta (default): only products changed since the last run, plus deletions.
+    full: every product; local rows missing from Shopify are tombstoned.
+    rest: every product through the REST API (no watermark, no tombstones).
+    bulk: like full, but through a single bulk operation streamed as JSONL.
 
-    products = response.json().get("products", [])
-    if not products:
-        print("⚠️ No products found in Shopify store.")
+    delta, full and rest resume from the last committed page of an interrupted run.
+    """
+    print(f"📦 Fetching products from Shopify ({mode})...")
+    client = get_shopify_client()
+    usage_before = dict(client.usage)
+    pipeline = {"workers": concurrency, "batch_size": batch_size, "prefetch": prefetch, "resume": resume}
+    try:
+        if mode == "bulk":
+            stats = await run_bulk_sync(batch_size=batch_size or BULK_BATCH_SIZE, workers=concurrency)
+        elif mode == "rest":
+            stats = await run_rest_sync(page_size=page_size or REST_PAGE_SIZE, **pipeline)
+        else:
+            stats = await run_sync(mode, page_size=page_size or PRODUCT_PAGE_SIZE, **pipeline)
+    except ShopifyError as e:
+        print("❌ Failed to fetch products:", e)
         return
 
-    async with SessionLocal() as session:
-        async with session.begin():
-            for p in products:
-                result = await session.execute(select(Product).where(Product.shopify_id == str(p["id"])))
-                existing = result.scalars().first()
+    if not stats["products"] and not stats.get("deleted"):
+        print("⚠️ No product changes found in Shopify store.")
+        return
+    print(
+        f"✅ Synced {stats['products']} products from Shopify in {stats['pages']} pages "
+        f"({stats['seconds']}s), {stats.get('deleted', 0)} tombstoned."
+    )
+    usage = {key: client.usage[key] - usage_before[key] for key in usage_before}
+    seconds = max(stats["seconds"], 0.001)
+    print(
+        f"📊 {stats['products'] / seconds:.1f} products/s | {usage['requests']} requests | "
+        f"{usage['bytes'] / 1024:.1f} KiB downloaded | API cost {usage['query_cost']:.0f} | "
+        f"{stats.get('batches', stats['pages'])} write transactions"
+    )
 
-                variants_data = [
-                    {
-                        "shopify_id": v["id"],
-                        "title": v["title"],
-                        "price": v["price"]
-                    }
-                    for v in p.get("variants", [])
-                ]
 
-                # ✅ Safely determine product price
-                product_price = None
-                if p.get("variants"):
-                    product_price = p["variants"][0].get("price")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync products from Shopify into the local DB.")
+    parser.add_argument("mode", nargs="?", default="delta", choices=MODES)
+    parser.add_argument("--concurrency", type=int, default=SYNC_TRANSFORM_WORKERS,
+                        help="pages transformed into rows in parallel")
+    parser.add_argument("--batch-size", type=int, default=SYNC_WRITE_BATCH_SIZE,
+                        help="minimum rows per write transaction (0 = one page each; bulk: products per page)")
+    parser.add_argument("--prefetch", type=int, default=2, help="pages fetched ahead of the writer")
+    parser.add_argument("--page-size", type=int, default=None, help="products per Shopify request")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="start over instead of continuing an interrupted run")
+    return parser.parse_args(argv)
 
-                if existing:
-                    existing.name = p["title"]
-                    existing.description = p.get("body_html", "")
-                    existing.image = p.get("image", {}).get("src")
-                    existing.variants = variants_data
-                    existing.price = product_price or 0.00
-                    print(f"🔁 Updated: {p['title']}")
-                else:
-                    product_obj = Product(
-                        shopify_id=str(p["id"]),
-                        name=p["title"],
-                        description=p.get("body_html", ""),
-                        image=p.get("image", {}).get("src"),
-                        price=product_price or 0.00,  # ✅ fallback default
-                        variants=variants_data
-                    )
-                    session.add(product_obj)
-                    print(f"🆕 Added: {p['title']}")
 
-        await session.commit()
-        print(f"✅ Synced {len(products)} products from Shopify.")
+async def main():
+    args = parse_args()
+    try:
+        await init_db()
+        await sync_shopify_products(
+            args.mode,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            prefetch=args.prefetch,
+            page_size=args.page_size,
+            resume=args.resume,
+        )
+    finally:
+        await close_shopify_client()
+        # Writes queued by the pipeline first; then the pools, or aiosqlite's threads can hang exit.
+        await get_db_writer().stop()
+        for db_engine in {engine, read_engine, write_engine}:
+            await db_engine.dispose()
 
 
 if __name__ == "__main__":
-    asyncio.run(sync_shopify_products())
+    asyncio.run(main())
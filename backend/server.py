@@ -1,11 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from services.database import init_db, SessionLocal
+from services.database import DB_PROFILE, get_session, init_db
+from services.db_writer import get_db_writer
 from routes.shopify import router as shopify_router
 from routes.cart import router as cart_router
 from models.product import Product
-from routes.gang_sheets import router as gang_router
+from routes.gang_sheets import router as gang_router, close_gang_sheet_http
+from routes.webhooks import router as webhooks_router
+from services.idempotency_service import get_idempotency_service
+from services.catalog_updater import get_catalog_updater
+from services.cart_expiry import get_cart_expiry
+from services.pricing import get_pricing_engine
+from services.cart_service import CART_BACKEND, get_cart_service
+from services.catalog_cache import get_catalog_cache
+from services.shopify_cart_service import get_shopify_cart_service
+from services.variant_availability import get_variant_availability
+from services.shopify_client import init_shopify_client, close_shopify_client
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
@@ -47,15 +59,41 @@ app.add_middleware(
 app.include_router(shopify_router, prefix="/api")
 app.include_router(cart_router)
 app.include_router(gang_router)
+app.include_router(webhooks_router)
 # --- Startup event ---
 @app.on_event("startup")
 async def startup_event():
     try:
         await init_db()
-        logger.info("✅ SQLite database initialized successfully")
+        logger.info(f"✅ SQLite database initialized successfully ({DB_PROFILE} profile)")
+        get_db_writer().start()
+        await get_pricing_engine().load()
+        await get_variant_availability().load()
+        purged = await get_idempotency_service().purge_expired()
+        if purged:
+            logger.info(f"🧹 Purged {purged} expired idempotency keys")
     except Exception as e:
         logger.error(f"❌ Failed to initialize SQLite database: {e}")
         raise
+    await init_shopify_client()
+    get_catalog_updater().start()
+    get_cart_expiry().start()
+    if CART_BACKEND == "memory":
+        get_cart_service().start()
+
+# --- Shutdown event ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    await get_catalog_updater().stop()
+    await get_cart_expiry().stop()
+    if CART_BACKEND == "memory":
+        await get_cart_service().stop()
+    await get_catalog_cache().close()
+    await get_shopify_cart_service().stop()
+    # Last: the jobs above may still be handing it writes.
+    await get_db_writer().stop()
+    await close_shopify_client()
+    await close_gang_sheet_http()
 
 # --- Health check endpoint ---
 @app.get("/health")
@@ -64,11 +102,10 @@ async def health_check():
 
 # --- Debug endpoint for products ---
 @app.get("/debug/products")
-async def debug_products():
-    async with SessionLocal() as session:
-        result = await session.execute(select(Product))
-        products = result.scalars().all()
-        return [
-            {"shopify_id": p.shopify_id, "name": p.name, "price": p.price}
-            for p in products
-        ]
+async def debug_products(session: AsyncSession = Depends(get_session)):
+    result = await session.execute(select(Product).where(Product.deleted_at.is_(None)))
+    products = result.scalars().all()
+    return [
+        {"shopify_id": p.shopify_id, "name": p.name, "price": p.price}
+        for p in products
+    ]
@@ -0,0 +1,211 @@
+import os
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from services.catalog_store import (
+    load_sync_state,
+    save_product_rows,
+    save_sync_state,
+    tombstone_products_not_in,
+)
+from services.catalog_sync import (
+    SYNC_STATE_NAME,
+    SYNC_TRANSFORM_WORKERS,
+    normalize_graphql_product,
+    publication_field,
+    sync_catalog,
+)
+from services.shopify_client import ShopifyClient, ShopifyError, get_shopify_client, raise_for_user_errors
+from services.shopify_throttle import Priority
+
+logger = logging.getLogger("bulk_sync")
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_POLL_MIN_SECONDS = float(os.getenv("BULK_POLL_MIN_SECONDS", "1"))
+BULK_POLL_MAX_SECONDS = float(os.getenv("BULK_POLL_MAX_SECONDS", "15"))
+BULK_TIMEOUT_SECONDS = float(os.getenv("BULK_TIMEOUT_SECONDS", "3600"))
+
+# Bulk queries can't take variables or pagination arguments; connections are
+# expanded in full and flattened into JSONL with __parentId on child rows.
+BULK_PRODUCTS_QUERY = """
+{
+  products%s {
+    edges {
+      node {
+        id
+        title
+        handle
+        description
+        updatedAt
+        status
+        %s
+        images { edges { node { url } } }
+        variants { edges { node { id title price availableForSale } } }
+      }
+    }
+  }
+}
+"""
+
+RUN_BULK_MUTATION = """
+mutation runBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query bulkOperationStatus($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+"""
+
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELED", "EXPIRED"}
+
+
+class BulkOperationError(ShopifyError):
+    """The bulk operation finished in a state other than COMPLETED."""
+
+
+# ------------------------------------------------------------------
+# Operation lifecycle
+# ------------------------------------------------------------------
+async def start_bulk_query(client: ShopifyClient, search: Optional[str] = None) -> str:
+    query = BULK_PRODUCTS_QUERY % (f"(query: {json.dumps(search)})" if search else "", publication_field())
+    data = await client.admin_graphql(RUN_BULK_MUTATION, {"query": query}, priority=Priority.SYNC)
+    payload = data.get("bulkOperationRunQuery") or {}
+    raise_for_user_errors(payload)
+    operation = payload.get("bulkOperation") or {}
+    logger.info("📦 Started bulk operation %s", operation.get("id"))
+    return operation["id"]
+
+
+async def wait_for_bulk_operation(client: ShopifyClient, operation_id: str) -> Dict[str, Any]:
+    """Poll with capped exponential backoff until the operation reaches a terminal status."""
+    delay = BULK_POLL_MIN_SECONDS
+    deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+    while True:
+        data = await client.admin_graphql(BULK_STATUS_QUERY, {"id": operation_id}, priority=Priority.SYNC)
+        operation = data.get("node") or {}
+        status = operation.get("status")
+        if status in TERMINAL_STATUSES:
+            if status != "COMPLETED":
+                raise BulkOperationError(f"Bulk operation {operation_id} {status}: {operation.get('errorCode')}")
+            logger.info("✅ Bulk operation %s completed (%s objects)", operation_id, operation.get("objectCount"))
+            return operation
+        if time.monotonic() > deadline:
+            raise BulkOperationError(f"Bulk operation {operation_id} still {status} after {BULK_TIMEOUT_SECONDS}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BULK_POLL_MAX_SECONDS)
+
+
+# ------------------------------------------------------------------
+# JSONL parsing
+# ------------------------------------------------------------------
+def _finish(parent: Dict[str, Any]) -> Dict[str, Any]:
+    return normalize_graphql_product(parent, parent.pop("_variants"))
+
+
+async def iter_bulk_products(lines: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Reassemble flattened bulk JSONL into normalized products.
+
+    Shopify writes each parent before its children, so only the product being
+    assembled is held in memory; it is emitted when the next parent starts.
+    """
+    current: Optional[Dict[str, Any]] = None
+    async for line in lines:
+        row = json.loads(line)
+        parent_id = row.pop("__parentId", None)
+        if parent_id is None:
+            if current is not None:
+                yield _finish(current)
+            current = {**row, "images": {"nodes": []}, "_variants": []}
+            continue
+        if current is None or current["id"] != parent_id:
+            logger.warning("Skipping bulk row whose parent %s is not the current product", parent_id)
+            continue
+        if str(row.get("id", "")).startswith("gid://shopify/ProductVariant/"):
+            current["_variants"].append(row)
+        elif "url" in row:
+            current["images"]["nodes"].append(row)
+    if current is not None:
+        yield _finish(current)
+
+
+async def _batched(products: AsyncIterator[Dict[str, Any]], size: int) -> AsyncIterator[Dict[str, Any]]:
+    """Group a product stream into sync pages (no cursor: a bulk result can't be resumed)."""
+    batch: List[Dict[str, Any]] = []
+    async for product in products:
+        batch.append(product)
+        if len(batch) >= size:
+            yield {"products": batch, "cursor": None}
+            batch = []
+    if batch:
+        yield {"products": batch, "cursor": None}
+
+
+# ------------------------------------------------------------------
+# Sync
+# ------------------------------------------------------------------
+async def run_bulk_sync(
+    client: Optional[ShopifyClient] = None,
+    batch_size: int = BULK_BATCH_SIZE,
+    workers: int = SYNC_TRANSFORM_WORKERS,
+) -> Dict[str, Any]:
+    """
+    Full catalog sync through one bulkOperationRunQuery instead of paged queries.
+
+    Results are streamed line by line and fed through the sync pipeline in
+    `batch_size` pages, so product payloads are never all in memory. Local products absent from the
+    result are tombstoned afterwards; only their IDs are kept for that sweep.
+    The watermark is advanced so later delta runs pick up from here.
+    """
+    client = client or get_shopify_client()
+    started = time.monotonic()
+    state = await load_sync_state(SYNC_STATE_NAME)
+
+    await save_sync_state(SYNC_STATE_NAME, mode="bulk", last_started_at=datetime.utcnow())
+    operation = await wait_for_bulk_operation(client, await start_bulk_query(client))
+
+    newest = state.watermark if state else None
+    seen: set = set()
+    stats = {"products": 0, "pages": 0}
+
+    async def write(rows: List[Dict[str, Any]]) -> int:
+        nonlocal newest
+        for row in rows:
+            seen.add(row["shopify_id"])
+            updated = row["shopify_updated_at"]
+            if updated and (newest is None or updated > newest):
+                newest = updated
+        return await save_product_rows(rows)
+
+    if operation.get("url"):
+        products = iter_bulk_products(client.stream_lines(operation["url"]))
+        stats = await sync_catalog(_batched(products, batch_size), write=write, workers=workers)
+
+    deleted = await tombstone_products_not_in(seen)
+    await save_sync_state(
+        SYNC_STATE_NAME,
+        watermark=newest,
+        cursor=None,
+        products_synced=stats["products"],
+        last_completed_at=datetime.utcnow(),
+    )
+    stats.update({
+        "mode": "bulk",
+        "deleted": deleted,
+        "seconds": round(time.monotonic() - started, 2),
+        "watermark": newest.isoformat() if newest else None,
+    })
+    logger.info("✅ Bulk sync wrote %s products in %s batches", stats["products"], stats["pages"])
+    return stats
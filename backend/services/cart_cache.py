@@ -0,0 +1,81 @@
+import os
+import copy
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Carts kept in memory per process; least recently used ones are dropped first.
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "1024"))
+
+
+class CartCache:
+    """
+    In-process LRU of hot carts keyed by session_id, as the dicts the cart API returns
+    plus a "version".
+
+    Every cart write bumps carts.version in the database and then writes through
+    here: the change is applied to the cached copy only if that copy is exactly
+    one version behind, otherwise the entry is dropped (another worker or
+    request got there first) and reloaded on the next read. Readers compare the
+    cached version with the database's before trusting the copy. Callers get
+    deep copies, so nobody can mutate the cached entry.
+    """
+
+    def __init__(self, max_size: int = CART_CACHE_SIZE):
+        self.max_size = max_size
+        self._carts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def get(self, session_id: str, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """The cached cart, if present and (when `version` is given) at that version."""
+        cart = self._carts.get(session_id)
+        if cart is None:
+            self.stats["misses"] += 1
+            return None
+        if version is not None and cart["version"] != version:
+            self.stats["stale"] += 1
+            self.evict(session_id)
+            return None
+        self.stats["hits"] += 1
+        self._carts.move_to_end(session_id)
+        return copy.deepcopy(cart)
+
+    def put(self, cart: Dict[str, Any]):
+        self._carts[cart["session_id"]] = copy.deepcopy(cart)
+        self._carts.move_to_end(cart["session_id"])
+        while len(self._carts) > self.max_size:
+            self._carts.popitem(last=False)
+
+    def evict(self, session_id: str):
+        self._carts.pop(session_id, None)
+
+    def apply_line(
+        self, session_id: str, version: int, line: Dict[str, Any], updated_at: datetime
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Write through one line (quantity 0 removes it) committed as cart `version`.
+        Returns the updated cart, or None if the cached copy wasn't at version - 1.
+        """
+        cart = self._carts.get(session_id)
+        if cart is None or cart["version"] != version - 1:
+            self.evict(session_id)
+            return None
+        items = [item for item in cart["items"] if item["variant_id"] != line["variant_id"]]
+        if line["quantity"] > 0:
+            existing = next((i for i, item in enumerate(cart["items"]) if item["variant_id"] == line["variant_id"]), None)
+            # Keep the line's position; new lines go last (cart_items id order).
+            items.insert(existing if existing is not None else len(items), dict(line))
+        cart.update(items=items, version=version, updated_at=updated_at.isoformat())
+        self._carts.move_to_end(session_id)
+        return copy.deepcopy(cart)
+
+    def clear(self):
+        self._carts.clear()
+
+
+# Module-level singleton
+cart_cache = CartCache()
+
+
+def get_cart_cache() -> CartCache:
+    return cart_cache
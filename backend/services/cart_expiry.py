@@ -0,0 +1,141 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import and_, delete, exists, or_, select
+
+from services.cart_service import get_cart_service
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.cart import Cart, CartItem, CartLogEntry
+from models.shopify_cart import ShopifyCart
+
+logger = logging.getLogger("cart_expiry")
+
+# Carts untouched (carts.updated_at) for this long are deleted with their lines.
+CART_TTL_DAYS = float(os.getenv("CART_TTL_DAYS", "30"))
+# Carts that never got a line (e.g. a one-off session) go much sooner.
+CART_EMPTY_TTL_HOURS = float(os.getenv("CART_EMPTY_TTL_HOURS", "24"))
+CART_EXPIRY_INTERVAL_SECONDS = float(os.getenv("CART_EXPIRY_INTERVAL_SECONDS", "3600"))
+# Carts deleted per transaction, so the job never holds the write lock for long.
+CART_EXPIRY_BATCH_SIZE = int(os.getenv("CART_EXPIRY_BATCH_SIZE", "500"))
+
+
+class CartExpiry:
+    """
+    Periodically deletes carts past their TTL, with their cart_items lines and
+    Shopify cart mappings, in small batches.
+
+    Candidates come from the carts.updated_at index, oldest first. Each batch
+    re-checks the cutoff inside its delete, so a cart written to after it was
+    picked survives. SQLite reuses the freed pages, so the tables and their
+    indexes stay around the size of the carts active within the TTL.
+    """
+
+    def __init__(
+        self,
+        ttl: timedelta = timedelta(days=CART_TTL_DAYS),
+        empty_ttl: timedelta = timedelta(hours=CART_EMPTY_TTL_HOURS),
+        interval: float = CART_EXPIRY_INTERVAL_SECONDS,
+        batch_size: int = CART_EXPIRY_BATCH_SIZE,
+    ):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "deleted": 0, "lines": 0}
+
+    def _expired(self, now: datetime):
+        has_lines = exists().where(CartItem.cart_id == Cart.id)
+        # In-memory carts with changes not yet compacted into carts / cart_items were just used.
+        has_log = exists().where(CartLogEntry.session_id == Cart.session_id)
+        # The outer range keeps this a scan of the updated_at index rather than of every cart.
+        return and_(
+            Cart.updated_at < now - min(self.ttl, self.empty_ttl),
+            or_(Cart.updated_at < now - self.ttl, ~has_lines),
+            ~has_log,
+        )
+
+    async def purge_batch(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Delete up to batch_size expired carts in one transaction."""
+        expired = self._expired(now or datetime.utcnow())
+        async with ReadSessionLocal() as session:
+            ids = (await session.execute(
+                select(Cart.id).where(expired).order_by(Cart.updated_at).limit(self.batch_size)
+            )).scalars().all()
+        if not ids:
+            return {"carts": 0, "lines": 0}
+
+        async def write(session):
+            # Re-check the TTL: a cart written to since the select keeps living.
+            carts = (await session.execute(
+                delete(Cart)
+                .where(Cart.id.in_(ids), expired)
+                .returning(Cart.id, Cart.session_id)
+                .execution_options(synchronize_session=False)
+            )).all()
+            # cart_items' ON DELETE CASCADE only fires with PRAGMA foreign_keys on, so delete explicitly.
+            lines = (await session.execute(
+                delete(CartItem).where(CartItem.cart_id.in_([row.id for row in carts]))
+            )).rowcount
+            await session.execute(delete(ShopifyCart).where(ShopifyCart.session_id.in_([row.session_id for row in carts])))
+            return carts, lines
+
+        carts, lines = await get_db_writer().run(write)
+        sessions = [row.session_id for row in carts]
+
+        carts_backend = get_cart_service()
+        for session_id in sessions:
+            carts_backend.evict(session_id)
+        return {"carts": len(carts), "lines": lines or 0}
+
+    async def purge_expired(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Delete every expired cart, batch by batch. Returns the totals."""
+        now = now or datetime.utcnow()
+        totals = {"carts": 0, "lines": 0}
+        while True:
+            batch = await self.purge_batch(now)
+            totals["carts"] += batch["carts"]
+            totals["lines"] += batch["lines"]
+            if batch["carts"] < self.batch_size:
+                break
+            # Let request handlers get at the database between batches.
+            await asyncio.sleep(0)
+        self.stats["runs"] += 1
+        self.stats["deleted"] += totals["carts"]
+        self.stats["lines"] += totals["lines"]
+        if totals["carts"]:
+            logger.info(f"🧹 Expired {totals['carts']} carts ({totals['lines']} lines)")
+        return totals
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.error(f"❌ Cart expiry failed, retrying next interval: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Module-level singleton
+cart_expiry = CartExpiry()
+
+
+def get_cart_expiry() -> CartExpiry:
+    return cart_expiry
@@ -1,41 +1,200 @@
+import os
 import logging
 from datetime import datetime
-from sqlalchemy import select
-from sqlalchemy.exc import SQLAlchemyError
-from services.database import SessionLocal
-from models.cart import Cart
-from models.product import Product
-import json
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from services.cart_cache import CartCache, get_cart_cache
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.cart import Cart, CartItem
+from models.product import ProductVariant
 
 logger = logging.getLogger("cart_service")
 logging.basicConfig(level=logging.INFO)
 
+CARTS = Cart.__table__
+CART_ITEMS = CartItem.__table__
+
+# "sql": carts live in the database (any number of workers). "memory": InMemoryCartService,
+# which keeps carts in process and snapshots them to the database (single worker only).
+CART_BACKEND = os.getenv("CART_BACKEND", "sql")
+CART_OPERATIONS = ("add", "set", "remove")
+CART_BATCH_MAX_OPERATIONS = int(os.getenv("CART_BATCH_MAX_OPERATIONS", "500"))
+
+
+class CartConflictError(Exception):
+    """The cart changed under the caller (an expected version didn't match), or the database stayed locked."""
+
+    def __init__(self, session_id: str, expected: Optional[int] = None, actual: Optional[int] = None):
+        self.session_id = session_id
+        self.expected = expected
+        self.actual = actual
+        if expected is not None:
+            message = f"Cart {session_id} is at version {actual}, not {expected}"
+        else:
+            message = f"Cart {session_id} is busy; the database stayed locked"
+        super().__init__(message)
+
+
+def _is_busy(error: OperationalError) -> bool:
+    message = str(error.orig if error.orig is not None else error).lower()
+    return "locked" in message or "busy" in message
+
+
+def variant_line(variant: ProductVariant, quantity: int) -> Dict[str, Any]:
+    """A cart line for `variant`, in the shape the cart API returns."""
+    return {
+        "product_id": variant.product_id,
+        "variant_id": variant.shopify_id,
+        "name": f"{variant.product_name} - {variant.title or 'Default'}",
+        "price": variant.price or 0.0,
+        "quantity": quantity,
+    }
+
+
+def operation_gid(op: Dict[str, Any], variants: Dict[str, ProductVariant]) -> str:
+    numeric = str(op["variant_id"]).rsplit("/", 1)[-1]
+    variant = variants.get(numeric)
+    return variant.shopify_id if variant is not None else f"gid://shopify/ProductVariant/{numeric}"
+
+
+def operation_quantity(op: Dict[str, Any]) -> int:
+    """The operation's quantity; only a missing one defaults (1 for add, 0 for set), never an explicit 0."""
+    quantity = op.get("quantity")
+    if quantity is None:
+        return 1 if op.get("op") == "add" else 0
+    return int(quantity)
+
+
+def validate_operations(operations: List[Dict[str, Any]], variants: Dict[str, ProductVariant]) -> List[str]:
+    """Every problem with a batch of cart operations, given its variants keyed by numeric ID."""
+    errors = []
+    for n, op in enumerate(operations):
+        kind, variant_id = op.get("op"), op.get("variant_id")
+        numeric = str(variant_id or "").rsplit("/", 1)[-1]
+        if kind not in CART_OPERATIONS:
+            errors.append(f"operations[{n}]: unknown op {kind!r}")
+        elif not numeric.isdigit():
+            errors.append(f"operations[{n}]: invalid variant_id {variant_id!r}")
+        elif kind != "remove" and numeric not in variants:
+            # Removing a line whose product has since been deleted is still allowed.
+            errors.append(f"operations[{n}]: variant {variant_id} not found")
+        elif kind != "remove" and op.get("product_id") and variants[numeric].product_id != op["product_id"]:
+            errors.append(f"operations[{n}]: variant {variant_id} does not belong to product {op['product_id']}")
+        elif kind == "add" and operation_quantity(op) < 1:
+            errors.append(f"operations[{n}]: add quantity must be at least 1")
+        elif kind == "set" and operation_quantity(op) < 0:
+            errors.append(f"operations[{n}]: quantity cannot be negative")
+    return errors
+
+
+def fold_operations(
+    operations: List[Dict[str, Any]], variants: Dict[str, ProductVariant], quantities: Dict[str, int]
+) -> Dict[str, int]:
+    """Apply operations in order to {variant GID: quantity}; a quantity of 0 means the line goes."""
+    for op in operations:
+        gid = operation_gid(op, variants)
+        if op["op"] == "add":
+            quantities[gid] = quantities.get(gid, 0) + operation_quantity(op)
+        elif op["op"] == "set":
+            quantities[gid] = operation_quantity(op)
+        else:
+            quantities[gid] = 0
+    return quantities
+
+
+def _cart_dict(cart: Cart) -> Dict[str, Any]:
+    return {
+        "id": cart.id,
+        "session_id": cart.session_id,
+        "items": cart.items,
+        "created_at": cart.created_at.isoformat(),
+        "updated_at": cart.updated_at.isoformat(),
+        "version": cart.version or 0,
+    }
+
 
 class CartService:
-    async def get_or_create_cart(self, session_id: str) -> Cart:
-        """Retrieve an existing cart or create a new one."""
-        async with SessionLocal() as session:
+    """
+    Local carts: one `carts` row per session with its lines in `cart_items`.
+
+    Every write is a single job on the database writer (one transaction,
+    group-committed with other requests' writes) that bumps carts.version and
+    writes through to the in-process cart cache, so reads of a hot cart cost
+    one indexed version check on a read-only connection instead of loading
+    all of its lines. A database locked by another worker is retried by the
+    writer; one still locked after that is a CartConflictError (see `_write`).
+    """
+
+    def __init__(self, cache: Optional[CartCache] = None):
+        self.cache = cache or get_cart_cache()
+        self.stats = {"conflicts": 0, "cache": self.cache.stats}
+
+    async def _write(self, session_id: str, attempt):
+        """
+        Run one write transaction. The database writer already retries it while
+        another worker holds the lock, so it isn't retried again here: a
+        database still locked after that raises CartConflictError.
+        """
+        try:
+            return await attempt()
+        except OperationalError as e:
+            if not _is_busy(e):
+                raise
+            self.stats["conflicts"] += 1
+            raise CartConflictError(session_id) from e
+
+    async def get_cart(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's cart, or None if it has none. Never writes."""
+        async with ReadSessionLocal() as session:
             try:
-                result = await session.execute(
-                    select(Cart).where(Cart.session_id == session_id)
-                )
-                cart = result.scalars().first()
+                version = (await session.execute(
+                    select(func.coalesce(Cart.version, 0)).where(Cart.session_id == session_id)
+                )).scalar()
+                if version is None:
+                    self.cache.evict(session_id)
+                    return None
+                cached = self.cache.get(session_id, version)
+                if cached is not None:
+                    return cached
+                cart = (await session.execute(select(Cart).where(Cart.session_id == session_id))).scalars().first()
+                if cart is None:
+                    return None
+                data = _cart_dict(cart)
+                self.cache.put(data)
+                return data
 
-                if cart:
-                    logger.info(f"🛒 Found existing cart for {session_id}")
-                    return cart
+            except SQLAlchemyError as e:
+                logger.error(f"❌ Database error loading cart: {e}")
+                return None
 
-                new_cart = Cart(
-                    session_id=session_id,
-                    items=[],
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow(),
-                )
-                session.add(new_cart)
-                await session.commit()
-                await session.refresh(new_cart)
-                logger.info(f"🆕 Created new cart for session: {session_id}")
-                return new_cart
+    async def get_or_create_cart(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve an existing cart or create a new one."""
+        async with ReadSessionLocal() as session:
+            try:
+                version = (await session.execute(
+                    select(func.coalesce(Cart.version, 0)).where(Cart.session_id == session_id)
+                )).scalar()
+                if version is not None:
+                    cached = self.cache.get(session_id, version)
+                    if cached is not None:
+                        return cached
+                else:
+                    now = datetime.utcnow()
+                    # DO NOTHING: a concurrent request may have created it first.
+                    await get_db_writer().run(lambda write: write.execute(
+                        sqlite_insert(CARTS)
+                        .values(session_id=session_id, created_at=now, updated_at=now, version=0)
+                        .on_conflict_do_nothing(index_elements=[CARTS.c.session_id])
+                    ))
+                    logger.debug(f"Created new cart for session: {session_id}")
+
+                cart = (await session.execute(select(Cart).where(Cart.session_id == session_id))).scalars().first()
+                data = _cart_dict(cart)
+                self.cache.put(data)
+                return data
 
             except SQLAlchemyError as e:
                 logger.error(f"❌ Database error creating cart: {e}")
@@ -47,96 +206,264 @@ class CartService:
         product_id: str,
         variant_id: str,
         quantity: int = 1,
-    ):
-        """Add an item to a user's cart."""
-        async with SessionLocal() as session:
-            try:
-                # Get or create cart
-                result = await session.execute(
-                    select(Cart).where(Cart.session_id == session_id)
-                )
-                cart = result.scalars().first()
-
-                if not cart:
-                    cart = Cart(
-                        session_id=session_id,
-                        items=[],
-                        created_at=datetime.utcnow(),
-                        updated_at=datetime.utcnow(),
-                    )
-                    session.add(cart)
-                    await session.commit()
-                    await session.refresh(cart)
-                    logger.info(f"🆕 Created new cart for session: {session_id}")
-
-                # Fetch product
-                result = await session.execute(
-                    select(Product).where(Product.shopify_id == product_id)
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Add an item to a user's cart.
+
+        One transaction upserts the cart row (bumping its version) and the
+        line (adding to the quantity if the variant is already there); other
+        lines are never touched. The cached cart is updated in place, so the
+        response normally needs no further read.
+
+        The quantity is incremented inside SQL rather than read and written
+        back, so concurrent adds from any number of workers can't lose each
+        other's updates; a database that stays locked through the writer's
+        retries raises CartConflictError.
+        """
+        try:
+            written = await self._write(
+                session_id, lambda: self._add_item_once(session_id, product_id, variant_id, quantity)
+            )
+        except CartConflictError:
+            raise
+        except SQLAlchemyError as e:
+            logger.error(f"❌ Error updating cart: {e}")
+            return None
+        if written is None:
+            return None
+
+        cart_id, created_at, version, created, line, now = written
+        logger.debug(f"Added variant {variant_id} to cart for session {session_id}")
+        if created:
+            # Brand-new cart: everything it holds was just written.
+            cart = {
+                "id": cart_id,
+                "session_id": session_id,
+                "items": [dict(line)],
+                "created_at": created_at.isoformat(),
+                "updated_at": now.isoformat(),
+                "version": version,
+            }
+            self.cache.put(cart)
+            return cart
+        cart = self.cache.apply_line(session_id, version, dict(line), now)
+        return cart if cart is not None else await self.get_or_create_cart(session_id)
+
+    async def _add_item_once(self, session_id: str, product_id: str, variant_id: str, quantity: int):
+        """
+        One attempt at the add transaction: (cart_id, created_at, version, created, line, now),
+        or None for an unknown variant. `created` is True when this insert made the cart.
+        """
+        # Point lookup by numeric variant ID (accepts a GID or the bare number), off the writer
+        numeric = str(variant_id).rsplit("/", 1)[-1]
+        async with ReadSessionLocal() as session:
+            variant = await session.get(ProductVariant, int(numeric)) if numeric.isdigit() else None
+        if variant is None or variant.product_id != product_id:
+            logger.error(f"❌ Variant {variant_id} not found for product {product_id}")
+            return None
+
+        async def write(session):
+            now = datetime.utcnow()
+            # Which statement wrote the row tells a new cart from an existing one; the
+            # version can't, since a legacy cart can be at any version (even 0).
+            row = (await session.execute(
+                sqlite_insert(CARTS)
+                .values(session_id=session_id, created_at=now, updated_at=now, version=1)
+                .on_conflict_do_nothing(index_elements=[CARTS.c.session_id])
+                .returning(CARTS.c.id, CARTS.c.created_at, CARTS.c.version)
+            )).first()
+            created = row is not None
+            if not created:
+                row = (await session.execute(
+                    update(Cart)
+                    .where(Cart.session_id == session_id)
+                    .values(updated_at=now, version=func.coalesce(Cart.version, 0) + 1)
+                    .returning(Cart.id, Cart.created_at, Cart.version)
+                )).one()
+            cart_id, created_at, version = row
+
+            line_insert = sqlite_insert(CART_ITEMS).values(
+                cart_id=cart_id,
+                product_id=product_id,
+                variant_id=variant.shopify_id,
+                name=f"{variant.product_name} - {variant.title or 'Default'}",
+                price=variant.price or 0.0,
+                quantity=quantity,
+                created_at=now,
+                updated_at=now,
+            )
+            line = (await session.execute(
+                line_insert.on_conflict_do_update(
+                    index_elements=[CART_ITEMS.c.cart_id, CART_ITEMS.c.variant_id],
+                    set_={"quantity": CART_ITEMS.c.quantity + line_insert.excluded.quantity, "updated_at": now},
+                ).returning(
+                    CART_ITEMS.c.product_id,
+                    CART_ITEMS.c.variant_id,
+                    CART_ITEMS.c.name,
+                    CART_ITEMS.c.price,
+                    CART_ITEMS.c.quantity,
                 )
-                product = result.scalars().first()
-                if not product:
-                    logger.error(f"❌ Product {product_id} not found in DB")
-                    return None
+            )).mappings().one()
+            return cart_id, created_at, version, created, line, now
+
+        return await get_db_writer().run(write)
+
+    async def apply_operations(
+        self,
+        session_id: str,
+        operations: Iterable[Dict[str, Any]],
+        expected_version: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Apply add / set / remove operations to a cart atomically and return the final cart.
+
+        Each operation is {"op", "variant_id", "quantity", "product_id" (optional check)}.
+        "add" adds to the line's quantity, "set" replaces it (0 removes the line)
+        and "remove" drops it. Operations apply in order, so the cart ends up as
+        if they had been sent one by one, but all variants are resolved with one
+        query and everything commits in one transaction. Raises ValueError, with
+        nothing written, if any operation is invalid.
+
+        The transaction claims the cart (bumping carts.version) before it reads
+        any line, so concurrent writers in other workers queue behind it rather
+        than overwrite each other. With
+        `expected_version` the bump is a compare-and-swap and the batch is only
+        applied on top of that version of the cart: CartConflictError, with
+        nothing written, if the cart has moved on.
+        """
+        operations = list(operations)
+        if not operations:
+            raise ValueError("No cart operations given")
+        if len(operations) > CART_BATCH_MAX_OPERATIONS:
+            raise ValueError(f"At most {CART_BATCH_MAX_OPERATIONS} cart operations per request")
+
+        data = await self._write(
+            session_id, lambda: self._apply_operations_once(session_id, operations, expected_version)
+        )
+        self.cache.put(data)
+        logger.debug(f"Applied {len(operations)} cart operations for session {session_id}")
+        return data
 
-                # Ensure variants exist
-                variants = product.variants or []
-                # Handle GID normalization
-                variant = next(
-                    (
-                        v for v in variants
-                        if str(v.get("shopify_id")).split("/")[-1] == str(variant_id).split("/")[-1]
+    async def _apply_operations_once(
+        self, session_id: str, operations: List[Dict[str, Any]], expected_version: Optional[int]
+    ) -> Dict[str, Any]:
+        numeric_ids = {str(op.get("variant_id", "")).rsplit("/", 1)[-1] for op in operations}
+        async with ReadSessionLocal() as session:
+            variants = {
+                str(v.id): v
+                for v in (await session.execute(
+                    select(ProductVariant).where(ProductVariant.id.in_([int(n) for n in numeric_ids if n.isdigit()]))
+                )).scalars()
+            }
+        errors = validate_operations(operations, variants)
+        if errors:
+            raise ValueError("; ".join(errors))
+
+        async def write(session):
+            now = datetime.utcnow()
+            # Claim the cart before reading its lines: from here this transaction holds the
+            # write lock, so nobody can change them until it commits.
+            cart_id = await self._bump_version(session, session_id, now, expected_version)
+
+            # Fold the operations over the current quantities of the lines they touch.
+            gids = {operation_gid(op, variants) for op in operations}
+            quantities = fold_operations(operations, variants, dict((await session.execute(
+                select(CartItem.variant_id, CartItem.quantity)
+                .where(CartItem.cart_id == cart_id, CartItem.variant_id.in_(gids))
+            )).all()))
+
+            keep = []
+            for gid, qty in quantities.items():
+                if qty <= 0:
+                    continue
+                line = variant_line(variants[gid.rsplit("/", 1)[-1]], qty)
+                keep.append({**line, "cart_id": cart_id, "created_at": now, "updated_at": now})
+            drop = [gid for gid, qty in quantities.items() if qty <= 0]
+            if keep:
+                line_insert = sqlite_insert(CART_ITEMS)
+                await session.execute(
+                    line_insert.on_conflict_do_update(
+                        index_elements=[CART_ITEMS.c.cart_id, CART_ITEMS.c.variant_id],
+                        set_={"quantity": line_insert.excluded.quantity, "updated_at": now},
                     ),
-                    None,
+                    keep,
+                )
+            if drop:
+                await session.execute(
+                    delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.variant_id.in_(drop))
                 )
-                if not variant:
-                    logger.error(f"❌ Variant {variant_id} not found for product {product_id}")
-                    return None
 
-                # Convert cart.items from string to list if necessary
-                if isinstance(cart.items, str):
-                    try:
-                        cart.items = json.loads(cart.items)
-                    except Exception:
-                        cart.items = []
+            cart = (await session.execute(
+                select(Cart).where(Cart.id == cart_id).execution_options(populate_existing=True)
+            )).scalars().one()
+            return _cart_dict(cart)
 
-                items = list(cart.items or [])
-                existing = next((i for i in items if str(i["variant_id"]) == str(variant_id)), None)
+        return await get_db_writer().run(write)
 
-                if existing:
-                    existing["quantity"] += quantity
-                else:
-                    items.append({
-                        "product_id": product_id,
-                        "variant_id": variant_id,
-                        "name": f"{product.name} - {variant.get('title', 'Default')}",
-                        "price": float(variant.get("price", 0)),
-                        "quantity": quantity,
-                    })
-
-                cart.items = items
-                cart.updated_at = datetime.utcnow()
-                session.add(cart)
-                await session.commit()
-                await session.refresh(cart)
-                logger.info(f"✅ Added variant {variant_id} to cart for session {session_id}")
-
-                # Return cart as dict (JSON serializable)
-                return {
-                    "id": cart.id,
-                    "session_id": cart.session_id,
-                    "items": cart.items,
-                    "created_at": cart.created_at.isoformat(),
-                    "updated_at": cart.updated_at.isoformat(),
-                }
+    @staticmethod
+    async def _bump_version(session, session_id: str, now: datetime, expected_version: Optional[int] = None) -> int:
+        """
+        Create the session's cart if needed and bump its version; returns the cart id.
 
-            except SQLAlchemyError as e:
-                logger.error(f"❌ Error updating cart: {e}")
-                await session.rollback()
-                return None
+        With `expected_version` the bump is a compare-and-swap: CartConflictError
+        if the cart is at any other version (a missing cart is at version 0).
+        """
+        # DO NOTHING: the cart may exist already or a concurrent request may create it first.
+        await session.execute(
+            sqlite_insert(CARTS)
+            .values(session_id=session_id, created_at=now, updated_at=now, version=0)
+            .on_conflict_do_nothing(index_elements=[CARTS.c.session_id])
+        )
+        current = func.coalesce(Cart.version, 0)
+        bump = update(Cart).where(Cart.session_id == session_id)
+        if expected_version is not None:
+            bump = bump.where(current == expected_version)
+        cart_id = (await session.execute(
+            bump.values(updated_at=now, version=current + 1).returning(Cart.id)
+        )).scalar()
+        if cart_id is None:
+            actual = (await session.execute(select(current).where(Cart.session_id == session_id))).scalar()
+            raise CartConflictError(session_id, expected_version, actual)
+        return cart_id
+
+    async def clear_cart(self, session_id: str) -> bool:
+        """Remove every line from a session's cart. Returns False if the session has no cart."""
+        now = datetime.utcnow()
+        async def write(session):
+            row = (await session.execute(
+                update(Cart)
+                .where(Cart.session_id == session_id)
+                .values(updated_at=now, version=func.coalesce(Cart.version, 0) + 1)
+                .returning(Cart.id, Cart.created_at, Cart.version)
+            )).first()
+            if row is not None:
+                await session.execute(delete(CartItem).where(CartItem.cart_id == row.id))
+            return row
+
+        row = await get_db_writer().run(write)
+        if row is None:
+            return False
+        self.cache.put({
+            "id": row.id,
+            "session_id": session_id,
+            "items": [],
+            "created_at": row.created_at.isoformat(),
+            "updated_at": now.isoformat(),
+            "version": row.version,
+        })
+        logger.info(f"🧹 Cleared cart for session {session_id}")
+        return True
+
+    def evict(self, session_id: str):
+        """Forget any in-process copy of a cart (it was deleted from the database)."""
+        self.cache.evict(session_id)
 
 
 cart_service = CartService()
 
 
 def get_cart_service():
+    if CART_BACKEND == "memory":
+        from services.in_memory_cart_service import get_in_memory_cart_service
+        return get_in_memory_cart_service()
     return cart_service
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from services.catalog_store import load_products
+from services.catalog_sync import iter_storefront_product_pages, run_sync, sync_catalog
+from services.shopify_client import SHOPIFY_ACCESS_TOKEN, get_shopify_client
+
+logger = logging.getLogger("catalog_cache")
+
+# Serve cached products for this long before revalidating in the background.
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+
+
+class CatalogCache:
+    """
+    Stale-while-revalidate cache of the live product catalog.
+
+    Reads are served from memory, loaded from the local products table. Once the
+    entry is older than `ttl`, the next read still returns it immediately and
+    kicks off a single background refresh (Shopify sync, then reload); requests
+    arriving meanwhile keep getting the stale copy. Only a cold cache with an
+    empty table waits on Shopify. If Shopify is down, the last good copy is
+    kept and retried after another `ttl`.
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._products: Optional[List[Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+    async def get_products(self) -> List[Dict[str, Any]]:
+        if self._products is None or self._dirty:
+            async with self._lock:
+                if self._products is None:
+                    await self._load(cold=True)
+                elif self._dirty:
+                    await self._load()
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            self._schedule_refresh()
+        return self._products
+
+    def invalidate(self):
+        """The local table changed (e.g. webhook batch); reload it on the next read without calling Shopify."""
+        self._dirty = True
+
+    # --- internals ---
+    async def _load(self, cold: bool = False):
+        products = await load_products()
+        if cold and not products:
+            logger.info("Local catalog is empty; syncing from Shopify before serving")
+            await self._sync_from_shopify()
+            products = await load_products()
+        self._products = products
+        self._loaded_at = time.monotonic()
+        self._dirty = False
+
+    def _schedule_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            await self._sync_from_shopify()
+        except Exception as e:
+            logger.warning("⚠️ Catalog refresh failed, serving cached products: %s", e)
+            self._loaded_at = time.monotonic()
+            return
+        async with self._lock:
+            await self._load()
+        logger.info("🔄 Catalog cache refreshed (%s products)", len(self._products))
+
+    async def _sync_from_shopify(self):
+        if SHOPIFY_ACCESS_TOKEN:
+            # Delta sync: only products changed since the watermark, plus deletions.
+            await run_sync("delta")
+        else:
+            await sync_catalog(iter_storefront_product_pages(get_shopify_client()))
+
+    async def close(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+
+
+# Module-level singleton
+catalog_cache = CatalogCache()
+
+
+def get_catalog_cache() -> CatalogCache:
+    return catalog_cache
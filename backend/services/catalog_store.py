@@ -0,0 +1,280 @@
+import os
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.product import Product, ProductVariant
+from models.sync_state import SyncState
+from services.pricing import get_pricing_engine
+from services.variant_availability import get_variant_availability
+
+logger = logging.getLogger("catalog_store")
+
+PRODUCT_FIELDS = ("name", "handle", "description", "price", "image", "images", "variants")
+UPSERT_CHUNK_SIZE = int(os.getenv("PRODUCT_UPSERT_CHUNK_SIZE", "500"))
+
+
+def parse_shopify_datetime(value: Any) -> Optional[datetime]:
+    """Parse Shopify timestamps ("...Z" from GraphQL, "...-05:00" from REST) into naive UTC."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def product_content_hash(p: Dict[str, Any]) -> str:
+    encoded = json.dumps([p.get(f) for f in PRODUCT_FIELDS], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+def is_listed(p: Dict[str, Any]) -> bool:
+    """
+    Only active, published products are sold. Drafts, archived products
+    (Shopify `status`) and products unpublished from the Online Store are
+    hidden like deletions. Sources that don't report either (the Storefront
+    API only returns listed products) count as listed.
+    """
+    return (p.get("status") or "active").lower() == "active" and p.get("published") is not False
+
+
+def _product_row(p: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    return {
+        "shopify_id": p["shopify_id"],
+        **{f: p.get(f) for f in PRODUCT_FIELDS},
+        "shopify_updated_at": parse_shopify_datetime(p.get("updated_at")),
+        "content_hash": product_content_hash(p),
+        "deleted_at": None if is_listed(p) else now,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def variant_rows(rows: Iterable[Dict[str, Any]], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """product_variants rows for product rows (or normalized products); variants without a numeric ID are skipped."""
+    now = now or datetime.utcnow()
+    out = []
+    for p in rows:
+        if p.get("deleted_at") is not None or not is_listed(p):
+            continue
+        for v in p.get("variants") or []:
+            numeric = str(v.get("shopify_id") or "").rsplit("/", 1)[-1]
+            if not numeric.isdigit():
+                continue
+            out.append({
+                "id": int(numeric),
+                "shopify_id": v["shopify_id"],
+                "product_id": p["shopify_id"],
+                "product_name": p.get("name"),
+                "title": v.get("title"),
+                "price": float(v.get("price") or 0),
+                "available": v.get("available"),
+                "updated_at": now,
+            })
+    return out
+
+
+def variant_upsert_statement():
+    stmt = sqlite_insert(ProductVariant.__table__)
+    excluded = stmt.excluded
+    table = ProductVariant.__table__
+    fields = ("shopify_id", "product_id", "product_name", "title", "price", "available")
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={**{f: excluded[f] for f in fields}, "updated_at": excluded.updated_at},
+        where=or_(*(table.c[f].is_distinct_from(excluded[f]) for f in fields)),
+    )
+
+
+def _upsert_statement():
+    stmt = sqlite_insert(Product.__table__)
+    excluded = stmt.excluded
+    table = Product.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.shopify_id],
+        set_={
+            **{f: excluded[f] for f in PRODUCT_FIELDS},
+            "shopify_updated_at": excluded.shopify_updated_at,
+            "content_hash": excluded.content_hash,
+            "deleted_at": excluded.deleted_at,
+            "updated_at": excluded.updated_at,
+        },
+        where=and_(
+            # Never let an older payload (a late webhook) overwrite a newer one.
+            or_(
+                table.c.shopify_updated_at.is_(None),
+                excluded.shopify_updated_at.is_(None),
+                excluded.shopify_updated_at >= table.c.shopify_updated_at,
+            ),
+            # Skip the write entirely when nothing we sync has changed, listing status included.
+            or_(
+                table.c.content_hash.is_(None),
+                table.c.content_hash != excluded.content_hash,
+                and_(table.c.deleted_at.is_(None), excluded.deleted_at.is_not(None)),
+                and_(table.c.deleted_at.is_not(None), excluded.deleted_at.is_(None)),
+            ),
+        ),
+    )
+
+
+def _is_stale(row: Dict[str, Any], stored_updated_at: Optional[datetime]) -> bool:
+    """The same test as the upsert's where clause, for deciding which rows' variants to write."""
+    incoming = row["shopify_updated_at"]
+    return bool(incoming and stored_updated_at and incoming < stored_updated_at)
+
+
+def product_rows(products: List[Dict[str, Any]], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Upsert rows (with content hashes) for normalized product dicts; the last payload wins for a repeated shopify_id."""
+    now = now or datetime.utcnow()
+    return list({p["shopify_id"]: _product_row(p, now) for p in products}.values())
+
+
+async def save_products(products: List[Dict[str, Any]], chunk_size: int = UPSERT_CHUNK_SIZE) -> int:
+    """
+    Insert or update normalized product dicts keyed by shopify_id, in one transaction.
+
+    Returns the number of products processed.
+    """
+    if not products:
+        return 0
+    await save_product_rows(product_rows(products), chunk_size)
+    return len(products)
+
+
+async def save_product_rows(rows: List[Dict[str, Any]], chunk_size: int = UPSERT_CHUNK_SIZE) -> int:
+    """
+    Write rows from `product_rows` in one transaction.
+
+    Each chunk is a single INSERT ... ON CONFLICT(shopify_id) DO UPDATE executed
+    with executemany; rows whose content hash matches are left untouched, and
+    rows older than the stored product (shopify_updated_at) are skipped. The
+    chunk's variants are upserted into product_variants the same way, and
+    variants the products no longer have (or hidden products' variants) are removed.
+    Returns the number of rows processed.
+    """
+    if not rows:
+        return 0
+    stmt = _upsert_statement()
+    variant_stmt = variant_upsert_statement()
+
+    async def write(session):
+        changed = 0
+        applied = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            stored = dict((await session.execute(
+                select(Product.shopify_id, Product.shopify_updated_at)
+                .where(Product.shopify_id.in_([row["shopify_id"] for row in chunk]))
+            )).all())
+            chunk = [row for row in chunk if not _is_stale(row, stored.get(row["shopify_id"]))]
+            if not chunk:
+                continue
+            applied.extend(chunk)
+            result = await session.execute(stmt, chunk)
+            changed += max(result.rowcount or 0, 0)
+            variants = variant_rows(chunk)
+            if variants:
+                await session.execute(variant_stmt, variants)
+            await session.execute(
+                delete(ProductVariant).where(
+                    ProductVariant.product_id.in_([row["shopify_id"] for row in chunk]),
+                    ProductVariant.id.not_in([v["id"] for v in variants]),
+                )
+            )
+        return changed, applied
+
+    changed, applied = await get_db_writer().run(write)
+    listed = [row for row in applied if row["deleted_at"] is None]
+    hidden = [row["shopify_id"] for row in applied if row["deleted_at"] is not None]
+    get_variant_availability().record_products(listed)
+    get_pricing_engine().record_products(listed)
+    if hidden:
+        get_variant_availability().forget_products(hidden)
+        get_pricing_engine().forget_products(hidden)
+    logger.debug(
+        "Upserted %s products (%s written, %s stale skipped, rest unchanged)",
+        len(rows), changed, len(rows) - len(applied),
+    )
+    return len(rows)
+
+
+async def load_products() -> List[Dict[str, Any]]:
+    """All live products, shaped like the normalized sync output."""
+    async with ReadSessionLocal() as session:
+        result = await session.execute(
+            select(Product).where(Product.deleted_at.is_(None)).order_by(Product.id)
+        )
+        return [
+            {
+                "shopify_id": p.shopify_id,
+                **{f: getattr(p, f) for f in PRODUCT_FIELDS},
+                "updated_at": p.shopify_updated_at.isoformat() + "Z" if p.shopify_updated_at else None,
+            }
+            for p in result.scalars()
+        ]
+
+
+# ------------------------------------------------------------------
+# Tombstones
+# ------------------------------------------------------------------
+async def tombstone_products(shopify_ids: Iterable[str]) -> int:
+    """Mark products deleted in Shopify. Rows are kept so carts and orders can still resolve them."""
+    ids = list(shopify_ids)
+    if not ids:
+        return 0
+
+    async def write(session):
+        result = await session.execute(
+            update(Product)
+            .where(Product.shopify_id.in_(ids), Product.deleted_at.is_(None))
+            .values(deleted_at=datetime.utcnow())
+        )
+        await session.execute(delete(ProductVariant).where(ProductVariant.product_id.in_(ids)))
+        return result
+
+    result = await get_db_writer().run(write)
+    get_variant_availability().forget_products(ids)
+    get_pricing_engine().forget_products(ids)
+    return result.rowcount or 0
+
+
+async def tombstone_products_not_in(seen_ids: Iterable[str]) -> int:
+    """After a full walk, tombstone every live product Shopify no longer returned."""
+    seen = set(seen_ids)
+    async with ReadSessionLocal() as session:
+        result = await session.execute(select(Product.shopify_id).where(Product.deleted_at.is_(None)))
+        missing = [shopify_id for shopify_id in result.scalars() if shopify_id not in seen]
+    return await tombstone_products(missing)
+
+
+# ------------------------------------------------------------------
+# Sync state
+# ------------------------------------------------------------------
+async def load_sync_state(name: str) -> Optional[SyncState]:
+    async with ReadSessionLocal() as session:
+        return await session.get(SyncState, name)
+
+
+async def save_sync_state(name: str, **fields: Any) -> None:
+    async def write(session):
+        state = await session.get(SyncState, name)
+        if state is None:
+            state = SyncState(name=name)
+            session.add(state)
+        for key, value in fields.items():
+            setattr(state, key, value)
+
+    await get_db_writer().run(write)
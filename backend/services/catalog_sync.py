@@ -0,0 +1,601 @@
+import os
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from services.catalog_store import (
+    load_sync_state,
+    product_rows,
+    save_product_rows,
+    save_sync_state,
+    tombstone_products,
+    tombstone_products_not_in,
+)
+from services.shopify_client import (
+    ShopifyClient,
+    ShopifyGraphQLError,
+    build_product_gid_from_numeric,
+    build_variant_gid_from_numeric,
+    get_shopify_client,
+)
+from services.shopify_throttle import Priority
+
+logger = logging.getLogger("catalog_sync")
+
+# Shopify rejects any single GraphQL query whose requested cost is over this (MAX_COST_EXCEEDED).
+SHOPIFY_MAX_QUERY_COST = 1000
+# Nested connection sizes; the product page size is derived from them so a page stays under the cost limit.
+VARIANT_PAGE_SIZE = 50
+IMAGE_LIMIT = 5
+PRODUCT_PAGE_SIZE = 10
+REST_PAGE_SIZE = 250
+
+SYNC_STATE_NAME = "products"
+REST_SYNC_STATE_NAME = "products_rest"
+# Re-read a little before the watermark: Shopify's search index lags writes slightly.
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "60"))
+# Pipeline shape: pages turned into rows in parallel, and rows committed per transaction (0 = one page each).
+SYNC_TRANSFORM_WORKERS = int(os.getenv("SYNC_TRANSFORM_WORKERS", "2"))
+SYNC_WRITE_BATCH_SIZE = int(os.getenv("SYNC_WRITE_BATCH_SIZE", "0"))
+# Online Store publication GID (the same setting gang sheet publishing uses). When set, Admin syncs
+# hide products that aren't published there, as the Storefront API would leave them out.
+SHOPIFY_ONLINE_CHANNEL_ID = os.getenv("SHOPIFY_ONLINE_CHANNEL_ID")
+
+# ------------------------------------------------------------------
+# Queries
+# ------------------------------------------------------------------
+def publication_field(publication_id: Optional[str] = SHOPIFY_ONLINE_CHANNEL_ID) -> str:
+    """Product field reporting whether it's on the Online Store ("" when no publication is configured)."""
+    if not publication_id:
+        return ""
+    return f"publishedOnPublication(publicationId: {json.dumps(publication_id)})"
+
+
+# Admin queries see every product, so they select `status` (and publication) and
+# the store hides anything the storefront shouldn't list (catalog_store.is_listed).
+# Products aren't filtered out here: a delta sync has to see a product go to
+# draft to hide it.
+ADMIN_PRODUCTS_QUERY = """
+query syncProducts($first: Int!, $after: String, $query: String, $variantsFirst: Int!, $imagesFirst: Int!) {
+  products(first: $first, after: $after, query: $query, sortKey: UPDATED_AT) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      id
+      title
+      handle
+      description
+      updatedAt
+      status
+      %s
+      images(first: $imagesFirst) { nodes { url } }
+      variants(first: $variantsFirst) {
+        pageInfo { hasNextPage endCursor }
+        nodes { id title price availableForSale }
+      }
+    }
+  }
+}
+""" % publication_field()
+
+ADMIN_VARIANTS_QUERY = """
+query syncProductVariants($id: ID!, $first: Int!, $after: String) {
+  product(id: $id) {
+    variants(first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id title price availableForSale }
+    }
+  }
+}
+"""
+
+DELETION_EVENTS_QUERY = """
+query productDeletions($first: Int!, $after: String, $query: String) {
+  deletionEvents(first: $first, after: $after, query: $query, subjectTypes: [PRODUCT]) {
+    pageInfo { hasNextPage endCursor }
+    nodes { subjectId occurredAt }
+  }
+}
+"""
+
+STOREFRONT_PRODUCTS_QUERY = """
+query storefrontProducts($first: Int!, $after: String, $query: String, $variantsFirst: Int!, $imagesFirst: Int!) {
+  products(first: $first, after: $after, query: $query, sortKey: UPDATED_AT) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      id
+      title
+      handle
+      description
+      updatedAt
+      images(first: $imagesFirst) { nodes { url } }
+      variants(first: $variantsFirst) {
+        pageInfo { hasNextPage endCursor }
+        nodes { id title price { amount currencyCode } availableForSale }
+      }
+    }
+  }
+}
+"""
+
+STOREFRONT_VARIANTS_QUERY = """
+query storefrontProductVariants($id: ID!, $first: Int!, $after: String) {
+  product(id: $id) {
+    variants(first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id title price { amount currencyCode } availableForSale }
+    }
+  }
+}
+"""
+
+
+# ------------------------------------------------------------------
+# Normalization (one shape for every source; matches the products table)
+# ------------------------------------------------------------------
+def _money(value: Any) -> float:
+    if isinstance(value, dict):
+        value = value.get("amount")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def normalize_graphql_product(node: Dict[str, Any], variant_nodes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    images = [img["url"] for img in (node.get("images") or {}).get("nodes", []) if img.get("url")]
+    variants = [
+        {
+            "shopify_id": v["id"],
+            "title": v.get("title"),
+            "price": _money(v.get("price")),
+            "available": v.get("availableForSale", True),
+        }
+        for v in variant_nodes
+    ]
+    return {
+        "shopify_id": node["id"],
+        "name": node.get("title"),
+        "handle": node.get("handle"),
+        "description": node.get("description") or "",
+        "price": variants[0]["price"] if variants else 0.0,
+        "image": images[0] if images else None,
+        "images": images,
+        "variants": variants,
+        "status": node.get("status"),
+        "published": node.get("publishedOnPublication"),
+        "updated_at": node.get("updatedAt"),
+    }
+
+
+def _rest_variant_available(v: Dict[str, Any]) -> bool:
+    # REST has no availableForSale; derive it the way Shopify does for tracked inventory.
+    if not v.get("inventory_management"):
+        return True
+    return (v.get("inventory_quantity") or 0) > 0 or v.get("inventory_policy") == "continue"
+
+
+def normalize_rest_product(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize an Admin REST product (also the products/* webhook payload)."""
+    images = [img["src"] for img in p.get("images") or [] if img.get("src")]
+    if not images and (p.get("image") or {}).get("src"):
+        images = [p["image"]["src"]]
+    variants = [
+        {
+            "shopify_id": v.get("admin_graphql_api_id") or build_variant_gid_from_numeric(v["id"]),
+            "title": v.get("title"),
+            "price": _money(v.get("price")),
+            "available": _rest_variant_available(v),
+        }
+        for v in p.get("variants") or []
+    ]
+    return {
+        "shopify_id": p.get("admin_graphql_api_id") or build_product_gid_from_numeric(p["id"]),
+        "name": p.get("title"),
+        "handle": p.get("handle"),
+        "description": p.get("body_html") or "",
+        "price": variants[0]["price"] if variants else 0.0,
+        "image": images[0] if images else None,
+        "images": images,
+        "variants": variants,
+        "status": p.get("status"),
+        # REST's published_at is the Online Store publication; null means unpublished.
+        "published": p["published_at"] is not None if "published_at" in p else None,
+        "updated_at": p.get("updated_at"),
+    }
+
+
+# ------------------------------------------------------------------
+# Query cost
+# ------------------------------------------------------------------
+def products_query_cost(first: int, variants_first: int = VARIANT_PAGE_SIZE, images_first: int = IMAGE_LIMIT) -> int:
+    """
+    Requested cost of one products page, the way Shopify computes it: a
+    connection costs 2 plus `first` times the cost of each node, and each
+    product node is 1 plus its own variants and images connections.
+    """
+    return 2 + first * (1 + (2 + variants_first) + (2 + images_first))
+
+
+def max_product_page_size(budget: int = SHOPIFY_MAX_QUERY_COST) -> int:
+    """Largest products page whose requested cost fits in `budget`."""
+    per_product = products_query_cost(1) - products_query_cost(0)
+    return max(1, (budget - products_query_cost(0)) // per_product)
+
+
+def _is_cost_exceeded(error: ShopifyGraphQLError) -> bool:
+    errors = error.errors if isinstance(error.errors, list) else [error.errors]
+    return any(
+        isinstance(e, dict) and (e.get("extensions") or {}).get("code") == "MAX_COST_EXCEEDED"
+        for e in errors
+    )
+
+
+# ------------------------------------------------------------------
+# Page iterators
+# ------------------------------------------------------------------
+GraphQLRunner = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+async def _remaining_variants(run: GraphQLRunner, variants_query: str, product_id: str, after: str) -> List[Dict[str, Any]]:
+    nodes: List[Dict[str, Any]] = []
+    while after:
+        data = await run(variants_query, {"id": product_id, "first": VARIANT_PAGE_SIZE, "after": after})
+        connection = (data.get("product") or {}).get("variants") or {}
+        nodes.extend(connection.get("nodes", []))
+        page = connection.get("pageInfo") or {}
+        after = page.get("endCursor") if page.get("hasNextPage") else None
+    return nodes
+
+
+async def _iter_graphql_pages(
+    run: GraphQLRunner,
+    products_query: str,
+    variants_query: str,
+    page_size: int,
+    search: Optional[str],
+    after: Optional[str],
+) -> AsyncIterator[Dict[str, Any]]:
+    limit = max_product_page_size()
+    if page_size > limit:
+        logger.warning(
+            "Product page size %s would cost %s points (limit %s); using %s",
+            page_size, products_query_cost(page_size), SHOPIFY_MAX_QUERY_COST, limit,
+        )
+        page_size = limit
+    while True:
+        variables = {
+            "first": page_size,
+            "after": after,
+            "query": search,
+            "variantsFirst": VARIANT_PAGE_SIZE,
+            "imagesFirst": IMAGE_LIMIT,
+        }
+        try:
+            data = await run(products_query, variables)
+        except ShopifyGraphQLError as e:
+            # Shopify's cost model can move; halve the page rather than fail the sync.
+            if not _is_cost_exceeded(e) or page_size == 1:
+                raise
+            page_size = max(1, page_size // 2)
+            logger.warning("Products query cost exceeded; retrying with %s products per page", page_size)
+            continue
+        connection = data.get("products") or {}
+        products = []
+        for node in connection.get("nodes", []):
+            variants = node.get("variants") or {}
+            variant_nodes = list(variants.get("nodes", []))
+            variant_page = variants.get("pageInfo") or {}
+            if variant_page.get("hasNextPage"):
+                variant_nodes += await _remaining_variants(run, variants_query, node["id"], variant_page["endCursor"])
+            products.append(normalize_graphql_product(node, variant_nodes))
+
+        page = connection.get("pageInfo") or {}
+        after = page.get("endCursor") or after
+        yield {"products": products, "cursor": after}
+        if not page.get("hasNextPage"):
+            return
+
+
+def iter_admin_product_pages(
+    client: ShopifyClient,
+    page_size: int = PRODUCT_PAGE_SIZE,
+    search: Optional[str] = None,
+    after: Optional[str] = None,
+    priority: Priority = Priority.SYNC,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Walk every product via Admin GraphQL `pageInfo.endCursor`, yielding {"products", "cursor"} pages."""
+    async def run(query, variables):
+        return await client.admin_graphql(query, variables, priority=priority)
+    return _iter_graphql_pages(run, ADMIN_PRODUCTS_QUERY, ADMIN_VARIANTS_QUERY, page_size, search, after)
+
+
+def iter_storefront_product_pages(
+    client: ShopifyClient,
+    page_size: int = PRODUCT_PAGE_SIZE,
+    search: Optional[str] = None,
+    after: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Walk every published product via the Storefront API."""
+    async def run(query, variables):
+        return await client.storefront_graphql(query, variables, priority=priority)
+    return _iter_graphql_pages(run, STOREFRONT_PRODUCTS_QUERY, STOREFRONT_VARIANTS_QUERY, page_size, search, after)
+
+
+async def iter_rest_product_pages(
+    client: ShopifyClient,
+    page_size: int = REST_PAGE_SIZE,
+    params: Optional[Dict[str, Any]] = None,
+    priority: Priority = Priority.SYNC,
+    after: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Walk /products.json by following the `Link: <...>; rel="next"` header. `after` resumes from a saved next link."""
+    url = after or "products.json"
+    request_params = None if after else {"limit": page_size, **(params or {})}
+    while url:
+        response = await client.rest("GET", url, params=request_params, priority=priority)
+        products = [normalize_rest_product(p) for p in response.json().get("products", [])]
+        next_url = response.links.get("next", {}).get("url")
+        yield {"products": products, "cursor": next_url}
+        # page_info links already carry every parameter Shopify allows alongside them.
+        url, request_params = next_url, None
+
+
+async def iter_deleted_product_ids(
+    client: ShopifyClient,
+    since: datetime,
+    priority: Priority = Priority.SYNC,
+) -> AsyncIterator[List[str]]:
+    """Yield pages of product GIDs deleted in Shopify after `since`."""
+    after = None
+    while True:
+        data = await client.admin_graphql(
+            DELETION_EVENTS_QUERY,
+            {"first": 250, "after": after, "query": f"occurred_at:>'{_search_time(since)}'"},
+            priority=priority,
+        )
+        connection = data.get("deletionEvents") or {}
+        yield [
+            subject if str(subject).startswith("gid://") else build_product_gid_from_numeric(subject)
+            for subject in (node.get("subjectId") for node in connection.get("nodes", []))
+            if subject
+        ]
+        page = connection.get("pageInfo") or {}
+        if not page.get("hasNextPage"):
+            return
+        after = page.get("endCursor")
+
+
+def _search_time(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# ------------------------------------------------------------------
+# Sync engine
+# ------------------------------------------------------------------
+RowWriter = Callable[[List[Dict[str, Any]]], Awaitable[int]]
+PageCheckpoint = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def sync_catalog(
+    pages: AsyncIterator[Dict[str, Any]],
+    write: RowWriter = save_product_rows,
+    prefetch: int = 2,
+    checkpoint: Optional[PageCheckpoint] = None,
+    workers: int = SYNC_TRANSFORM_WORKERS,
+    batch_size: int = SYNC_WRITE_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Drain a page iterator into the database as a fetch -> transform -> write pipeline.
+
+    One fetcher walks the cursor (pagination can't be fanned out) and keeps up to
+    `prefetch` pages queued. `workers` transformers turn pages into upsert rows
+    off the event loop, so hashing doesn't stall the fetcher. A single writer
+    commits rows in page order, batching pages until at least `batch_size` rows
+    are pending, then runs `checkpoint` with the last committed page (e.g. to
+    persist its cursor), so a resumed run never skips uncommitted pages.
+    """
+    pages_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+    rows_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+    done = object()
+    started = time.monotonic()
+    workers = max(1, workers)
+
+    async def fetch():
+        seq = 0
+        try:
+            async for page in pages:
+                await pages_queue.put((seq, page))
+                seq += 1
+            end = done
+        except Exception as e:
+            # Handed to the writer in sequence, after the pages already fetched.
+            end = e
+        for _ in range(workers):
+            await pages_queue.put(None)
+        await rows_queue.put((seq, None, end))
+
+    async def transform():
+        while True:
+            item = await pages_queue.get()
+            if item is None:
+                return
+            seq, page = item
+            try:
+                rows = await asyncio.to_thread(product_rows, page["products"])
+            except Exception as e:
+                rows = e
+            await rows_queue.put((seq, page, rows))
+
+    tasks = [asyncio.create_task(fetch())] + [asyncio.create_task(transform()) for _ in range(workers)]
+    stats = {"pages": 0, "products": 0, "batches": 0}
+    batch: List[Dict[str, Any]] = []
+    batch_pages: List[Dict[str, Any]] = []
+
+    async def commit():
+        stats["products"] += await write(batch)
+        stats["pages"] += len(batch_pages)
+        stats["batches"] += 1
+        stats["cursor"] = batch_pages[-1].get("cursor")
+        if checkpoint is not None:
+            await checkpoint(batch_pages[-1])
+        batch.clear()
+        batch_pages.clear()
+
+    try:
+        # Transformers finish out of order; hold results until their turn.
+        pending: Dict[int, Any] = {}
+        next_seq = 0
+        finished = False
+        while not finished:
+            seq, page, rows = await rows_queue.get()
+            pending[seq] = (page, rows)
+            while next_seq in pending and not finished:
+                page, rows = pending.pop(next_seq)
+                next_seq += 1
+                if rows is done or isinstance(rows, Exception):
+                    if batch_pages:
+                        await commit()
+                    if rows is not done:
+                        raise rows
+                    finished = True
+                    continue
+                batch.extend(rows)
+                batch_pages.append(page)
+                if len(batch) >= batch_size:
+                    await commit()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    logger.info(
+        "✅ Catalog sync wrote %s products in %s pages / %s transactions (%ss)",
+        stats["products"], stats["pages"], stats["batches"], stats["seconds"],
+    )
+    return stats
+
+
+async def run_sync(
+    mode: str = "delta",
+    client: Optional[ShopifyClient] = None,
+    page_size: int = PRODUCT_PAGE_SIZE,
+    resume: bool = True,
+    workers: int = SYNC_TRANSFORM_WORKERS,
+    batch_size: int = SYNC_WRITE_BATCH_SIZE,
+    prefetch: int = 2,
+) -> Dict[str, Any]:
+    """
+    Sync the local catalog from Admin GraphQL.
+
+    "full" walks every product and tombstones local rows Shopify no longer has.
+    "delta" only asks for products updated since the stored watermark and
+    tombstones products from deletionEvents, so its cost follows what changed.
+    A delta run without a watermark falls back to full. An unfinished run of the
+    same mode resumes from its last committed cursor.
+    """
+    client = client or get_shopify_client()
+    state = await load_sync_state(SYNC_STATE_NAME)
+    if mode == "delta" and not (state and state.watermark):
+        logger.info("No sync watermark yet; running a full sync")
+        mode = "full"
+
+    search = None
+    since = None
+    if mode == "delta":
+        since = state.watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        search = f"updated_at:>'{_search_time(since)}'"
+    after = state.cursor if resume and state and state.mode == mode and state.cursor else None
+    if after:
+        logger.info("Resuming %s sync from cursor %s", mode, after)
+
+    newest = state.watermark if state else None
+    seen: set = set()
+
+    async def write(rows: List[Dict[str, Any]]) -> int:
+        nonlocal newest
+        written = await save_product_rows(rows)
+        for row in rows:
+            seen.add(row["shopify_id"])
+            updated = row["shopify_updated_at"]
+            if updated and (newest is None or updated > newest):
+                newest = updated
+        return written
+
+    async def checkpoint(page: Dict[str, Any]):
+        await save_sync_state(SYNC_STATE_NAME, cursor=page.get("cursor"))
+
+    await save_sync_state(SYNC_STATE_NAME, mode=mode, last_started_at=datetime.utcnow())
+    stats = await sync_catalog(
+        iter_admin_product_pages(client, page_size=page_size, search=search, after=after),
+        write=write,
+        checkpoint=checkpoint,
+        prefetch=prefetch,
+        workers=workers,
+        batch_size=batch_size,
+    )
+
+    deleted = 0
+    if mode == "delta":
+        async for ids in iter_deleted_product_ids(client, since):
+            deleted += await tombstone_products(ids)
+    elif after is None:
+        deleted = await tombstone_products_not_in(seen)
+    else:
+        # A resumed full walk didn't see the earlier pages, so it can't tell what's missing.
+        logger.info("Skipping deletion sweep for resumed full sync")
+
+    await save_sync_state(
+        SYNC_STATE_NAME,
+        watermark=newest,
+        cursor=None,
+        products_synced=stats["products"],
+        last_completed_at=datetime.utcnow(),
+    )
+    stats.update({"mode": mode, "deleted": deleted, "watermark": newest.isoformat() if newest else None})
+    logger.info("✅ %s sync done: %s updated, %s tombstoned", mode, stats["products"], deleted)
+    return stats
+
+
+async def run_rest_sync(
+    client: Optional[ShopifyClient] = None,
+    page_size: int = REST_PAGE_SIZE,
+    resume: bool = True,
+    workers: int = SYNC_TRANSFORM_WORKERS,
+    batch_size: int = SYNC_WRITE_BATCH_SIZE,
+    prefetch: int = 2,
+) -> Dict[str, Any]:
+    """
+    Sync every product through the Admin REST API (no watermark, no tombstones).
+
+    The next-page link is checkpointed after each committed batch, so an
+    interrupted run resumes where it stopped.
+    """
+    client = client or get_shopify_client()
+    state = await load_sync_state(REST_SYNC_STATE_NAME)
+    after = state.cursor if resume and state and state.cursor else None
+    if after:
+        logger.info("Resuming rest sync from %s", after)
+
+    async def checkpoint(page: Dict[str, Any]):
+        await save_sync_state(REST_SYNC_STATE_NAME, cursor=page.get("cursor"))
+
+    await save_sync_state(REST_SYNC_STATE_NAME, mode="rest", last_started_at=datetime.utcnow())
+    stats = await sync_catalog(
+        iter_rest_product_pages(client, page_size=page_size, after=after),
+        checkpoint=checkpoint,
+        prefetch=prefetch,
+        workers=workers,
+        batch_size=batch_size,
+    )
+    await save_sync_state(
+        REST_SYNC_STATE_NAME,
+        cursor=None,
+        products_synced=stats["products"],
+        last_completed_at=datetime.utcnow(),
+    )
+    stats.update({"mode": "rest", "deleted": 0})
+    return stats
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from services.catalog_cache import get_catalog_cache
+from services.catalog_store import parse_shopify_datetime, save_products, tombstone_products
+
+logger = logging.getLogger("catalog_updater")
+
+# How long to hold events so bursts of updates to the same product collapse into one write.
+CATALOG_UPDATE_WINDOW_SECONDS = float(os.getenv("CATALOG_UPDATE_WINDOW_SECONDS", "2"))
+CATALOG_UPDATE_MAX_BATCH = int(os.getenv("CATALOG_UPDATE_MAX_BATCH", "200"))
+
+# Sentinel stored in the pending map for a deletion.
+_DELETED = None
+
+
+class CatalogUpdater:
+    """
+    Applies product change events (webhooks) to the local catalog in batches.
+
+    Events are keyed by product GID, so repeated updates to one product inside
+    the window keep only the newest payload. Shopify may deliver webhooks out of
+    order; an update older than the one already pending is dropped, a pending
+    deletion wins over any update, and the store itself ignores payloads older
+    than the product it holds. Updates to draft or archived products hide them
+    (see catalog_store.is_listed) until they are active again.
+    """
+
+    def __init__(
+        self,
+        window: float = CATALOG_UPDATE_WINDOW_SECONDS,
+        max_batch: int = CATALOG_UPDATE_MAX_BATCH,
+    ):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"received": 0, "coalesced": 0, "upserted": 0, "deleted": 0}
+
+    # --- producers ---
+    def submit_upsert(self, product: Dict[str, Any]):
+        """Queue a normalized product (see catalog_sync.normalize_rest_product)."""
+        key = product["shopify_id"]
+        self.stats["received"] += 1
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+            queued = self._pending[key]
+            # Product IDs are never reused, so a late update can't revive a deletion.
+            if queued is _DELETED or _is_older(product, queued):
+                return
+        self._pending[key] = product
+        self._wake()
+
+    def submit_delete(self, shopify_id: str):
+        self.stats["received"] += 1
+        if shopify_id in self._pending:
+            self.stats["coalesced"] += 1
+        self._pending[shopify_id] = _DELETED
+        self._wake()
+
+    def _wake(self):
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    # --- consumer ---
+    async def flush(self) -> int:
+        """Apply everything pending now. Returns the number of products touched."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        upserts = [p for p in pending.values() if p is not _DELETED]
+        deletes = [key for key, p in pending.items() if p is _DELETED]
+        try:
+            if upserts:
+                self.stats["upserted"] += await save_products(upserts)
+            if deletes:
+                self.stats["deleted"] += await tombstone_products(deletes)
+        except BaseException:
+            # Put the batch back unless newer events for the same products arrived meanwhile.
+            for key, value in pending.items():
+                self._pending.setdefault(key, value)
+            raise
+        get_catalog_cache().invalidate()
+        logger.info("🔄 Applied %s product updates and %s deletions from webhooks", len(upserts), len(deletes))
+        return len(pending)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let the window fill, but cut it short once a full batch is queued.
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Catalog update batch failed, retrying next window: {e}")
+                self._wakeup.set()
+                await asyncio.sleep(self.window)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the background loop and apply whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _is_older(product: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    mine = parse_shopify_datetime(product.get("updated_at"))
+    theirs = parse_shopify_datetime(other.get("updated_at"))
+    return bool(mine and theirs and mine < theirs)
+
+
+# Module-level singleton
+catalog_updater = CatalogUpdater()
+
+
+def get_catalog_updater() -> CatalogUpdater:
+    return catalog_updater
@@ -1,6 +1,9 @@
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 import os
+import json
+from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 import logging
@@ -12,8 +15,100 @@ logger = logging.getLogger("database")
 logging.basicConfig(level=logging.INFO)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./presm.db")
+# Engine settings: "prod" (default), "dev" (logs every statement) or "bench" (not crash-safe).
+DB_PROFILE = os.getenv("DB_PROFILE", "prod")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Pragmas are applied to every new SQLite connection; the pool sizes bound concurrent connections.
+# WAL lets readers run alongside the writer, and with WAL synchronous=NORMAL only risks the last
+# transactions on power loss, never corruption. Negative cache_size is in KiB.
+DB_PROFILES = {
+    "dev": {
+        "echo": True,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "cache_size": -16000,
+        },
+    },
+    "prod": {
+        "echo": False,
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+    },
+    "bench": {
+        "echo": False,
+        "pool_size": 20,
+        "max_overflow": 20,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "busy_timeout": 10000,
+            "cache_size": -131072,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+        },
+    },
+}
+
+
+def make_engine(url: str, settings: dict, role: str = "default"):
+    """
+    Async engine for `url` with a profile's settings (see DB_PROFILES).
+
+    role="read" makes every connection read-only (PRAGMA query_only).
+    role="write" is the single connection the database writer owns: its
+    transactions start with BEGIN IMMEDIATE, so the write lock is taken (or
+    waited for, up to busy_timeout) up front instead of failing mid-transaction,
+    and the driver's own transaction handling is switched off so SAVEPOINTs work.
+    """
+    kwargs = {"echo": settings.get("echo", False)}
+    if ":memory:" not in url:
+        if role == "write":
+            kwargs.update(pool_size=1, max_overflow=0)
+        else:
+            kwargs.update(pool_size=settings.get("pool_size", 5), max_overflow=settings.get("max_overflow", 10))
+    new_engine = create_async_engine(url, **kwargs)
+    if new_engine.dialect.name != "sqlite":
+        return new_engine
+    pragmas = dict(settings.get("pragmas") or {})
+    if role == "read":
+        pragmas["query_only"] = "ON"
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, _record):
+        if role == "write":
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    if role == "write":
+        @event.listens_for(new_engine.sync_engine, "begin")
+        def _on_begin(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return new_engine
+
+
+def create_engine_for(url: str = DATABASE_URL, profile: str = DB_PROFILE, role: str = "default"):
+    if profile not in DB_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE {profile!r}; expected one of {sorted(DB_PROFILES)}")
+    return make_engine(url, DB_PROFILES[profile], role)
+
+
+engine = create_engine_for(DATABASE_URL, DB_PROFILE)
 
 SessionLocal = sessionmaker(
     bind=engine,
@@ -21,14 +116,134 @@ SessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+# Reads use their own pool of read-only connections; with WAL they never wait on the writer.
+# Writes go through services.db_writer, which owns the single write connection.
+# An in-memory database exists per connection, so there everything shares the one engine.
+if ":memory:" in DATABASE_URL:
+    read_engine = write_engine = engine
+else:
+    read_engine = create_engine_for(DATABASE_URL, DB_PROFILE, role="read")
+    write_engine = create_engine_for(DATABASE_URL, DB_PROFILE, role="write")
+
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
+WriteSessionLocal = sessionmaker(bind=write_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_session():
+    """FastAPI dependency: one read-only session per request, closed when the response is done."""
+    async with ReadSessionLocal() as session:
+        yield session
+
+def _add_missing_columns(sync_conn, metadata):
+    """
+    create_all() never alters existing tables, so add columns (and indexes) that
+    newer models define but an older database file lacks. Only nullable/defaulted
+    columns are added, which is all SQLite's ADD COLUMN allows anyway.
+    """
+    inspector = inspect(sync_conn)
+    for table in metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            # A server default also fills the column on every existing row.
+            default = f" DEFAULT {column.server_default.arg.text}" if column.server_default is not None else ""
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}{default}'))
+            logger.info(f"🔧 Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+def _migrate_cart_items(sync_conn):
+    """
+    Move carts still holding the old JSON `items` list into cart_items rows,
+    merging duplicate variants, then clear the JSON so each cart moves once.
+    """
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from models.cart import CartItem
+
+    table = CartItem.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.cart_id, table.c.variant_id],
+        set_={"quantity": table.c.quantity + stmt.excluded.quantity},
+    )
+    carts = sync_conn.execute(text("SELECT id, items FROM carts WHERE items IS NOT NULL")).all()
+    moved = 0
+    for cart_id, items in carts:
+        # Older writes sometimes stored the list as a JSON string inside the JSON column.
+        while isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except ValueError:
+                items = []
+        now = datetime.utcnow()
+        rows = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict) or not item.get("variant_id"):
+                continue
+            variant_id = str(item["variant_id"])
+            if not variant_id.startswith("gid://"):
+                variant_id = f"gid://shopify/ProductVariant/{variant_id}"
+            row = rows.setdefault(variant_id, {
+                "cart_id": cart_id,
+                "product_id": str(item.get("product_id") or ""),
+                "variant_id": variant_id,
+                "name": item.get("name"),
+                "price": float(item.get("price") or 0),
+                "quantity": 0,
+                "created_at": now,
+                "updated_at": now,
+            })
+            row["quantity"] += int(item.get("quantity") or 1)
+        if rows:
+            sync_conn.execute(stmt, list(rows.values()))
+        sync_conn.execute(text("UPDATE carts SET items = NULL WHERE id = :id"), {"id": cart_id})
+        moved += 1
+    if moved:
+        logger.info(f"🔧 Moved {moved} JSON carts into cart_items")
+
+
+def _backfill_cart_versions(sync_conn):
+    """Carts from before carts.version (or migrated before it had a default) start at version 0."""
+    result = sync_conn.execute(text("UPDATE carts SET version = 0 WHERE version IS NULL"))
+    if result.rowcount:
+        logger.info(f"🔧 Set version 0 on {result.rowcount} carts")
+
+
+def _backfill_product_variants(sync_conn):
+    """Fill product_variants from the products' JSON variants the first time the table exists."""
+    from sqlalchemy import select
+    from models.product import Product, ProductVariant
+    from services.catalog_store import variant_upsert_statement, variant_rows
+
+    if sync_conn.execute(select(ProductVariant.id).limit(1)).first() is not None:
+        return
+    products = sync_conn.execute(
+        select(Product.shopify_id, Product.name, Product.variants).where(Product.deleted_at.is_(None))
+    ).mappings().all()
+    rows = variant_rows(products)
+    if rows:
+        sync_conn.execute(variant_upsert_statement(), rows)
+        logger.info(f"🔧 Indexed {len(rows)} product variants")
+
+
 async def init_db():
     """Initialize the database and create tables."""
     async with engine.begin() as conn:
         # Import models to register them with Base
         from models.product import Base as ProductBase
         from models.cart import Base as CartBase
+        from models.idempotency import Base as IdempotencyBase
+        from models.sync_state import Base as SyncStateBase
+        from models.shopify_cart import Base as ShopifyCartBase
         
         # Create all tables using a shared metadata if possible, but since separate Bases, create separately
-        await conn.run_sync(ProductBase.metadata.create_all)
-        await conn.run_sync(CartBase.metadata.create_all)
-        logger.info("✅ Created tables: products, carts")
\ No newline at end of file
+        for base in (ProductBase, CartBase, IdempotencyBase, SyncStateBase, ShopifyCartBase):
+            await conn.run_sync(base.metadata.create_all)
+            await conn.run_sync(_add_missing_columns, base.metadata)
+        await conn.run_sync(_migrate_cart_items)
+        await conn.run_sync(_backfill_cart_versions)
+        await conn.run_sync(_backfill_product_variants)
+        logger.info("✅ Created tables: products, carts, cart_items, cart_log, idempotency_keys, sync_state")
@@ -0,0 +1,157 @@
+import os
+import asyncio
+import logging
+import random
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.database import WriteSessionLocal
+
+logger = logging.getLogger("db_writer")
+
+# Write jobs committed together in one transaction (group commit).
+DB_WRITE_BATCH_MAX = int(os.getenv("DB_WRITE_BATCH_MAX", "64"))
+# Whole-batch retries when another process holds the write lock past busy_timeout.
+DB_WRITE_LOCK_RETRIES = int(os.getenv("DB_WRITE_LOCK_RETRIES", "3"))
+
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+# Set while a job runs on the writer, so a job that calls run() again joins its transaction.
+_writer_session: ContextVar[Optional[AsyncSession]] = ContextVar("db_writer_session", default=None)
+
+
+def _is_locked(error: OperationalError) -> bool:
+    message = str(error.orig if error.orig is not None else error).lower()
+    return "locked" in message or "busy" in message
+
+
+class DatabaseWriter:
+    """
+    The process's only database writer: write jobs are queued and run one at a
+    time by a single task on a single connection.
+
+    A job is an async function taking the session; it runs inside a SAVEPOINT
+    of a transaction shared with whatever else was queued meanwhile (up to
+    DB_WRITE_BATCH_MAX jobs), and the whole batch is committed at once. A job
+    that raises is rolled back to its savepoint alone and its caller gets the
+    exception; the others still commit. Callers are resumed only after the
+    commit, so anything they do with the result (caches, responses) happens
+    on durable data.
+
+    Requests never compete with each other for SQLite's write lock any more;
+    only other processes can, and the writer waits for them at BEGIN
+    IMMEDIATE. Before `start` (scripts, one-off tools) jobs simply run in
+    their own transaction.
+    """
+
+    def __init__(self, session_factory=WriteSessionLocal, batch_max: int = DB_WRITE_BATCH_MAX):
+        self.session_factory = session_factory
+        self.batch_max = batch_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"jobs": 0, "commits": 0, "failed": 0, "lock_retries": 0}
+
+    async def run(self, work: WriteJob) -> Any:
+        """Run `work(session)` in a write transaction and return its result once committed."""
+        session = _writer_session.get()
+        if session is not None:
+            # Already on the writer: nest inside the current job rather than queue behind it.
+            async with session.begin_nested():
+                return await work(session)
+        if self._task is None:
+            return (await self._commit([(work, None)]))[0].result()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((work, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_max and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # None is stop()'s marker: everything queued before it is still written.
+            stopping = None in batch
+            # Callers that gave up (cancelled) don't get written.
+            batch = [(work, future) for work, future in filter(None, batch) if not future.done()]
+            if not batch:
+                continue
+            try:
+                outcomes = await self._commit(batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"❌ Write batch of {len(batch)} jobs failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), outcome in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if outcome.exception() is not None:
+                    future.set_exception(outcome.exception())
+                else:
+                    future.set_result(outcome.result())
+
+    async def _commit(self, batch: List[Tuple[WriteJob, Any]]) -> List[asyncio.Future]:
+        """Run the batch's jobs in one transaction; one settled future per job."""
+        for attempt in range(DB_WRITE_LOCK_RETRIES + 1):
+            try:
+                return await self._commit_once(batch)
+            except OperationalError as e:
+                if not _is_locked(e) or attempt == DB_WRITE_LOCK_RETRIES:
+                    raise
+                self.stats["lock_retries"] += 1
+                await asyncio.sleep(0.05 * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    async def _commit_once(self, batch: List[Tuple[WriteJob, Any]]) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        outcomes = []
+        async with self.session_factory() as session:
+            async with session.begin():
+                token = _writer_session.set(session)
+                try:
+                    for work, _ in batch:
+                        outcome = loop.create_future()
+                        try:
+                            async with session.begin_nested():
+                                outcome.set_result(await work(session))
+                        except OperationalError as e:
+                            if _is_locked(e):
+                                raise
+                            outcome.set_exception(e)
+                        except Exception as e:
+                            outcome.set_exception(e)
+                        outcomes.append(outcome)
+                finally:
+                    _writer_session.reset(token)
+        self.stats["jobs"] += len(batch)
+        self.stats["commits"] += 1
+        return outcomes
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Write everything already queued, then stop the writer task. Writes that
+        arrive meanwhile commit directly instead of queueing behind the marker.
+        """
+        task, self._task = self._task, None
+        if task is None:
+            return
+        await self._queue.put(None)
+        await task
+
+
+# Module-level singleton
+db_writer = DatabaseWriter()
+
+
+def get_db_writer() -> DatabaseWriter:
+    return db_writer
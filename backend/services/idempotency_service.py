@@ -0,0 +1,255 @@
+import os
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.idempotency import IdempotencyRecord
+
+logger = logging.getLogger("idempotency")
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# A claim older than this is assumed to belong to a crashed worker and may be taken over.
+IDEMPOTENCY_STALE_SECONDS = int(os.getenv("IDEMPOTENCY_STALE_SECONDS", "1800"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.5"))
+# How long a duplicate waits on another worker's claim before answering 409 (client retries later).
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+MAX_KEY_LENGTH = 255
+
+# (key, progress) of the attempt running in this task; see IdempotencyService.checkpoint().
+_attempt: contextvars.ContextVar[Optional[Tuple[str, Dict[str, Any]]]] = contextvars.ContextVar(
+    "idempotency_attempt", default=None
+)
+
+
+def request_fingerprint(**fields: Any) -> str:
+    """Stable hash of the request fields that define 'the same request'."""
+    encoded = json.dumps(jsonable_encoder(fields), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotencyService:
+    """
+    Runs a unit of work at most once per Idempotency-Key.
+
+    Duplicates arriving in this process share the same asyncio task; duplicates
+    arriving in another worker see the persisted in_progress claim and poll the
+    store until the owner records the result (taking over a claim whose owner died,
+    and giving up with a 409 after IDEMPOTENCY_WAIT_SECONDS).
+
+    Work that fails before it checkpoints anything releases the key so the client
+    can retry from scratch. Once it has checkpointed a side effect (say, a created
+    Shopify product) the key is kept as "failed" with that progress, and the next
+    attempt -- a waiting duplicate or the client's retry -- resumes from it.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        work: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Return (result, replayed). `replayed` is True when the work was not run for this call."""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            inflight_fingerprint, task = inflight
+            if inflight_fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+            logger.info("Joining in-flight request for Idempotency-Key %s", key)
+            result, _ = await asyncio.shield(task)
+            return result, True
+
+        # Register synchronously so concurrent duplicates in this process join this task.
+        task = asyncio.create_task(self._claim_and_execute(key, fingerprint, work))
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def progress(self) -> Dict[str, Any]:
+        """What earlier attempts with the current Idempotency-Key checkpointed ({} without a key)."""
+        attempt = _attempt.get()
+        return dict(attempt[1]) if attempt else {}
+
+    async def checkpoint(self, **progress: Any):
+        """
+        Persist a side effect the work has just made, before making the next one.
+        A retry after a failure sees it in progress() and skips redoing it.
+        """
+        attempt = _attempt.get()
+        if attempt is None:
+            return
+        key, state = attempt
+        state.update(jsonable_encoder(progress))
+        await get_db_writer().run(lambda session: session.execute(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.key == key)
+            .values(progress=dict(state), updated_at=datetime.utcnow())
+        ))
+
+    async def _claim_and_execute(self, key, fingerprint, work) -> Tuple[Dict[str, Any], bool]:
+        record, progress = await self._claim(key, fingerprint)
+        if record is not None:
+            if record.request_hash != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+            if record.status == "completed":
+                logger.info("Replaying stored response for Idempotency-Key %s", key)
+                return record.response, True
+            return await self._wait_for_owner(key, fingerprint, work), True
+
+        if progress:
+            logger.info("Resuming Idempotency-Key %s from %s", key, sorted(progress))
+        token = _attempt.set((key, progress))
+        try:
+            result = jsonable_encoder(await work())
+        except BaseException:
+            await self._fail(key, progress)
+            raise
+        finally:
+            _attempt.reset(token)
+        await self._complete(key, result)
+        return result, False
+
+    async def _claim(self, key: str, fingerprint: str) -> Tuple[Optional[IdempotencyRecord], Dict[str, Any]]:
+        """
+        Claim the key. Returns (None, progress to resume from) if we now own it,
+        else (the other owner's record, {}).
+        """
+        now = datetime.utcnow()
+
+        async def insert_claim(session):
+            session.add(IdempotencyRecord(
+                key=key,
+                request_hash=fingerprint,
+                status="in_progress",
+                created_at=now,
+                updated_at=now,
+            ))
+            await session.flush()
+
+        try:
+            await get_db_writer().run(insert_claim)
+            return None, {}
+        except IntegrityError:
+            pass
+
+        async with ReadSessionLocal() as session:
+            result = await session.execute(select(IdempotencyRecord).where(IdempotencyRecord.key == key))
+            existing = result.scalars().first()
+        if existing is None:
+            # Released between our insert and select; try once more.
+            return await self._claim(key, fingerprint)
+
+        expired = existing.created_at < now - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        if expired:
+            logger.warning("Taking over expired Idempotency-Key %s", key)
+            await self._release(key, existing.updated_at)
+            return await self._claim(key, fingerprint)
+        if existing.request_hash == fingerprint and (existing.status == "failed" or self._abandoned(existing, now)):
+            # Keep the record: its progress says which side effects already happened.
+            logger.warning("Taking over %s Idempotency-Key %s", existing.status, key)
+            taken = await get_db_writer().run(lambda session: session.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key, IdempotencyRecord.updated_at == existing.updated_at)
+                .values(status="in_progress", updated_at=now)
+            ))
+            if taken.rowcount != 1:
+                # Another waiter took it over first.
+                return await self._claim(key, fingerprint)
+            return None, dict(existing.progress or {})
+        return existing, {}
+
+    @staticmethod
+    def _abandoned(record: IdempotencyRecord, now: datetime) -> bool:
+        return (
+            record.status == "in_progress"
+            and record.updated_at < now - timedelta(seconds=IDEMPOTENCY_STALE_SECONDS)
+        )
+
+    async def _wait_for_owner(self, key, fingerprint, work) -> Dict[str, Any]:
+        """
+        Poll until the worker that owns the claim completes, fails or releases it.
+
+        A claim that failed or goes stale while we wait (its owner was killed) is
+        taken over and resumed; if the owner is alive but still busy after
+        IDEMPOTENCY_WAIT_SECONDS the client gets a 409 and retries later.
+        """
+        logger.info("Waiting on another worker for Idempotency-Key %s", key)
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+            async with ReadSessionLocal() as session:
+                result = await session.execute(select(IdempotencyRecord).where(IdempotencyRecord.key == key))
+                record = result.scalars().first()
+            if record is None or record.status == "failed" or self._abandoned(record, datetime.utcnow()):
+                # Owner failed (released or kept the key) or died (claim went stale): run it ourselves.
+                result, _ = await self._claim_and_execute(key, fingerprint, work)
+                return result
+            if record.status == "completed":
+                return record.response
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": str(max(int(IDEMPOTENCY_POLL_INTERVAL), 1))},
+                )
+
+    async def _complete(self, key: str, response: Dict[str, Any]):
+        async def write(session):
+            record = await session.get(IdempotencyRecord, key)
+            if record is not None:
+                record.status = "completed"
+                record.response = response
+                record.updated_at = datetime.utcnow()
+
+        await get_db_writer().run(write)
+
+    async def _fail(self, key: str, progress: Dict[str, Any]):
+        """Release the key, or keep it as "failed" if the attempt left side effects behind."""
+        if not progress:
+            await self._release(key)
+            return
+        logger.warning("Keeping Idempotency-Key %s after a failed attempt; a retry resumes it", key)
+        await get_db_writer().run(lambda session: session.execute(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.key == key)
+            .values(status="failed", progress=dict(progress), updated_at=datetime.utcnow())
+        ))
+
+    async def _release(self, key: str, updated_at: Optional[datetime] = None):
+        """Delete the claim; with `updated_at`, only if it is still that version (a takeover)."""
+        statement = delete(IdempotencyRecord).where(IdempotencyRecord.key == key)
+        if updated_at is not None:
+            # Another waiter may have taken the key over already; leave its fresh claim alone.
+            statement = statement.where(IdempotencyRecord.updated_at == updated_at)
+        await get_db_writer().run(lambda session: session.execute(statement))
+
+    async def purge_expired(self) -> int:
+        """Delete keys older than the TTL. Returns the number of rows removed."""
+        cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        result = await get_db_writer().run(
+            lambda session: session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.created_at < cutoff))
+        )
+        return result.rowcount or 0
+
+
+idempotency_service = IdempotencyService()
+
+
+def get_idempotency_service():
+    return idempotency_service
@@ -1,88 +1,440 @@
-from typing import Dict, Optional
+import os
+import asyncio
+import copy
+import logging
+import time
+import zlib
+from collections import OrderedDict
 from datetime import datetime
-from models.cart import Cart, CartItem, CartItemCreate, CartItemUpdate
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from sqlalchemy import and_, bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-class InMemoryCartService:
-    """In-memory cart service for development without database"""
-    
+from services.cart_service import (
+    CART_BATCH_MAX_OPERATIONS,
+    CartConflictError,
+    fold_operations,
+    validate_operations,
+    variant_line,
+)
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.cart import Cart, CartItem, CartLogEntry
+from models.product import ProductVariant
+
+logger = logging.getLogger("in_memory_cart_service")
+
+# Independent shards, each with its own lock, so carts in different shards never wait on each other.
+CART_MEMORY_SHARDS = int(os.getenv("CART_MEMORY_SHARDS", "16"))
+# Carts held in memory across all shards; least recently used clean carts are dropped first.
+CART_MEMORY_MAX_CARTS = int(os.getenv("CART_MEMORY_MAX_CARTS", "50000"))
+# How often cart changes are appended to the cart_log table: at most this much is lost in a crash.
+CART_MEMORY_FLUSH_SECONDS = float(os.getenv("CART_MEMORY_FLUSH_SECONDS", "1"))
+# How often the log is folded into the carts / cart_items snapshot and truncated.
+CART_MEMORY_COMPACT_SECONDS = float(os.getenv("CART_MEMORY_COMPACT_SECONDS", "60"))
+# Log entries written or compacted per transaction.
+CART_MEMORY_FLUSH_BATCH = int(os.getenv("CART_MEMORY_FLUSH_BATCH", "500"))
+# How long a variant looked up for a cart line is reused before it is read again.
+CART_MEMORY_VARIANT_TTL_SECONDS = float(os.getenv("CART_MEMORY_VARIANT_TTL_SECONDS", "60"))
+
+CARTS = Cart.__table__
+CART_ITEMS = CartItem.__table__
+CART_LOG = CartLogEntry.__table__
+
+
+class _Shard:
     def __init__(self):
-        self.carts: Dict[str, Cart] = {}
-    
-    async def get_or_create_cart(self, session_id: str, user_id: Optional[str] = None) -> Cart:
-        """Get existing cart or create new one"""
-        if session_id not in self.carts:
-            self.carts[session_id] = Cart(
-                session_id=session_id,
-                user_id=user_id,
-                items=[]
-            )
-        return self.carts[session_id]
-    
-    async def add_item_to_cart(self, session_id: str, item_data: CartItemCreate) -> Optional[Cart]:
-        """Add item to cart"""
-        cart = await self.get_or_create_cart(session_id)
-        
-        # Create cart item from provided data
-        cart_item = CartItem(
-            product_id=item_data.product_id,
-            variant_id=getattr(item_data, 'variant_id', None),
-            name=item_data.name,
-            price=item_data.price,
-            image=getattr(item_data, 'image', ''),
-            description=getattr(item_data, 'description', ''),
-            quantity=item_data.quantity,
-            options=item_data.options if hasattr(item_data, 'options') else {}
-        )
-        
-        # Check if item already exists
-        existing_item = None
-        for item in cart.items:
-            if item.product_id == cart_item.product_id and item.variant_id == cart_item.variant_id:
-                existing_item = item
-                break
-        
-        if existing_item:
-            existing_item.quantity += cart_item.quantity
+        self.lock = asyncio.Lock()
+        # session_id -> cart dict ("items" is {variant GID: line}, in insertion order)
+        self.carts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Changes not yet in cart_log, oldest first; their sessions are dirty and never evicted.
+        self.log: List[Dict[str, Any]] = []
+        self.dirty: set = set()
+
+
+class InMemoryCartService:
+    """
+    Carts kept in process memory, with the same interface as CartService.
+
+    Carts are spread over CART_MEMORY_SHARDS shards by a stable hash of the
+    session ID; every operation on a cart runs under its shard's lock and
+    touches no database, apart from loading a cart on a miss and resolving
+    variants (cached for CART_MEMORY_VARIANT_TTL_SECONDS).
+
+    Every change is recorded as the lines it set or removed, and a
+    background task appends those records to the cart_log table every
+    CART_MEMORY_FLUSH_SECONDS, so the write per interval is proportional to
+    what changed rather than to the size of the carts. Every
+    CART_MEMORY_COMPACT_SECONDS the log is folded into the carts / cart_items
+    snapshot (upserting changed lines, deleting removed ones) and truncated.
+    A cart is loaded, lazily, as its snapshot with its log replayed on top,
+    so a crash loses at most the last flush interval. Only carts whose
+    changes are all in the log are evicted when a shard is over its share
+    of CART_MEMORY_MAX_CARTS.
+
+    One process owns the carts: this backend is for single-worker deployments
+    (CART_BACKEND=memory); use CartService for several workers.
+    """
+
+    def __init__(
+        self,
+        shards: int = CART_MEMORY_SHARDS,
+        max_carts: int = CART_MEMORY_MAX_CARTS,
+        flush_interval: float = CART_MEMORY_FLUSH_SECONDS,
+        compact_interval: float = CART_MEMORY_COMPACT_SECONDS,
+        variant_ttl: float = CART_MEMORY_VARIANT_TTL_SECONDS,
+    ):
+        self._shards = [_Shard() for _ in range(shards)]
+        self.max_per_shard = max(1, max_carts // shards)
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.variant_ttl = variant_ttl
+        self._variants: Dict[int, Tuple[ProductVariant, float]] = {}
+        # Keeps log appends in order and compaction from running alongside them.
+        self._log_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "loads": 0, "evicted": 0, "flushed": 0, "flushes": 0, "compacted": 0}
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[zlib.crc32(session_id.encode()) % len(self._shards)]
+
+    # --- cart state (call with the shard lock held) ---
+    async def _load(self, shard: _Shard, session_id: str, create: bool) -> Optional[Dict[str, Any]]:
+        cart = shard.carts.get(session_id)
+        if cart is not None:
+            self.stats["hits"] += 1
+            shard.carts.move_to_end(session_id)
+            return cart
+        async with ReadSessionLocal() as session:
+            row = (await session.execute(select(Cart).where(Cart.session_id == session_id))).scalars().first()
+            entries = (await session.execute(
+                select(CartLogEntry).where(CartLogEntry.session_id == session_id).order_by(CartLogEntry.id)
+            )).scalars().all()
+        if row is not None or entries:
+            self.stats["loads"] += 1
+            # A cart not compacted yet has no snapshot row; its first log entry is its creation.
+            created_at = row.created_at if row is not None else entries[0].created_at
+            cart = {
+                "id": row.id if row is not None else None,
+                "session_id": session_id,
+                "items": {line["variant_id"]: line for line in row.items} if row is not None else {},
+                "created_at": created_at,
+                "updated_at": row.updated_at if row is not None else created_at,
+                "version": (row.version or 0) if row is not None else 0,
+            }
+            for entry in entries:
+                _apply_changes(cart["items"], entry.changes)
+                cart["version"] = max(cart["version"], entry.version)
+                cart["updated_at"] = max(cart["updated_at"], entry.created_at)
+        elif create:
+            now = datetime.utcnow()
+            # The id is assigned by the database when the log is first compacted.
+            cart = {"id": None, "session_id": session_id, "items": {}, "created_at": now, "updated_at": now, "version": 0}
+            self._append(shard, cart, {})
         else:
-            cart.items.append(cart_item)
-        
-        cart.updated_at = datetime.utcnow()
-        return cart
-    
-    async def update_cart_item(self, session_id: str, item_index: int, update_data: CartItemUpdate) -> Optional[Cart]:
-        """Update cart item quantity"""
-        cart = await self.get_or_create_cart(session_id)
-        
-        if item_index < 0 or item_index >= len(cart.items):
             return None
-        
-        if update_data.quantity <= 0:
-            cart.items.pop(item_index)
-        else:
-            cart.items[item_index].quantity = update_data.quantity
-        
-        cart.updated_at = datetime.utcnow()
+        shard.carts[session_id] = cart
+        self._trim(shard)
         return cart
-    
-    async def remove_cart_item(self, session_id: str, item_index: int) -> Optional[Cart]:
-        """Remove item from cart"""
-        cart = await self.get_or_create_cart(session_id)
-        
-        if item_index < 0 or item_index >= len(cart.items):
+
+    def _trim(self, shard: _Shard):
+        if len(shard.carts) <= self.max_per_shard:
+            return
+        for session_id in list(shard.carts):
+            if len(shard.carts) <= self.max_per_shard:
+                break
+            if session_id not in shard.dirty:
+                del shard.carts[session_id]
+                self.stats["evicted"] += 1
+
+    @staticmethod
+    def _append(shard: _Shard, cart: Dict[str, Any], changes: Dict[str, Optional[Dict[str, Any]]]):
+        shard.log.append({
+            "session_id": cart["session_id"],
+            "version": cart["version"],
+            "changes": copy.deepcopy(changes),
+            "created_at": cart["updated_at"],
+        })
+        shard.dirty.add(cart["session_id"])
+
+    def _touch(self, shard: _Shard, cart: Dict[str, Any], changes: Dict[str, Optional[Dict[str, Any]]]):
+        """Record a change: `changes` maps each variant GID it touched to its new line, or None if removed."""
+        cart["version"] += 1
+        cart["updated_at"] = datetime.utcnow()
+        self._append(shard, cart, changes)
+
+    @staticmethod
+    def _public(cart: Dict[str, Any]) -> Dict[str, Any]:
+        """The cart in the shape CartService returns (a copy the caller may keep)."""
+        return {
+            "id": cart["id"],
+            "session_id": cart["session_id"],
+            "items": [dict(line) for line in cart["items"].values()],
+            "created_at": cart["created_at"].isoformat(),
+            "updated_at": cart["updated_at"].isoformat(),
+            "version": cart["version"],
+        }
+
+    async def _resolve_variants(self, numeric_ids: Iterable[str]) -> Dict[str, ProductVariant]:
+        """Variants by numeric ID string, reading only those not looked up within variant_ttl."""
+        now = time.monotonic()
+        wanted = {int(n) for n in numeric_ids if n.isdigit()}
+        missing = [n for n in wanted if n not in self._variants or now - self._variants[n][1] > self.variant_ttl]
+        if missing:
+            async with ReadSessionLocal() as session:
+                found = (await session.execute(select(ProductVariant).where(ProductVariant.id.in_(missing)))).scalars()
+                for variant in found:
+                    self._variants[variant.id] = (variant, now)
+            for n in missing:
+                if n in self._variants and self._variants[n][1] != now:
+                    # Deleted from the catalog since it was cached.
+                    del self._variants[n]
+        return {str(n): self._variants[n][0] for n in wanted if n in self._variants}
+
+    # --- CartService interface ---
+    async def get_cart(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's cart, or None if it has none. Never creates one."""
+        shard = self._shard(session_id)
+        async with shard.lock:
+            cart = await self._load(shard, session_id, create=False)
+            return self._public(cart) if cart is not None else None
+
+    async def get_or_create_cart(self, session_id: str) -> Optional[Dict[str, Any]]:
+        shard = self._shard(session_id)
+        async with shard.lock:
+            return self._public(await self._load(shard, session_id, create=True))
+
+    async def add_item_to_cart(
+        self,
+        session_id: str,
+        product_id: str,
+        variant_id: str,
+        quantity: int = 1,
+    ) -> Optional[Dict[str, Any]]:
+        """Add quantity of a variant to the cart; None if the variant isn't one of the product's."""
+        numeric = str(variant_id).rsplit("/", 1)[-1]
+        variant = (await self._resolve_variants([numeric])).get(numeric)
+        if variant is None or variant.product_id != product_id:
+            logger.error(f"❌ Variant {variant_id} not found for product {product_id}")
             return None
-        
-        cart.items.pop(item_index)
-        cart.updated_at = datetime.utcnow()
-        return cart
-    
-    async def clear_cart(self, session_id: str) -> Cart:
-        """Clear all items from cart"""
-        cart = await self.get_or_create_cart(session_id)
-        cart.items = []
-        cart.updated_at = datetime.utcnow()
-        return cart
-    
-    async def get_cart(self, session_id: str) -> Cart:
-        """Get cart"""
-        return await self.get_or_create_cart(session_id)
+        shard = self._shard(session_id)
+        async with shard.lock:
+            cart = await self._load(shard, session_id, create=True)
+            line = cart["items"].get(variant.shopify_id)
+            line = cart["items"][variant.shopify_id] = variant_line(variant, (line["quantity"] if line else 0) + quantity)
+            self._touch(shard, cart, {variant.shopify_id: line})
+            return self._public(cart)
+
+    async def apply_operations(
+        self,
+        session_id: str,
+        operations: Iterable[Dict[str, Any]],
+        expected_version: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Apply add / set / remove operations atomically; same rules and errors as CartService.apply_operations."""
+        operations = list(operations)
+        if not operations:
+            raise ValueError("No cart operations given")
+        if len(operations) > CART_BATCH_MAX_OPERATIONS:
+            raise ValueError(f"At most {CART_BATCH_MAX_OPERATIONS} cart operations per request")
+        variants = await self._resolve_variants(str(op.get("variant_id", "")).rsplit("/", 1)[-1] for op in operations)
+        errors = validate_operations(operations, variants)
+        if errors:
+            raise ValueError("; ".join(errors))
+
+        shard = self._shard(session_id)
+        async with shard.lock:
+            cart = await self._load(shard, session_id, create=True)
+            if expected_version is not None and cart["version"] != expected_version:
+                raise CartConflictError(session_id, expected_version, cart["version"])
+            quantities = {gid: line["quantity"] for gid, line in cart["items"].items()}
+            changes = {}
+            for gid, qty in fold_operations(operations, variants, quantities).items():
+                if qty <= 0:
+                    if cart["items"].pop(gid, None) is not None:
+                        changes[gid] = None
+                elif gid in cart["items"] and cart["items"][gid]["quantity"] == qty:
+                    continue
+                else:
+                    changes[gid] = cart["items"][gid] = variant_line(variants[gid.rsplit("/", 1)[-1]], qty)
+            self._touch(shard, cart, changes)
+            return self._public(cart)
+
+    async def clear_cart(self, session_id: str) -> bool:
+        """Remove every line from a session's cart. Returns False if the session has no cart."""
+        shard = self._shard(session_id)
+        async with shard.lock:
+            cart = await self._load(shard, session_id, create=False)
+            if cart is None:
+                return False
+            changes = dict.fromkeys(cart["items"])
+            cart["items"] = {}
+            self._touch(shard, cart, changes)
+        logger.info(f"🧹 Cleared cart for session {session_id}")
+        return True
+
+    def evict(self, session_id: str):
+        """Forget a cart deleted from the database, unless it has changes not yet written there."""
+        shard = self._shard(session_id)
+        if session_id not in shard.dirty:
+            shard.carts.pop(session_id, None)
+
+    # --- log ---
+    async def flush(self) -> int:
+        """Append every change not yet in cart_log. Returns the number of entries written."""
+        async with self._log_lock:
+            pending = []
+            for shard in self._shards:
+                async with shard.lock:
+                    pending.append(shard.log)
+                    shard.log = []
+            entries = [entry for log in pending for entry in log]
+            try:
+                for start in range(0, len(entries), CART_MEMORY_FLUSH_BATCH):
+                    await get_db_writer().run(_appender(entries[start:start + CART_MEMORY_FLUSH_BATCH]))
+            except Exception:
+                # Nothing is lost: the unwritten entries go back ahead of anything logged meanwhile.
+                for shard, log in zip(self._shards, pending):
+                    async with shard.lock:
+                        shard.log = log + shard.log
+                raise
+            for shard in self._shards:
+                async with shard.lock:
+                    shard.dirty = {entry["session_id"] for entry in shard.log}
+                    self._trim(shard)
+        if entries:
+            self.stats["flushed"] += len(entries)
+            self.stats["flushes"] += 1
+            logger.debug(f"Appended {len(entries)} cart changes to the log")
+        return len(entries)
+
+    async def compact(self) -> int:
+        """Fold cart_log into the carts / cart_items snapshot and delete it. Returns the entries folded."""
+        folded = 0
+        async with self._log_lock:
+            while True:
+                count, ids = await get_db_writer().run(_compactor(CART_MEMORY_FLUSH_BATCH))
+                folded += count
+                for session_id, cart_id in ids.items():
+                    shard = self._shard(session_id)
+                    async with shard.lock:
+                        live = shard.carts.get(session_id)
+                        if live is not None:
+                            live["id"] = cart_id
+                if count < CART_MEMORY_FLUSH_BATCH:
+                    break
+        if folded:
+            self.stats["compacted"] += folded
+            logger.debug(f"Compacted {folded} cart log entries")
+        return folded
+
+    async def _run(self):
+        # Compact on the first pass too, folding whatever a previous process left in the log.
+        compacted_at = float("-inf")
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - compacted_at >= self.compact_interval:
+                    await self.compact()
+                    compacted_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"❌ Cart log write failed, retrying next interval: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the log loop, write whatever is still pending and compact the log."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await self.compact()
+
+
+def _apply_changes(items: Dict[str, Dict[str, Any]], changes: Dict[str, Optional[Dict[str, Any]]]):
+    for gid, line in changes.items():
+        if line is None:
+            items.pop(gid, None)
+        else:
+            # A line that was removed and added back goes to the end, as in CartService.
+            items[gid] = line
+
+
+def _appender(entries: List[Dict[str, Any]]):
+    async def write(session):
+        await session.execute(sqlite_insert(CART_LOG), entries)
+    return write
+
+
+def _compactor(limit: int):
+    """A writer job folding the oldest `limit` log entries into the snapshot; returns (count, {session: cart id})."""
+    async def write(session):
+        entries = (await session.execute(select(CART_LOG).order_by(CART_LOG.c.id).limit(limit))).all()
+        if not entries:
+            return 0, {}
+        carts: Dict[str, Dict[str, Any]] = {}
+        for entry in entries:
+            cart = carts.setdefault(entry.session_id, {
+                "session_id": entry.session_id, "created_at": entry.created_at, "lines": {}, "removed": set(),
+            })
+            cart["version"], cart["updated_at"] = entry.version, entry.created_at
+            cart["removed"].update(gid for gid, line in entry.changes.items() if line is None)
+            _apply_changes(cart["lines"], entry.changes)
+
+        cart_insert = sqlite_insert(CARTS)
+        upsert = cart_insert.on_conflict_do_update(
+            index_elements=[CARTS.c.session_id],
+            set_={"updated_at": cart_insert.excluded.updated_at, "version": cart_insert.excluded.version},
+        ).returning(CARTS.c.id, CARTS.c.session_id)
+        rows = await session.execute(upsert, [
+            {key: cart[key] for key in ("session_id", "created_at", "updated_at", "version")}
+            for cart in carts.values()
+        ])
+        ids = {row.session_id: row.id for row in rows}
+
+        conn = await session.connection()
+        # Removed lines go, including ones added back since: those are re-inserted at the end.
+        removed = [
+            {"cart": ids[cart["session_id"]], "variant": gid}
+            for cart in carts.values() for gid in cart["removed"]
+        ]
+        if removed:
+            await conn.execute(
+                CART_ITEMS.delete().where(and_(
+                    CART_ITEMS.c.cart_id == bindparam("cart"), CART_ITEMS.c.variant_id == bindparam("variant"),
+                )),
+                removed,
+            )
+        lines = [
+            {**line, "cart_id": ids[cart["session_id"]], "created_at": cart["updated_at"], "updated_at": cart["updated_at"]}
+            for cart in carts.values()
+            for line in cart["lines"].values()
+        ]
+        if lines:
+            line_insert = sqlite_insert(CART_ITEMS)
+            await conn.execute(
+                line_insert.on_conflict_do_update(
+                    index_elements=[CART_ITEMS.c.cart_id, CART_ITEMS.c.variant_id],
+                    set_={key: line_insert.excluded[key] for key in ("product_id", "name", "price", "quantity", "updated_at")},
+                ),
+                lines,
+            )
+        await session.execute(delete(CartLogEntry).where(CartLogEntry.id <= entries[-1].id))
+        return len(entries), ids
+    return write
+
+
+# Module-level singleton
+in_memory_cart_service = InMemoryCartService()
+
+
+def get_in_memory_cart_service() -> InMemoryCartService:
+    return in_memory_cart_service
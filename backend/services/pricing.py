@@ -0,0 +1,152 @@
+import os
+import logging
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from services.database import ReadSessionLocal
+from models.product import ProductVariant
+
+logger = logging.getLogger("pricing")
+
+
+def _parse_breaks(spec: str) -> List[Tuple[int, float]]:
+    """"10:5,25:10" -> [(1, 0.0), (10, 0.05), (25, 0.10)]: minimum quantity and fractional discount."""
+    breaks = {1: 0.0}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        quantity, percent = part.split(":")
+        breaks[int(quantity)] = float(percent) / 100
+    return sorted(breaks.items())
+
+
+# Quantity breaks applied to every variant's unit price: "min_quantity:percent_off,...", e.g.
+# "10:5,25:10,50:15,100:20". Off by default: checkout charges Shopify's variant prices, so a
+# schedule only belongs here once matching (automatic) discounts are set up in Shopify.
+PRICING_QUANTITY_BREAKS = _parse_breaks(os.getenv("PRICING_QUANTITY_BREAKS", ""))
+# Added to a gang sheet's base price per design placed on it (quantity breaks apply to it too).
+GANG_SHEET_DESIGN_FEE = float(os.getenv("GANG_SHEET_DESIGN_FEE", "0.50"))
+
+
+class PriceTiers(NamedTuple):
+    """Unit prices by quantity: unit_prices[i] applies from min_quantities[i] up to the next break."""
+
+    min_quantities: Tuple[int, ...]
+    unit_prices: Tuple[float, ...]
+
+    @classmethod
+    def from_price(cls, price: float, breaks: Sequence[Tuple[int, float]] = PRICING_QUANTITY_BREAKS) -> "PriceTiers":
+        return cls(
+            tuple(quantity for quantity, _ in breaks),
+            tuple(round(price * (1 - discount), 2) for _, discount in breaks),
+        )
+
+    def tier(self, quantity: int) -> int:
+        return max(bisect_right(self.min_quantities, quantity) - 1, 0)
+
+
+class PricingEngine:
+    """
+    Per-variant price tier tables, built when products are synced and kept in memory.
+
+    Every variant gets the PRICING_QUANTITY_BREAKS schedule over its synced
+    price, so pricing a cart is one pass over its lines with a bisect per line
+    and no database access. Variants the engine hasn't seen (e.g. before the
+    first sync after a restart, see `load`) are priced from the line's stored
+    price with the same schedule.
+
+    These are the prices shown in the app; Shopify checkout applies its own
+    discounts, which must mirror the breaks (hence no breaks by default).
+    """
+
+    def __init__(self, breaks: Sequence[Tuple[int, float]] = PRICING_QUANTITY_BREAKS):
+        self.breaks = list(breaks)
+        self.design_fee_tiers = PriceTiers.from_price(GANG_SHEET_DESIGN_FEE, self.breaks)
+        self._tiers: Dict[str, PriceTiers] = {}
+        self._products: Dict[str, List[str]] = {}
+
+    # --- tier tables ---
+    def record_products(self, products: Iterable[Dict[str, Any]]):
+        """Rebuild the tiers of every variant of normalized products (or product rows)."""
+        for p in products:
+            gids = []
+            for v in p.get("variants") or []:
+                if v.get("shopify_id") and v.get("price") is not None:
+                    self._tiers[v["shopify_id"]] = PriceTiers.from_price(float(v["price"]), self.breaks)
+                    gids.append(v["shopify_id"])
+            for gid in set(self._products.get(p.get("shopify_id"), ())) - set(gids):
+                self._tiers.pop(gid, None)
+            self._products[p.get("shopify_id")] = gids
+
+    def forget_products(self, product_ids: Iterable[str]):
+        for product_id in product_ids:
+            for gid in self._products.pop(product_id, ()):
+                self._tiers.pop(gid, None)
+
+    async def load(self) -> int:
+        """Build tiers for every variant in product_variants (startup, before any sync has run)."""
+        async with ReadSessionLocal() as session:
+            rows = (await session.execute(
+                select(ProductVariant.product_id, ProductVariant.shopify_id, ProductVariant.price)
+            )).all()
+        products: Dict[str, List[Dict[str, Any]]] = {}
+        for product_id, gid, price in rows:
+            products.setdefault(product_id, []).append({"shopify_id": gid, "price": price or 0.0})
+        self.record_products({"shopify_id": pid, "variants": variants} for pid, variants in products.items())
+        logger.info(f"💲 Built price tiers for {len(rows)} variants")
+        return len(rows)
+
+    def tiers(self, variant_id: str, fallback_price: Optional[float] = None) -> Optional[PriceTiers]:
+        tiers = self._tiers.get(variant_id)
+        if tiers is None and fallback_price is not None:
+            tiers = PriceTiers.from_price(float(fallback_price), self.breaks)
+        return tiers
+
+    # --- pricing ---
+    def price_cart(self, items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Price cart lines ({"variant_id", "quantity", "price"}) at their quantity tier.
+
+        Returns {"lines": [...], "subtotal"}, each line with its unit_price,
+        line_total and the quantity its tier starts at.
+        """
+        lines = []
+        subtotal = 0.0
+        for item in items:
+            quantity = int(item.get("quantity") or 0)
+            tiers = self.tiers(item["variant_id"], item.get("price") or 0.0)
+            n = tiers.tier(quantity)
+            unit_price = tiers.unit_prices[n]
+            line_total = round(unit_price * quantity, 2)
+            subtotal += line_total
+            lines.append({
+                "variant_id": item["variant_id"],
+                "quantity": quantity,
+                "unit_price": unit_price,
+                "line_total": line_total,
+                "tier_min_quantity": tiers.min_quantities[n],
+            })
+        return {"lines": lines, "subtotal": round(subtotal, 2)}
+
+    def price_gang_sheets(self, sheets: Iterable[Tuple[float, Iterable[int]]]) -> List[float]:
+        """
+        Totals for gang sheets given as (base_price, design quantities): base plus
+        a fee per design, the fee discounted at the sheet's total design quantity.
+        """
+        fees = self.design_fee_tiers
+        totals = []
+        for base_price, quantities in sheets:
+            designs = sum(quantities)
+            totals.append(round(base_price + designs * fees.unit_prices[fees.tier(designs)], 2))
+        return totals
+
+    def price_gang_sheet(self, base_price: float, quantities: Iterable[int]) -> float:
+        return self.price_gang_sheets([(base_price, quantities)])[0]
+
+
+# Module-level singleton
+pricing_engine = PricingEngine()
+
+
+def get_pricing_engine() -> PricingEngine:
+    return pricing_engine
@@ -0,0 +1,131 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+logger = logging.getLogger("shopify_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker over a rolling time window.
+
+    Each finished call is recorded as (time, failed, slow). Once the window holds
+    at least `min_calls`, the breaker opens when the failure rate reaches
+    `error_rate` or the share of calls slower than `slow_seconds` reaches
+    `slow_rate`. While open, `allow()` returns None so callers fail fast instead
+    of queueing behind a struggling Shopify. After `open_seconds` a single probe
+    is let through (half-open); its outcome closes or re-opens the breaker.
+
+    `allow()` hands each admitted call a ticket, the breaker's generation at the
+    time, which the call passes back to `record()`/`abandon()`. Every state
+    change starts a new generation, so calls admitted before it -- say, slow
+    requests that started before the breaker opened -- can't decide the probe.
+
+    It also keeps recent per-request latencies so hedged reads can be fired at
+    the observed p95.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 30.0,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        slow_seconds: float = 5.0,
+        slow_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        latency_samples: int = 200,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._generation = 0
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._latencies: Deque[float] = deque(maxlen=latency_samples)
+
+    # --- gate ---
+    def allow(self) -> Optional[int]:
+        """A ticket for the call, or None if it must not be attempted."""
+        if self.state == CLOSED:
+            return self._generation
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                return None
+            self.state = HALF_OPEN
+            self._probing = False
+        if self._probing:
+            return None
+        self._probing = True
+        self._generation += 1
+        return self._generation
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed (0 when closed)."""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    # --- outcomes ---
+    def record(self, ticket: int, success: bool, elapsed: float):
+        if ticket != self._generation:
+            # Admitted before the last state change; its outcome says nothing about now.
+            return
+        slow = elapsed >= self.slow_seconds
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if success and not slow:
+                logger.info("✅ Shopify %s circuit closed after a healthy probe", self.name)
+                self.state = CLOSED
+                self._generation += 1
+                self._calls.clear()
+            else:
+                self._open()
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, not success, slow))
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+        if self.state == CLOSED and len(self._calls) >= self.min_calls:
+            total = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            slow_calls = sum(1 for _, _, was_slow in self._calls if was_slow)
+            if failures / total >= self.error_rate or slow_calls / total >= self.slow_rate:
+                self._open()
+
+    def abandon(self, ticket: int):
+        """A call was cancelled before finishing; if it was the probe, free its slot."""
+        if self.state == HALF_OPEN and ticket == self._generation:
+            self._probing = False
+
+    def _open(self):
+        if self.state != OPEN:
+            logger.warning("⚠️ Shopify %s circuit opened for %ss", self.name, self.open_seconds)
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._generation += 1
+
+    # --- latency ---
+    def observe_latency(self, elapsed: float):
+        self._latencies.append(elapsed)
+
+    def percentile(self, pct: float, min_samples: int = 20) -> Optional[float]:
+        if len(self._latencies) < min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
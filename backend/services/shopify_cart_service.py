@@ -0,0 +1,403 @@
+import os
+import asyncio
+import logging
+import weakref
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.cart_service import get_cart_service
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+from models.shopify_cart import ShopifyCart
+from services.shopify_client import (
+    SHOPIFY_STORE,
+    ShopifyCircuitOpenError,
+    ShopifyError,
+    ShopifyUserError,
+    build_variant_gid_from_numeric,
+    get_shopify_client,
+    numeric_id_from_gid,
+    raise_for_user_errors,
+    shopify_base_url,
+)
+from services.shopify_throttle import Priority
+from services.variant_availability import get_variant_availability
+
+logger = logging.getLogger("shopify_cart_service")
+
+# Storefront carts expire after 10 days; start a fresh one a little before that.
+SHOPIFY_CART_MAX_AGE_DAYS = int(os.getenv("SHOPIFY_CART_MAX_AGE_DAYS", "9"))
+# An unchanged cart's checkoutUrl is handed out without asking Shopify for this long after Shopify
+# last returned the cart; after that the cart is re-read first, since it may have been checked out.
+SHOPIFY_CART_VERIFY_SECONDS = int(os.getenv("SHOPIFY_CART_VERIFY_SECONDS", "300"))
+# "cart": reuse the session's Storefront cart. "permalink": build /cart/... links locally when possible.
+SHOPIFY_CHECKOUT_MODE = os.getenv("SHOPIFY_CHECKOUT_MODE", "cart")
+# Domain for cart permalinks; the myshopify domain redirects to the primary one.
+SHOPIFY_CHECKOUT_DOMAIN = os.getenv("SHOPIFY_CHECKOUT_DOMAIN") or SHOPIFY_STORE
+CHECKOUT_MODES = ("cart", "permalink")
+
+CART_FIELDS = """
+  id
+  checkoutUrl
+  lines(first: 250) {
+    nodes { id quantity merchandise { ... on ProductVariant { id } } }
+  }
+"""
+
+CART_QUERY = """
+query cart($id: ID!) {
+  cart(id: $id) { %s }
+}
+""" % CART_FIELDS
+
+CART_CREATE_MUTATION = """
+mutation cartCreate($input: CartInput!) {
+  cartCreate(input: $input) {
+    cart { %s }
+    userErrors { field message }
+  }
+}
+""" % CART_FIELDS
+
+CART_LINES_ADD_MUTATION = """
+mutation cartLinesAdd($cartId: ID!, $lines: [CartLineInput!]!) {
+  cartLinesAdd(cartId: $cartId, lines: $lines) {
+    cart { %s }
+    userErrors { field message }
+  }
+}
+""" % CART_FIELDS
+
+CART_LINES_UPDATE_MUTATION = """
+mutation cartLinesUpdate($cartId: ID!, $lines: [CartLineUpdateInput!]!) {
+  cartLinesUpdate(cartId: $cartId, lines: $lines) {
+    cart { %s }
+    userErrors { field message }
+  }
+}
+""" % CART_FIELDS
+
+CART_LINES_REMOVE_MUTATION = """
+mutation cartLinesRemove($cartId: ID!, $lineIds: [ID!]!) {
+  cartLinesRemove(cartId: $cartId, lineIds: $lineIds) {
+    cart { %s }
+    userErrors { field message }
+  }
+}
+""" % CART_FIELDS
+
+
+CART_CREATE_WITH_EXTRAS_MUTATION = """
+mutation cartCreate($input: CartInput!) {
+  cartCreate(input: $input) {
+    cart { id checkoutUrl }
+    userErrors { field message }
+  }
+}
+"""
+
+
+class CartGoneError(ShopifyError):
+    """The mapped Storefront cart no longer accepts changes (expired or already checked out)."""
+
+
+def to_variant_gid(variant_id: Any) -> str:
+    value = str(variant_id)
+    return value if value.startswith("gid://") else build_variant_gid_from_numeric(value)
+
+
+def line_quantity(value: Any) -> int:
+    """A requested line quantity as an int; ValueError for anything that isn't a whole number."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"invalid quantity {value!r}")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"invalid quantity {value!r}") from None
+
+
+def desired_lines(items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Collapse cart items ({"variant_id", "quantity"}) into {variant_gid: quantity}."""
+    lines: Dict[str, int] = {}
+    for item in items:
+        if not item.get("variant_id"):
+            continue
+        gid = to_variant_gid(item["variant_id"])
+        lines[gid] = lines.get(gid, 0) + line_quantity(item.get("quantity", 1))
+    return {gid: qty for gid, qty in lines.items() if qty > 0}
+
+
+def cart_permalink(lines: Dict[str, int]) -> str:
+    """https://{shop}/cart/{variant_id}:{qty},... -- goes straight to checkout with those lines."""
+    path = ",".join(f"{numeric_id_from_gid(gid)}:{qty}" for gid, qty in lines.items())
+    return f"{shopify_base_url(SHOPIFY_CHECKOUT_DOMAIN)}/cart/{path}"
+
+
+def _lines_from_cart(cart: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    lines = {}
+    for node in (cart.get("lines") or {}).get("nodes", []):
+        merchandise = (node.get("merchandise") or {}).get("id")
+        if merchandise:
+            lines[merchandise] = {"id": node["id"], "quantity": node["quantity"]}
+    return lines
+
+
+CART_PURPOSE = "cart"
+BUY_NOW_PURPOSE = "buy_now"
+
+
+class ShopifyCartService:
+    """
+    Keeps Storefront carts per x-session-id and brings them in line with the
+    requested contents using cartLinesAdd / cartLinesUpdate / cartLinesRemove.
+
+    Each session has one cart mirroring its local cart and one for "buy now"
+    checkouts of explicit items, so a buy-now URL never changes under the
+    customer when the local cart does. The last known Shopify line state is
+    stored locally; when nothing changed the stored checkoutUrl is returned with
+    no Shopify call at all, as long as Shopify returned the cart within
+    SHOPIFY_CART_VERIFY_SECONDS. Older carts are re-read first, and one that was
+    checked out or expired is replaced. Work on the same cart is serialized.
+    """
+
+    def __init__(self):
+        # Weak values: a cart's lock disappears once nobody holds or waits on it.
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._background: set = set()
+
+    def _lock(self, key: Tuple[str, str]) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    async def checkout(
+        self,
+        session_id: str,
+        lines: Optional[Dict[str, int]] = None,
+        mode: str = SHOPIFY_CHECKOUT_MODE,
+        attributes: Optional[Dict[str, str]] = None,
+        discount_codes: Optional[List[str]] = None,
+    ) -> Dict[str, str]:
+        """
+        Checkout for `lines`, or for the session's local cart when `lines` is None.
+
+        Every line is first checked against the variant availability cache (one
+        batched lookup for stale entries), so a sold-out or unpublished variant
+        fails here with VariantUnavailableError before any cart mutation.
+
+        Returns {"checkout_url", "via"}. "permalink" mode skips Shopify cart calls
+        when every variant is freshly known to be available; otherwise
+        the reusable cart is used, falling back to a permalink if the Storefront
+        circuit breaker is open. Attributes and discount codes can't be carried
+        by the reused cart's diffs, so those checkouts get a one-off cartCreate.
+        """
+        if mode not in CHECKOUT_MODES:
+            raise ValueError(f"Unknown checkout mode {mode!r}")
+        purpose = BUY_NOW_PURPOSE if lines is not None else CART_PURPOSE
+        if lines is None:
+            lines = await self._local_cart_lines(session_id)
+        if not lines:
+            raise ValueError("Cannot check out an empty cart")
+        await get_variant_availability().require_available(lines)
+
+        if attributes or discount_codes:
+            url = await self._create_with_extras(lines, attributes or {}, discount_codes or [])
+            return {"checkout_url": url, "via": "cart_create"}
+        if mode == "permalink":
+            url = await self.permalink(lines)
+            if url:
+                return {"checkout_url": url, "via": "permalink"}
+        try:
+            if purpose == CART_PURPOSE:
+                url = await self.cart_checkout_url(session_id)
+            else:
+                url = await self.checkout_url(session_id, lines)
+        except ShopifyCircuitOpenError:
+            # Storefront is failing fast; a locally built permalink still gets the customer to checkout.
+            url = await self.permalink(lines)
+            if not url:
+                raise
+            logger.warning("⚠️ Storefront circuit open; falling back to a cart permalink for %s", session_id)
+            return {"checkout_url": url, "via": "permalink"}
+        return {"checkout_url": url, "via": "cart"}
+
+    async def permalink(self, lines: Dict[str, int]) -> Optional[str]:
+        """A cart permalink if every line is freshly known to be available, else None."""
+        availability = get_variant_availability()
+        for gid in lines:
+            if availability.is_available(gid) is not True:
+                logger.info("Variant %s not known to be available locally; using a Storefront cart", gid)
+                return None
+        return cart_permalink(lines)
+
+    async def checkout_url(self, session_id: str, lines: Dict[str, int], purpose: str = BUY_NOW_PURPOSE) -> str:
+        """Return a checkout URL for exactly `lines` ({variant_gid: quantity})."""
+        if not lines:
+            raise ValueError("Cannot check out an empty cart")
+        async with self._lock((session_id, purpose)):
+            return await self._reconcile(session_id, purpose, lines)
+
+    async def cart_checkout_url(self, session_id: str) -> str:
+        """Checkout URL for the session's local cart."""
+        async with self._lock((session_id, CART_PURPOSE)):
+            lines = await self._local_cart_lines(session_id)
+            if not lines:
+                raise ValueError("Cannot check out an empty cart")
+            return await self._reconcile(session_id, CART_PURPOSE, lines)
+
+    def schedule_sync(self, session_id: str):
+        """Push local cart changes ahead of checkout so checkout itself needs no round trip."""
+        task = asyncio.create_task(self._sync_quietly(session_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def stop(self):
+        """Let background syncs that are already running finish."""
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def _sync_quietly(self, session_id: str):
+        try:
+            await self.cart_checkout_url(session_id)
+        except ValueError:
+            pass
+        except Exception as e:
+            # Checkout will retry the diff; this is only a head start.
+            logger.warning("⚠️ Background Shopify cart sync failed for %s: %s", session_id, e)
+
+    async def _local_cart_lines(self, session_id: str) -> Dict[str, int]:
+        # Read under the lock so a delayed background sync never pushes stale contents.
+        cart = await get_cart_service().get_cart(session_id)
+        return desired_lines(cart["items"] if cart else [])
+
+    async def _reconcile(self, session_id: str, purpose: str, lines: Dict[str, int]) -> str:
+        mapping = await self._load(session_id, purpose)
+        if mapping and datetime.utcnow() - mapping.created_at > timedelta(days=SHOPIFY_CART_MAX_AGE_DAYS):
+            mapping = None
+        if mapping:
+            try:
+                return await self._apply_diff(mapping, lines)
+            except CartGoneError as e:
+                logger.info("Shopify cart for %s is no longer usable (%s); creating a new one", session_id, e)
+        return await self._create(session_id, purpose, lines)
+
+    # --- Shopify ---
+    async def _create(self, session_id: str, purpose: str, lines: Dict[str, int]) -> str:
+        variables = {"input": {"lines": [{"merchandiseId": gid, "quantity": qty} for gid, qty in lines.items()]}}
+        data = await get_shopify_client().storefront_graphql(CART_CREATE_MUTATION, variables, priority=Priority.CHECKOUT)
+        payload = data.get("cartCreate") or {}
+        raise_for_user_errors(payload)
+        cart = payload.get("cart") or {}
+        if not cart.get("checkoutUrl"):
+            raise ShopifyError("cartCreate returned no checkoutUrl")
+        await self._save(session_id, purpose, cart, new=True)
+        logger.info("🛒 Created Shopify %s cart for session %s", purpose, session_id)
+        return cart["checkoutUrl"]
+
+    async def _create_with_extras(
+        self, lines: Dict[str, int], attributes: Dict[str, str], discount_codes: List[str]
+    ) -> str:
+        variables = {
+            "input": {
+                "lines": [{"merchandiseId": gid, "quantity": qty} for gid, qty in lines.items()],
+                "attributes": [{"key": k, "value": str(v)} for k, v in attributes.items()],
+                "discountCodes": discount_codes,
+            }
+        }
+        data = await get_shopify_client().storefront_graphql(
+            CART_CREATE_WITH_EXTRAS_MUTATION, variables, priority=Priority.CHECKOUT
+        )
+        payload = data.get("cartCreate") or {}
+        raise_for_user_errors(payload)
+        cart = payload.get("cart") or {}
+        if not cart.get("checkoutUrl"):
+            raise ShopifyError("cartCreate returned no checkoutUrl")
+        return cart["checkoutUrl"]
+
+    async def _apply_diff(
+        self, mapping: ShopifyCart, lines: Dict[str, int], current: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> str:
+        verified = current is not None
+        if current is None:
+            current = dict(mapping.lines or {})
+        add = [{"merchandiseId": gid, "quantity": qty} for gid, qty in lines.items() if gid not in current]
+        update = [
+            {"id": current[gid]["id"], "quantity": qty}
+            for gid, qty in lines.items()
+            if gid in current and current[gid]["quantity"] != qty
+        ]
+        remove = [line["id"] for gid, line in current.items() if gid not in lines]
+        if not (add or update or remove):
+            if verified or not self._needs_verify(mapping):
+                return mapping.checkout_url
+            cart = await self._fetch(mapping.cart_id)
+            await self._save(mapping.session_id, mapping.purpose, cart)
+            # Shopify's lines are the truth; diff again in case they moved under us.
+            return await self._apply_diff(mapping, lines, _lines_from_cart(cart))
+
+        cart = None
+        if remove:
+            cart = await self._mutate("cartLinesRemove", CART_LINES_REMOVE_MUTATION, {"cartId": mapping.cart_id, "lineIds": remove})
+        if update:
+            cart = await self._mutate("cartLinesUpdate", CART_LINES_UPDATE_MUTATION, {"cartId": mapping.cart_id, "lines": update})
+        if add:
+            cart = await self._mutate("cartLinesAdd", CART_LINES_ADD_MUTATION, {"cartId": mapping.cart_id, "lines": add})
+        await self._save(mapping.session_id, mapping.purpose, cart)
+        logger.info(
+            "🛒 Synced Shopify cart for %s (+%s ~%s -%s lines)", mapping.session_id, len(add), len(update), len(remove)
+        )
+        return cart.get("checkoutUrl") or mapping.checkout_url
+
+    @staticmethod
+    def _needs_verify(mapping: ShopifyCart) -> bool:
+        verified_at = mapping.verified_at or mapping.created_at
+        return verified_at is None or datetime.utcnow() - verified_at > timedelta(seconds=SHOPIFY_CART_VERIFY_SECONDS)
+
+    async def _fetch(self, cart_id: str) -> Dict[str, Any]:
+        data = await get_shopify_client().storefront_graphql(CART_QUERY, {"id": cart_id}, priority=Priority.CHECKOUT)
+        if not data.get("cart"):
+            # Shopify returns null for carts that were checked out or have expired.
+            raise CartGoneError("cart query returned no cart")
+        return data["cart"]
+
+    async def _mutate(self, name: str, mutation: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        data = await get_shopify_client().storefront_graphql(mutation, variables, priority=Priority.CHECKOUT)
+        payload = data.get(name) or {}
+        try:
+            raise_for_user_errors(payload)
+        except ShopifyUserError as e:
+            # Line IDs from an expired or completed cart are rejected; treat that as a gone cart.
+            raise CartGoneError(str(e.user_errors)) from e
+        if not payload.get("cart"):
+            raise CartGoneError(f"{name} returned no cart")
+        return payload["cart"]
+
+    # --- persistence ---
+    async def _load(self, session_id: str, purpose: str) -> Optional[ShopifyCart]:
+        async with ReadSessionLocal() as session:
+            return await session.get(ShopifyCart, (session_id, purpose))
+
+    async def _save(self, session_id: str, purpose: str, cart: Dict[str, Any], new: bool = False):
+        async def write(session):
+            mapping = await session.get(ShopifyCart, (session_id, purpose))
+            if mapping is None:
+                mapping = ShopifyCart(session_id=session_id, purpose=purpose)
+                session.add(mapping)
+            if new:
+                mapping.created_at = datetime.utcnow()
+            mapping.cart_id = cart["id"]
+            mapping.checkout_url = cart.get("checkoutUrl") or mapping.checkout_url
+            mapping.lines = _lines_from_cart(cart)
+            mapping.verified_at = datetime.utcnow()
+
+        await get_db_writer().run(write)
+
+
+# Module-level singleton
+shopify_cart_service = ShopifyCartService()
+
+
+def get_shopify_cart_service() -> ShopifyCartService:
+    return shopify_cart_service
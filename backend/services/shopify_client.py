@@ -0,0 +1,481 @@
+import os
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from services.shopify_breaker import CircuitBreaker
+from services.shopify_throttle import (
+    LeakyBucket,
+    Priority,
+    graphql_throttle_status,
+    is_graphql_throttled,
+    parse_rest_call_limit,
+    retry_after_seconds,
+)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+load_dotenv()
+
+logger = logging.getLogger("shopify_client")
+
+SHOPIFY_STORE = os.getenv("SHOPIFY_STORE", "presmtechnologies.myshopify.com")
+SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
+SHOPIFY_STOREFRONT_TOKEN = os.getenv("SHOPIFY_STOREFRONT_TOKEN", "")
+SHOPIFY_ADMIN_API_VERSION = os.getenv("SHOPIFY_ADMIN_API_VERSION", "2025-01")
+SHOPIFY_STOREFRONT_API_VERSION = os.getenv("SHOPIFY_STOREFRONT_API_VERSION", "2025-01")
+
+SHOPIFY_HTTP_TIMEOUT = float(os.getenv("SHOPIFY_HTTP_TIMEOUT", "20"))
+SHOPIFY_MAX_CONNECTIONS = int(os.getenv("SHOPIFY_MAX_CONNECTIONS", "20"))
+SHOPIFY_MAX_KEEPALIVE = int(os.getenv("SHOPIFY_MAX_KEEPALIVE", "10"))
+
+# Starting bucket sizes; replaced by what Shopify reports after the first response.
+SHOPIFY_ADMIN_BUCKET_SIZE = float(os.getenv("SHOPIFY_ADMIN_BUCKET_SIZE", "1000"))
+SHOPIFY_ADMIN_RESTORE_RATE = float(os.getenv("SHOPIFY_ADMIN_RESTORE_RATE", "50"))
+SHOPIFY_REST_BUCKET_SIZE = float(os.getenv("SHOPIFY_REST_BUCKET_SIZE", "40"))
+SHOPIFY_REST_RESTORE_RATE = float(os.getenv("SHOPIFY_REST_RESTORE_RATE", "2"))
+SHOPIFY_DEFAULT_QUERY_COST = float(os.getenv("SHOPIFY_DEFAULT_QUERY_COST", "10"))
+# Storefront throttles carry no bucket state; without a Retry-After, Storefront calls wait this long.
+SHOPIFY_STOREFRONT_THROTTLE_SECONDS = float(os.getenv("SHOPIFY_STOREFRONT_THROTTLE_SECONDS", "1"))
+SHOPIFY_MAX_THROTTLE_RETRIES = int(os.getenv("SHOPIFY_MAX_THROTTLE_RETRIES", "5"))
+
+# Circuit breaker, per endpoint (admin GraphQL, Storefront GraphQL, admin REST).
+SHOPIFY_BREAKER_WINDOW_SECONDS = float(os.getenv("SHOPIFY_BREAKER_WINDOW_SECONDS", "30"))
+SHOPIFY_BREAKER_MIN_CALLS = int(os.getenv("SHOPIFY_BREAKER_MIN_CALLS", "10"))
+SHOPIFY_BREAKER_ERROR_RATE = float(os.getenv("SHOPIFY_BREAKER_ERROR_RATE", "0.5"))
+SHOPIFY_BREAKER_SLOW_SECONDS = float(os.getenv("SHOPIFY_BREAKER_SLOW_SECONDS", "5"))
+SHOPIFY_BREAKER_SLOW_RATE = float(os.getenv("SHOPIFY_BREAKER_SLOW_RATE", "0.8"))
+SHOPIFY_BREAKER_OPEN_SECONDS = float(os.getenv("SHOPIFY_BREAKER_OPEN_SECONDS", "30"))
+# Hedged Storefront reads: a second copy is sent once the first has taken longer than the endpoint's p95.
+SHOPIFY_HEDGE_ENABLED = os.getenv("SHOPIFY_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+SHOPIFY_HEDGE_DEFAULT_DELAY = float(os.getenv("SHOPIFY_HEDGE_DEFAULT_DELAY", "1.0"))
+SHOPIFY_HEDGE_MIN_DELAY = float(os.getenv("SHOPIFY_HEDGE_MIN_DELAY", "0.1"))
+
+
+# ------------------------------------------------------------------
+# Errors
+# ------------------------------------------------------------------
+class ShopifyError(Exception):
+    """Base class for all Shopify client errors."""
+
+
+class ShopifyConfigError(ShopifyError):
+    """A required token or setting is missing."""
+
+
+class ShopifyHTTPError(ShopifyError):
+    def __init__(self, status_code: int, body: str, url: str = "", retry_after: Optional[str] = None):
+        super().__init__(f"Shopify HTTP {status_code} from {url}: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+        self.url = url
+        self.retry_after = retry_after
+
+
+class ShopifyGraphQLError(ShopifyError):
+    def __init__(self, errors: Any):
+        super().__init__(f"Shopify GraphQL errors: {errors}")
+        self.errors = errors
+
+
+class ShopifyUserError(ShopifyError):
+    def __init__(self, user_errors: List[Dict[str, Any]]):
+        super().__init__(f"Shopify userErrors: {user_errors}")
+        self.user_errors = user_errors
+
+
+class ShopifyThrottledError(ShopifyError):
+    """Still throttled after SHOPIFY_MAX_THROTTLE_RETRIES waits."""
+
+
+class ShopifyCircuitOpenError(ShopifyError):
+    """The endpoint's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+        super().__init__(f"Shopify {endpoint} circuit open; retry in {retry_in:.0f}s")
+
+
+# ------------------------------------------------------------------
+# GID helpers
+# ------------------------------------------------------------------
+def shopify_base_url(store: str = SHOPIFY_STORE) -> str:
+    """"shop.myshopify.com" -> "https://shop.myshopify.com"; a full URL (e.g. a local simulator) is kept as is."""
+    return store.rstrip("/") if "://" in store else f"https://{store}"
+
+def numeric_id_from_gid(gid: str) -> str:
+    return str(gid).split("/")[-1] if gid else None
+
+def build_variant_gid_from_numeric(numeric_id: int) -> str:
+    return f"gid://shopify/ProductVariant/{numeric_id}"
+
+def build_product_gid_from_numeric(numeric_id: int) -> str:
+    return f"gid://shopify/Product/{numeric_id}"
+
+
+def raise_for_user_errors(payload: Optional[Dict[str, Any]]):
+    """Raise ShopifyUserError if a mutation payload carries userErrors."""
+    user_errors = (payload or {}).get("userErrors") or []
+    if user_errors:
+        raise ShopifyUserError(user_errors)
+
+
+# ------------------------------------------------------------------
+# Client
+# ------------------------------------------------------------------
+class ShopifyClient:
+    """
+    One pooled HTTP client for every Shopify API we call.
+
+    Connections to the store are kept alive (and multiplexed over HTTP/2 when `h2`
+    is installed), so operations after the first skip the TCP+TLS handshake.
+    Admin GraphQL and REST calls go through local leaky-bucket models fed by
+    Shopify's throttle reports, so callers queue by priority instead of hitting
+    429/THROTTLED responses. Storefront calls go through a bucket too, which
+    only holds them back, by priority, while Shopify is throttling them.
+    """
+
+    def __init__(
+        self,
+        store: str = SHOPIFY_STORE,
+        access_token: str = SHOPIFY_ACCESS_TOKEN,
+        storefront_token: str = SHOPIFY_STOREFRONT_TOKEN,
+        admin_version: str = SHOPIFY_ADMIN_API_VERSION,
+        storefront_version: str = SHOPIFY_STOREFRONT_API_VERSION,
+        timeout: float = SHOPIFY_HTTP_TIMEOUT,
+    ):
+        self.store = store
+        self.access_token = access_token
+        self.storefront_token = storefront_token
+
+        base = shopify_base_url(store)
+        self.admin_graphql_url = f"{base}/admin/api/{admin_version}/graphql.json"
+        self.storefront_graphql_url = f"{base}/api/{storefront_version}/graphql.json"
+        self.rest_base_url = f"{base}/admin/api/{admin_version}"
+
+        self.http = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=SHOPIFY_MAX_CONNECTIONS,
+                max_keepalive_connections=SHOPIFY_MAX_KEEPALIVE,
+            ),
+            headers={"Accept": "application/json"},
+        )
+
+        self.admin_bucket = LeakyBucket("admin_graphql", SHOPIFY_ADMIN_BUCKET_SIZE, SHOPIFY_ADMIN_RESTORE_RATE)
+        self.rest_bucket = LeakyBucket("admin_rest", SHOPIFY_REST_BUCKET_SIZE, SHOPIFY_REST_RESTORE_RATE)
+        # Storefront calls cost nothing here; a throttle puts the bucket in deficit, which queues every
+        # Storefront caller by priority until it has refilled.
+        self.storefront_bucket = LeakyBucket("storefront_graphql", 1, 1)
+        # Last requestedQueryCost seen per query text; better than a flat guess on repeat calls.
+        self._query_costs: Dict[str, float] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {
+            name: CircuitBreaker(
+                name,
+                window_seconds=SHOPIFY_BREAKER_WINDOW_SECONDS,
+                min_calls=SHOPIFY_BREAKER_MIN_CALLS,
+                error_rate=SHOPIFY_BREAKER_ERROR_RATE,
+                slow_seconds=SHOPIFY_BREAKER_SLOW_SECONDS,
+                slow_rate=SHOPIFY_BREAKER_SLOW_RATE,
+                open_seconds=SHOPIFY_BREAKER_OPEN_SECONDS,
+            )
+            for name in ("admin_graphql", "storefront_graphql", "admin_rest")
+        }
+        self.hedges_sent = 0
+        # Running totals for throughput reports: HTTP requests, response bytes, Admin GraphQL actualQueryCost.
+        self.usage: Dict[str, float] = {"requests": 0, "bytes": 0, "query_cost": 0.0}
+
+    # --- auth headers ---
+    def _admin_headers(self) -> Dict[str, str]:
+        if not self.access_token:
+            raise ShopifyConfigError("SHOPIFY_ACCESS_TOKEN is not set")
+        return {"X-Shopify-Access-Token": self.access_token}
+
+    def _storefront_headers(self) -> Dict[str, str]:
+        if not self.storefront_token:
+            raise ShopifyConfigError("SHOPIFY_STOREFRONT_TOKEN is not set")
+        return {"X-Shopify-Storefront-Access-Token": self.storefront_token}
+
+    # --- transport ---
+    async def _request(
+        self, method: str, url: str, headers: Dict[str, str], breaker: CircuitBreaker, **kwargs
+    ) -> httpx.Response:
+        started = time.monotonic()
+        try:
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            raise ShopifyError(f"Shopify request to {url} failed: {e}") from e
+        breaker.observe_latency(time.monotonic() - started)
+        self.usage["requests"] += 1
+        self.usage["bytes"] += len(response.content)
+        if response.status_code >= 400:
+            raise ShopifyHTTPError(response.status_code, response.text, url, response.headers.get("Retry-After"))
+        return response
+
+    async def _send(
+        self, method: str, url: str, headers: Dict[str, str], endpoint: str, hedge: bool = False, **kwargs
+    ) -> httpx.Response:
+        """
+        One logical call through the endpoint's circuit breaker.
+
+        Transport errors, 5xx and calls slower than SHOPIFY_BREAKER_SLOW_SECONDS
+        count against the breaker; 4xx and throttling don't. `hedge` marks the
+        call as safe to send twice.
+        """
+        breaker = self.breakers[endpoint]
+        ticket = breaker.allow()
+        if ticket is None:
+            raise ShopifyCircuitOpenError(endpoint, breaker.retry_in)
+        started = time.monotonic()
+        try:
+            if hedge and SHOPIFY_HEDGE_ENABLED:
+                response = await self._hedged(method, url, headers, breaker, **kwargs)
+            else:
+                response = await self._request(method, url, headers, breaker, **kwargs)
+        except ShopifyHTTPError as e:
+            breaker.record(ticket, e.status_code < 500, time.monotonic() - started)
+            raise
+        except ShopifyError:
+            breaker.record(ticket, False, time.monotonic() - started)
+            raise
+        except BaseException:
+            breaker.abandon(ticket)
+            raise
+        breaker.record(ticket, True, time.monotonic() - started)
+        return response
+
+    async def _hedged(
+        self, method: str, url: str, headers: Dict[str, str], breaker: CircuitBreaker, **kwargs
+    ) -> httpx.Response:
+        """Send the request; if it outlives the endpoint's p95, send a copy and take whichever succeeds first."""
+        p95 = breaker.percentile(0.95)
+        delay = max(SHOPIFY_HEDGE_MIN_DELAY, p95 if p95 is not None else SHOPIFY_HEDGE_DEFAULT_DELAY)
+        first = asyncio.ensure_future(self._request(method, url, headers, breaker, **kwargs))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except BaseException:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+
+        self.hedges_sent += 1
+        logger.debug("Hedging %s %s after %.2fs", method, url, delay)
+        pending = {first, asyncio.ensure_future(self._request(method, url, headers, breaker, **kwargs))}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Dict[str, Any]:
+        try:
+            return response.json()
+        except ValueError:
+            raise ShopifyError(f"Invalid JSON from Shopify: {response.text[:200]}")
+
+    async def _graphql(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        query: str,
+        variables=None,
+        timeout=None,
+        *,
+        bucket: LeakyBucket,
+        priority: Priority = Priority.INTERACTIVE,
+        cost: Optional[float] = None,
+        endpoint: str = "admin_graphql",
+        throttle_wait: float = 0.0,
+    ) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"query": query}
+        if variables:
+            body["variables"] = variables
+        kwargs = {"timeout": timeout} if timeout else {}
+        query_key = hashlib.sha1(query.encode()).hexdigest()
+        read = not query.lstrip().startswith("mutation")
+
+        for attempt in range(SHOPIFY_MAX_THROTTLE_RETRIES + 1):
+            estimate = cost if cost is not None else self._query_costs.get(query_key, SHOPIFY_DEFAULT_QUERY_COST)
+            reserved = await bucket.acquire(estimate, priority)
+            # A hedge is a second real request. A costed one would be charged by Shopify but never reserved
+            # here, so only free reads are hedged, and not sync traffic that nobody is waiting on.
+            hedge = not reserved and read and priority != Priority.SYNC
+            try:
+                response = await self._send("POST", url, headers, endpoint, hedge=hedge, json=body, **kwargs)
+            except ShopifyHTTPError as e:
+                bucket.release(reserved)
+                if e.status_code in (429, 430):
+                    self._back_off(bucket, e, attempt, throttle_wait)
+                    continue
+                raise
+            except BaseException:
+                bucket.release(reserved)
+                raise
+
+            data = self._json(response)
+            cost_info = graphql_throttle_status(data)
+            self.usage["query_cost"] += float(cost_info.get("actualQueryCost") or 0)
+            status = cost_info.get("throttleStatus") or {}
+            if cost_info.get("requestedQueryCost") is not None:
+                self._query_costs[query_key] = float(cost_info["requestedQueryCost"])
+            bucket.settle(
+                reserved,
+                available=status.get("currentlyAvailable"),
+                capacity=status.get("maximumAvailable"),
+                restore_rate=status.get("restoreRate"),
+            )
+            if is_graphql_throttled(data):
+                logger.info("Shopify GraphQL throttled (attempt %s); waiting for bucket to refill", attempt + 1)
+                if not cost_info:
+                    # No bucket state to adopt: assume it's empty (or blocked for throttle_wait).
+                    bucket.drain(throttle_wait)
+                continue
+            if data.get("errors"):
+                raise ShopifyGraphQLError(data["errors"])
+            return data.get("data") or {}
+
+        raise ShopifyThrottledError(f"Shopify still throttling {url} after {SHOPIFY_MAX_THROTTLE_RETRIES} retries")
+
+    @staticmethod
+    def _back_off(bucket: LeakyBucket, error: "ShopifyHTTPError", attempt: int, default_wait: float = 0.0):
+        """Handle an HTTP 429: empty the bucket model for Retry-After (or `default_wait`) seconds."""
+        logger.info("Shopify HTTP %s from %s (attempt %s)", error.status_code, error.url, attempt + 1)
+        # The bucket wakes the next caller once that has passed (plus that call's own cost).
+        bucket.drain(retry_after_seconds(error.retry_after, default_wait))
+
+    # --- public API ---
+    async def admin_graphql(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        timeout: float = None,
+        priority: Priority = Priority.INTERACTIVE,
+        cost: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Run an Admin GraphQL operation and return its `data`. `cost` overrides the estimated query cost."""
+        return await self._graphql(
+            self.admin_graphql_url, self._admin_headers(), query, variables, timeout,
+            bucket=self.admin_bucket, priority=priority, cost=cost, endpoint="admin_graphql",
+        )
+
+    async def storefront_graphql(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        timeout: float = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> Dict[str, Any]:
+        """Run a Storefront GraphQL operation and return its `data`. No query costs, so its reads are hedged."""
+        return await self._graphql(
+            self.storefront_graphql_url, self._storefront_headers(), query, variables, timeout,
+            bucket=self.storefront_bucket, priority=priority, cost=0, endpoint="storefront_graphql",
+            throttle_wait=SHOPIFY_STOREFRONT_THROTTLE_SECONDS,
+        )
+
+    async def rest(
+        self,
+        method: str,
+        path: str,
+        timeout: float = None,
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs,
+    ) -> httpx.Response:
+        """Call the Admin REST API. `path` is relative to /admin/api/{version}/, or a full URL (pagination links)."""
+        url = path if path.startswith("http") else f"{self.rest_base_url}/{path.lstrip('/')}"
+        if timeout:
+            kwargs["timeout"] = timeout
+        bucket = self.rest_bucket
+
+        for attempt in range(SHOPIFY_MAX_THROTTLE_RETRIES + 1):
+            reserved = await bucket.acquire(1, priority)
+            try:
+                # Not hedged: a second copy would use a call the bucket never reserved.
+                response = await self._send(method, url, self._admin_headers(), "admin_rest", **kwargs)
+            except ShopifyHTTPError as e:
+                bucket.release(reserved)
+                if e.status_code == 429:
+                    self._back_off(bucket, e, attempt)
+                    continue
+                raise
+            except BaseException:
+                bucket.release(reserved)
+                raise
+
+            limit = parse_rest_call_limit(response.headers.get("X-Shopify-Shop-Api-Call-Limit"))
+            if limit:
+                used, capacity = limit
+                bucket.settle(reserved, available=capacity - used, capacity=capacity)
+            else:
+                bucket.settle(reserved)
+            return response
+
+        raise ShopifyThrottledError(f"Shopify still throttling {url} after {SHOPIFY_MAX_THROTTLE_RETRIES} retries")
+
+    async def stream_lines(self, url: str, timeout: float = 300) -> AsyncIterator[str]:
+        """Stream a (possibly very large) text download line by line, e.g. a bulk operation result."""
+        try:
+            async with self.http.stream("GET", url, timeout=timeout) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise ShopifyHTTPError(response.status_code, response.text, url)
+                self.usage["requests"] += 1
+                async for line in response.aiter_lines():
+                    self.usage["bytes"] += len(line) + 1
+                    if line:
+                        yield line
+        except httpx.HTTPError as e:
+            raise ShopifyError(f"Download of {url} failed: {e}") from e
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# ------------------------------------------------------------------
+# Lifecycle
+# ------------------------------------------------------------------
+_client: Optional[ShopifyClient] = None
+
+
+async def init_shopify_client() -> ShopifyClient:
+    global _client
+    if _client is None:
+        _client = ShopifyClient()
+        logger.info(
+            "✅ Shopify client ready for %s (http2=%s)", _client.store, HTTP2_AVAILABLE
+        )
+    return _client
+
+
+async def close_shopify_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_shopify_client() -> ShopifyClient:
+    """Return the shared client, creating it on first use (scripts don't run the startup hook)."""
+    global _client
+    if _client is None:
+        _client = ShopifyClient()
+    return _client
@@ -1,9 +1,10 @@
-import os
-import httpx
 import logging
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from fastapi import HTTPException
 from services.database import get_products_collection, get_carts_collection
+from services.catalog_sync import iter_storefront_product_pages
+from services.shopify_client import ShopifyError, ShopifyHTTPError, get_shopify_client
 
 logger = logging.getLogger("shopify")
 logging.basicConfig(level=logging.INFO)
@@ -12,85 +13,37 @@ class ShopifyService:
     """Handles Shopify GraphQL operations for products and checkout."""
 
     def __init__(self):
-        self.store = os.getenv("SHOPIFY_STORE", "presmtechnologies.myshopify.com")
-        self.token = os.getenv("SHOPIFY_STOREFRONT_TOKEN", "")
-        self.graphql_url = f"https://{self.store}/api/2024-10/graphql.json"
+        self.client = get_shopify_client()
 
-        if not self.token:
+        if not self.client.storefront_token:
             logger.warning("⚠️ SHOPIFY_STOREFRONT_TOKEN not set!")
         else:
-            logger.info(f"✓ Shopify initialized for store: {self.store}")
-
-    def _headers(self) -> Dict[str, str]:
-        return {
-            "X-Shopify-Storefront-Access-Token": self.token,
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
+            logger.info(f"✓ Shopify initialized for store: {self.client.store}")
 
     async def get_products_with_variants(self) -> Dict[str, Any]:
         """Fetch Shopify products with variants and sync to MongoDB."""
-        query = """
-        {
-          products(first: 20) {
-            edges {
-              node {
-                id
-                title
-                handle
-                description
-                images(first: 3) {
-                  edges {
-                    node { url }
-                  }
-                }
-                variants(first: 5) {
-                  edges {
-                    node {
-                      id
-                      title
-                      price { amount currencyCode }
-                      availableForSale
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
-        """
-
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.graphql_url,
-                    headers=self._headers(),
-                    json={"query": query},
-                    timeout=20.0,
+            products = []
+            async for page in iter_storefront_product_pages(self.client):
+                products.extend(
+                    {
+                        "id": p["shopify_id"],
+                        "title": p["name"],
+                        "handle": p["handle"],
+                        "description": p["description"],
+                        "images": p["images"],
+                        "variants": [
+                            {
+                                "id": v["shopify_id"],
+                                "title": v["title"],
+                                "price": v["price"],
+                                "available": v["available"],
+                            }
+                            for v in p["variants"]
+                        ],
+                    }
+                    for p in page["products"]
                 )
-                response.raise_for_status()
-                data = response.json()
-
-            products = [
-                {
-                    "id": edge["node"]["id"],
-                    "title": edge["node"]["title"],
-                    "handle": edge["node"]["handle"],
-                    "description": edge["node"].get("description", ""),
-                    "images": [img["node"]["url"] for img in edge["node"]["images"]["edges"]],
-                    "variants": [
-                        {
-                            "id": v["node"]["id"],
-                            "title": v["node"]["title"],
-                            "price": v["node"]["price"]["amount"],
-                            "currency": v["node"]["price"]["currencyCode"],
-                            "available": v["node"]["availableForSale"],
-                        }
-                        for v in edge["node"]["variants"]["edges"]
-                    ],
-                }
-                for edge in data.get("data", {}).get("products", {}).get("edges", [])
-            ]
 
             # Sync products to MongoDB
             try:
@@ -137,7 +90,7 @@ class ShopifyService:
 
             return {"count": len(products), "products": products}
 
-        except httpx.HTTPStatusError as e:
+        except ShopifyHTTPError as e:
             logger.error(f"HTTP error fetching Shopify products: {str(e)}")
             raise
         except Exception as e:
@@ -173,30 +126,13 @@ class ShopifyService:
             }
             """
 
-            payload = {"query": query, "variables": {"input": {"lineItems": line_items}}}
+            variables = {"input": {"lineItems": line_items}}
+            data = await self.client.storefront_graphql(query, variables)
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.graphql_url,
-                    headers=self._headers(),
-                    json=payload,
-                    timeout=20.0,
-                )
-                response.raise_for_status()
-                data = response.json()
-
-            checkout = (
-                data.get("data", {})
-                .get("checkoutCreate", {})
-                .get("checkout")
-            )
+            checkout = data.get("checkoutCreate", {}).get("checkout")
 
             if not checkout:
-                errors = (
-                    data.get("data", {})
-                    .get("checkoutCreate", {})
-                    .get("checkoutUserErrors", [])
-                )
+                errors = data.get("checkoutCreate", {}).get("checkoutUserErrors", [])
                 message = errors[0]["message"] if errors else "Checkout creation failed"
                 logger.error(f"Checkout creation failed: {message}")
                 raise ValueError(message)
@@ -207,8 +143,8 @@ class ShopifyService:
         except ValueError as e:
             logger.error(f"ValueError during checkout creation: {str(e)}")
             raise HTTPException(status_code=400, detail=str(e))
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error during checkout creation: {str(e)}")
+        except ShopifyError as e:
+            logger.error(f"Shopify error during checkout creation: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
         except Exception as e:
             logger.error(f"Unexpected error during checkout creation: {str(e)}")
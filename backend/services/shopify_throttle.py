@@ -0,0 +1,166 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("shopify_throttle")
+
+
+class Priority(IntEnum):
+    """Lower value is served first when callers queue on the same bucket."""
+    CHECKOUT = 0
+    INTERACTIVE = 1
+    SYNC = 2
+
+
+class LeakyBucket:
+    """
+    Local model of one Shopify leaky bucket.
+
+    `acquire()` deducts a cost (GraphQL query points or one REST call) before the
+    request is sent. If the bucket cannot cover it, the caller is queued by
+    (priority, arrival) and woken exactly when the bucket has refilled enough,
+    so nobody polls or sleeps longer than needed. `settle()` re-syncs the model
+    with the level Shopify reports on each response.
+    """
+
+    def __init__(self, name: str, capacity: float, restore_rate: float):
+        self.name = name
+        self.capacity = float(capacity)
+        self.restore_rate = float(restore_rate)
+        self._available = float(capacity)
+        self._in_flight = 0.0
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._available
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._available = min(self.capacity, self._available + elapsed * self.restore_rate)
+            self._updated = now
+
+    async def acquire(self, cost: float, priority: Priority = Priority.INTERACTIVE) -> float:
+        """Wait until `cost` can be spent. Returns the cost actually reserved."""
+        cost = min(float(cost), self.capacity)
+        self._refill()
+        if not self._waiters and self._available >= cost:
+            self._reserve(cost)
+            return cost
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), cost, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation landed; give it back.
+                self.release(cost)
+            raise
+        return cost
+
+    def _reserve(self, cost: float):
+        self._available -= cost
+        self._in_flight += cost
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, cost, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._available < cost:
+                delay = (cost - self._available) / self.restore_rate
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._reserve(cost)
+            future.set_result(None)
+
+    def release(self, reserved: float):
+        """Return a reservation whose request never reached Shopify."""
+        self._in_flight = max(0.0, self._in_flight - reserved)
+        self._refill()
+        self._available = min(self.capacity, self._available + reserved)
+        self._wake()
+
+    def settle(
+        self,
+        reserved: float,
+        available: Optional[float] = None,
+        capacity: Optional[float] = None,
+        restore_rate: Optional[float] = None,
+    ):
+        """Finish a reservation, adopting Shopify's reported bucket state when present."""
+        self._in_flight = max(0.0, self._in_flight - reserved)
+        if capacity:
+            self.capacity = float(capacity)
+        if restore_rate:
+            self.restore_rate = float(restore_rate)
+        if available is not None:
+            # Shopify's figure doesn't yet include requests still in flight from here.
+            self._available = max(0.0, float(available) - self._in_flight)
+            self._updated = time.monotonic()
+        self._wake()
+
+    def drain(self, blocked_for: float = 0.0):
+        """Shopify says we're throttled: assume the bucket is empty, or in deficit for `blocked_for` seconds."""
+        self._available = -blocked_for * self.restore_rate
+        self._updated = time.monotonic()
+
+    def _wake(self):
+        if self._waiters:
+            try:
+                self._dispatch()
+            except RuntimeError:
+                # No running loop (called from sync teardown); the next acquire dispatches.
+                pass
+
+
+# ------------------------------------------------------------------
+# Response parsing
+# ------------------------------------------------------------------
+def graphql_throttle_status(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Return extensions.cost (requestedQueryCost, actualQueryCost, throttleStatus) or {}."""
+    return (body.get("extensions") or {}).get("cost") or {}
+
+
+def is_graphql_throttled(body: Dict[str, Any]) -> bool:
+    return any(
+        (err.get("extensions") or {}).get("code") == "THROTTLED"
+        for err in body.get("errors") or []
+        if isinstance(err, dict)
+    )
+
+
+def parse_rest_call_limit(header: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse X-Shopify-Shop-Api-Call-Limit ("32/40") into (used, capacity)."""
+    if not header or "/" not in header:
+        return None
+    try:
+        used, capacity = header.split("/", 1)
+        return int(used), int(capacity)
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(header: Optional[str], default: float) -> float:
+    try:
+        return max(0.0, float(header))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,160 @@
+import os
+import logging
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from models.product import ProductVariant
+from services.database import ReadSessionLocal
+from services.shopify_client import ShopifyError, ShopifyUserError, get_shopify_client
+from services.shopify_throttle import Priority
+
+logger = logging.getLogger("variant_availability")
+
+# How long an availableForSale from a Storefront lookup is trusted before checkout re-checks it.
+VARIANT_AVAILABILITY_TTL_SECONDS = float(os.getenv("VARIANT_AVAILABILITY_TTL_SECONDS", "120"))
+# Same for values fed by product syncs and webhooks. Syncs run once the catalog cache is older
+# than CATALOG_CACHE_TTL_SECONDS and a request comes in, so these must outlive one refresh
+# interval (twice it by default) or checkout would look up every variant between syncs anyway.
+VARIANT_AVAILABILITY_SYNC_TTL_SECONDS = float(os.getenv(
+    "VARIANT_AVAILABILITY_SYNC_TTL_SECONDS",
+    str(2 * float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))),
+))
+# Storefront `nodes(ids:)` accepts at most 250 IDs per call.
+NODES_BATCH_SIZE = 250
+
+VARIANT_NODES_QUERY = """
+query variantAvailability($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on ProductVariant { id availableForSale product { id } }
+  }
+}
+"""
+
+
+class VariantUnavailableError(ShopifyUserError):
+    """
+    Some cart variants are sold out or not published to the Storefront.
+
+    Shaped like cartCreate userErrors so callers that already report those
+    don't need another case.
+    """
+
+    def __init__(self, variant_ids: List[str]):
+        self.variant_ids = variant_ids
+        super().__init__([
+            {"field": ["lines", "merchandiseId"], "message": f"Variant {gid} is not available for sale", "variant_id": gid}
+            for gid in variant_ids
+        ])
+
+
+class _Entry(NamedTuple):
+    available: bool
+    product_id: Optional[str]
+    checked_at: float
+    ttl: float
+
+
+class VariantAvailabilityCache:
+    """
+    Last known availableForSale per variant GID, each entry with its own TTL.
+
+    Entries come from product syncs and webhooks (through the product writer,
+    trusted for `sync_ttl`, which outlasts the catalog refresh interval), from
+    product_variants at startup (`load`, trusted the same way) and from
+    Storefront lookups (trusted for `ttl`). A variant missing from the Storefront
+    (unpublished or deleted) is recorded as unavailable. Before checkout,
+    `require_available` refreshes every stale or unknown line in a single
+    batched `nodes` query and rejects the cart locally if anything is
+    unavailable, instead of waiting for cartCreate userErrors. If that lookup
+    fails, checkout proceeds and Shopify has the final word.
+    """
+
+    def __init__(self, ttl: float = VARIANT_AVAILABILITY_TTL_SECONDS, sync_ttl: float = VARIANT_AVAILABILITY_SYNC_TTL_SECONDS):
+        self.ttl = ttl
+        self.sync_ttl = sync_ttl
+        self._entries: Dict[str, _Entry] = {}
+        self.stats = {"checked": 0, "refreshed": 0, "rejected": 0}
+
+    # --- writes ---
+    def record(self, variant_id: str, available: bool, product_id: Optional[str] = None, ttl: Optional[float] = None):
+        self._entries[variant_id] = _Entry(bool(available), product_id, time.monotonic(), self.ttl if ttl is None else ttl)
+
+    def record_products(self, products: Iterable[Dict[str, Any]]):
+        """Record every variant of normalized products (or product rows) that reports availability."""
+        for p in products:
+            for v in p.get("variants") or []:
+                if v.get("shopify_id") and v.get("available") is not None:
+                    self.record(v["shopify_id"], v["available"], p.get("shopify_id"), self.sync_ttl)
+
+    async def load(self) -> int:
+        """Seed entries from product_variants (startup), so checkout after a restart needn't ask the Storefront."""
+        async with ReadSessionLocal() as session:
+            rows = (await session.execute(
+                select(ProductVariant.product_id, ProductVariant.shopify_id, ProductVariant.available)
+            )).all()
+        products: Dict[str, List[Dict[str, Any]]] = {}
+        for product_id, gid, available in rows:
+            products.setdefault(product_id, []).append({"shopify_id": gid, "available": available})
+        self.record_products({"shopify_id": pid, "variants": variants} for pid, variants in products.items())
+        logger.info(f"📦 Loaded availability for {len(rows)} variants")
+        return len(rows)
+
+    def forget_products(self, product_ids: Iterable[str]):
+        """Products were deleted in Shopify: their variants can't be bought any more."""
+        ids = set(product_ids)
+        now = time.monotonic()
+        for gid, entry in list(self._entries.items()):
+            if entry.product_id in ids:
+                self._entries[gid] = entry._replace(available=False, checked_at=now, ttl=self.sync_ttl)
+
+    # --- reads ---
+    def is_available(self, variant_id: str) -> Optional[bool]:
+        """Fresh availability, or None when unknown or past its TTL."""
+        entry = self._entries.get(variant_id)
+        if entry is None or time.monotonic() - entry.checked_at > entry.ttl:
+            return None
+        return entry.available
+
+    async def refresh(self, variant_ids: Iterable[str]):
+        """Look up every stale or unknown variant in `variant_ids` with batched Storefront `nodes` queries."""
+        stale = [gid for gid in dict.fromkeys(variant_ids) if self.is_available(gid) is None]
+        if not stale:
+            return
+        client = get_shopify_client()
+        for start in range(0, len(stale), NODES_BATCH_SIZE):
+            ids = stale[start:start + NODES_BATCH_SIZE]
+            data = await client.storefront_graphql(VARIANT_NODES_QUERY, {"ids": ids}, priority=Priority.CHECKOUT)
+            nodes = data.get("nodes") or []
+            for gid, node in zip(ids, nodes + [None] * (len(ids) - len(nodes))):
+                if node:
+                    self.record(gid, node.get("availableForSale", False), (node.get("product") or {}).get("id"))
+                else:
+                    # Not visible to the Storefront: unpublished, deleted or never existed.
+                    known = self._entries.get(gid)
+                    self.record(gid, False, known.product_id if known else None)
+        self.stats["refreshed"] += len(stale)
+
+    async def require_available(self, variant_ids: Iterable[str]):
+        """Raise VariantUnavailableError if any variant is known to be unavailable after a refresh."""
+        ids = list(variant_ids)
+        self.stats["checked"] += 1
+        try:
+            await self.refresh(ids)
+        except ShopifyError as e:
+            logger.warning("⚠️ Variant availability check skipped: %s", e)
+        # Only fresh answers reject a cart; after a failed lookup, stale ones are left to Shopify.
+        unavailable = [gid for gid in ids if self.is_available(gid) is False]
+        if unavailable:
+            self.stats["rejected"] += 1
+            logger.info("Rejecting checkout locally; unavailable variants: %s", unavailable)
+            raise VariantUnavailableError(unavailable)
+
+
+# Module-level singleton
+variant_availability = VariantAvailabilityCache()
+
+
+def get_variant_availability() -> VariantAvailabilityCache:
+    return variant_availability
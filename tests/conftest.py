@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+# The backend imports its modules top-level (services.*, models.*), and reads
+# DATABASE_URL when services.database is first imported, so both are set up
+# before any test module imports backend code.
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend"))
+sys.path.insert(0, BACKEND_DIR)
+
+_db_dir = tempfile.mkdtemp(prefix="presm-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("DB_PROFILE", "bench")
+# Route modules refuse to import without Shopify credentials; tests only ever talk to the simulator.
+os.environ.setdefault("SHOPIFY_STORE", "shopify.test")
+os.environ.setdefault("SHOPIFY_ACCESS_TOKEN", "sim")
+os.environ.setdefault("SHOPIFY_STOREFRONT_TOKEN", "sim")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def database():
+    """
+    A freshly created schema for one test, dropped afterwards. Pooled
+    connections are disposed too, since each test runs on its own event loop.
+    """
+    from services import database
+    from models.product import Base as ProductBase
+    from models.cart import Base as CartBase
+    from models.idempotency import Base as IdempotencyBase
+    from models.sync_state import Base as SyncStateBase
+    from models.shopify_cart import Base as ShopifyCartBase
+
+    await database.init_db()
+    yield database
+    async with database.engine.begin() as conn:
+        for base in (ProductBase, CartBase, IdempotencyBase, SyncStateBase, ShopifyCartBase):
+            await conn.run_sync(base.metadata.drop_all)
+    for engine in {database.engine, database.read_engine, database.write_engine}:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def catalog(database):
+    """One product with three variants in the local catalog; yields its product_id and variant GIDs."""
+    from services.catalog_store import save_products
+
+    product_id = "gid://shopify/Product/1"
+    variants = [f"gid://shopify/ProductVariant/{n}" for n in (11, 12, 13)]
+    await save_products([{
+        "shopify_id": product_id,
+        "name": "Transfer",
+        "price": 5.0,
+        "variants": [{"shopify_id": gid, "title": gid[-2:], "price": 5.0, "available": True} for gid in variants],
+    }])
+    return SimpleNamespace(product_id=product_id, variants=variants)
+
+
+@pytest.fixture
+async def api_client():
+    """An httpx client for the backend app, in-process; startup jobs don't run, so tests wire what they need."""
+    from server import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def shopify():
+    """A ShopifyClient wired in-process to scripts/shopify_simulator.py; yields (client, simulator state)."""
+    from scripts.shopify_simulator import SimConfig, create_app
+    from services.shopify_client import ShopifyClient
+
+    app = create_app(SimConfig(products=7, variants=3, latency_ms=0, bulk_seconds=0))
+    client = ShopifyClient(store="http://shopify.test", access_token="sim", storefront_token="sim")
+    client.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://shopify.test")
+    yield client, app.state.sim
+    await client.aclose()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: spawns worker processes; deselect with -m 'not slow'")
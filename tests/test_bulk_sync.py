@@ -0,0 +1,80 @@
+import pytest
+
+from services import bulk_sync
+from services.bulk_sync import iter_bulk_products, run_bulk_sync, start_bulk_query, wait_for_bulk_operation
+from services.catalog_store import load_products, save_products
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(bulk_sync, "BULK_POLL_MIN_SECONDS", 0)
+
+
+def _expected(sim):
+    return {
+        p.gid(): {
+            "name": p.title,
+            "images": p.images,
+            "variants": [f"gid://shopify/ProductVariant/{v['id']}" for v in p.variants],
+        }
+        for p in sim.products.values()
+        if p.status == "ACTIVE" and p.visible_at is not None
+    }
+
+
+async def test_iter_bulk_products_reassembles_children_under_their_parent(shopify):
+    client, sim = shopify
+    operation = await wait_for_bulk_operation(client, await start_bulk_query(client))
+
+    products = [p async for p in iter_bulk_products(client.stream_lines(operation["url"]))]
+
+    assert {
+        p["shopify_id"]: {"name": p["name"], "images": p["images"], "variants": [v["shopify_id"] for v in p["variants"]]}
+        for p in products
+    } == _expected(sim)
+    assert all(p["price"] == p["variants"][0]["price"] for p in products)
+
+
+async def test_iter_bulk_products_skips_orphaned_rows():
+    async def lines():
+        yield '{"id": "gid://shopify/Product/1", "title": "One"}'
+        yield '{"id": "gid://shopify/ProductVariant/10", "price": "5.00", "__parentId": "gid://shopify/Product/1"}'
+        yield '{"id": "gid://shopify/ProductVariant/99", "price": "1.00", "__parentId": "gid://shopify/Product/9"}'
+        yield '{"id": "gid://shopify/Product/2", "title": "Two"}'
+
+    products = [p async for p in iter_bulk_products(lines())]
+
+    assert [(p["shopify_id"], [v["shopify_id"] for v in p["variants"]]) for p in products] == [
+        ("gid://shopify/Product/1", ["gid://shopify/ProductVariant/10"]),
+        ("gid://shopify/Product/2", []),
+    ]
+
+
+async def test_run_bulk_sync_writes_products_and_tombstones_missing(shopify, database):
+    client, sim = shopify
+    await save_products([{"shopify_id": "gid://shopify/Product/1", "name": "Gone from Shopify", "price": 5.0, "variants": []}])
+
+    stats = await run_bulk_sync(client=client, batch_size=3)
+
+    assert stats["products"] == len(sim.products)
+    assert stats["deleted"] == 1
+    stored = {
+        p["shopify_id"]: {"name": p["name"], "images": p["images"], "variants": [v["shopify_id"] for v in p["variants"]]}
+        for p in await load_products()
+    }
+    assert stored == _expected(sim)
+
+
+async def test_run_bulk_sync_hides_draft_and_unpublished_products(shopify, database):
+    client, sim = shopify
+    draft, unpublished, *_ = sim.products.values()
+    draft.status = "DRAFT"
+    unpublished.visible_at = None
+
+    await run_bulk_sync(client=client)
+
+    listed = {p["shopify_id"] for p in await load_products()}
+    assert draft.gid() not in listed and unpublished.gid() not in listed
+    assert listed == set(_expected(sim))
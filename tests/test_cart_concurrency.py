@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+from services.cart_service import CartService
+from services.db_writer import get_db_writer
+
+pytestmark = pytest.mark.anyio
+
+SESSION = "concurrent"
+
+
+async def _adds(service: CartService, catalog, count: int, offset: int = 0):
+    """`count` adds spread over the catalog's variants (variant n gets n+1 units per add); returns the units added per variant."""
+    variants = catalog.variants
+    added = {gid: 0 for gid in variants}
+    calls = []
+    for n in range(offset, offset + count):
+        gid = variants[n % len(variants)]
+        quantity = n % len(variants) + 1
+        added[gid] += quantity
+        calls.append(service.add_item_to_cart(SESSION, catalog.product_id, gid, quantity))
+    carts = await asyncio.gather(*calls)
+    assert all(cart is not None for cart in carts)
+    return added
+
+
+async def _final_cart():
+    # A fresh service: no cache, straight from the database.
+    cart = await CartService().get_cart(SESSION)
+    return {i["variant_id"]: i["quantity"] for i in cart["items"]}, cart["version"]
+
+
+@pytest.mark.parametrize("writer", ["direct", "group_commit"])
+async def test_concurrent_adds_lose_no_quantity(catalog, writer):
+    if writer == "group_commit":
+        get_db_writer().start()
+    # Several services stand in for several workers, each with its own cart cache.
+    services = [CartService() for _ in range(4)]
+    try:
+        results = await asyncio.gather(*(_adds(service, catalog, 50, offset=50 * n) for n, service in enumerate(services)))
+    finally:
+        await get_db_writer().stop()
+
+    expected = {gid: sum(r[gid] for r in results) for gid in catalog.variants}
+    assert await _final_cart() == (expected, 200)
+
+
+async def test_concurrent_batches_and_adds_apply_in_some_order(catalog):
+    service = CartService()
+    variants = catalog.variants
+    await service.add_item_to_cart(SESSION, catalog.product_id, variants[0], 1)
+
+    ops = [{"op": "add", "variant_id": variants[0], "quantity": 2}, {"op": "add", "variant_id": variants[1], "quantity": 1}]
+    await asyncio.gather(
+        *(CartService().apply_operations(SESSION, ops) for _ in range(20)),
+        *(CartService().add_item_to_cart(SESSION, catalog.product_id, variants[2], 1) for _ in range(20)),
+    )
+
+    assert await _final_cart() == ({variants[0]: 41, variants[1]: 20, variants[2]: 20}, 41)
+
+
+def _worker_process(catalog, offset: int, count: int, results):
+    async def run():
+        from services import database
+
+        try:
+            results.put(await _adds(CartService(), catalog, count, offset))
+        finally:
+            for engine in {database.engine, database.read_engine, database.write_engine}:
+                await engine.dispose()
+
+    asyncio.run(run())
+
+
+@pytest.mark.slow
+async def test_concurrent_adds_from_several_processes(catalog):
+    """Separate processes share only the SQLite file, so this exercises locked-database retries."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=_worker_process, args=(catalog, 40 * n, 40, results)) for n in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        await asyncio.to_thread(worker.join, 120)
+        assert worker.exitcode == 0
+    totals = [results.get(timeout=5) for _ in workers]
+
+    expected = {gid: sum(t[gid] for t in totals) for gid in catalog.variants}
+    assert await _final_cart() == (expected, 160)
+
+
+async def test_locked_database_is_left_to_the_writer_to_retry(catalog, monkeypatch):
+    from sqlalchemy.exc import OperationalError
+
+    from services import cart_service
+
+    class LockedWriter:
+        runs = 0
+
+        async def run(self, work):
+            # What the writer raises once its own lock retries are used up.
+            self.runs += 1
+            raise OperationalError("UPDATE carts", {}, Exception("database is locked"))
+
+    writer = LockedWriter()
+    monkeypatch.setattr(cart_service, "get_db_writer", lambda: writer)
+    service = CartService()
+
+    with pytest.raises(cart_service.CartConflictError, match="busy"):
+        await service.add_item_to_cart(SESSION, catalog.product_id, catalog.variants[0], 1)
+    with pytest.raises(cart_service.CartConflictError, match="busy"):
+        await service.apply_operations(SESSION, [{"op": "add", "variant_id": catalog.variants[0], "quantity": 1}])
+
+    assert writer.runs == 2
+    assert service.stats["conflicts"] == 2
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from models.cart import Cart, CartItem
+from services import cart_expiry
+from services.cart_expiry import CartExpiry
+from services.cart_service import CartService
+from services.database import ReadSessionLocal
+from services.db_writer import get_db_writer
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 1, 31)
+
+
+async def _carts(catalog, ages, lines=True):
+    """One cart per age (a timedelta), last written that long before NOW."""
+    service = CartService()
+    for n, age in enumerate(ages):
+        session_id = f"s{n}" if lines else f"empty{n}"
+        if lines:
+            await service.add_item_to_cart(session_id, catalog.product_id, catalog.variants[0], 1)
+        else:
+            await service.get_or_create_cart(session_id)
+        await get_db_writer().run(lambda session, s=session_id, a=age: session.execute(
+            update(Cart).where(Cart.session_id == s).values(updated_at=NOW - a)
+        ))
+
+
+async def _remaining():
+    async with ReadSessionLocal() as session:
+        carts = (await session.execute(select(Cart.session_id).order_by(Cart.session_id))).scalars().all()
+        lines = (await session.execute(select(func.count()).select_from(CartItem))).scalar()
+    return carts, lines
+
+
+async def test_expired_carts_are_deleted_with_their_lines_in_batches(catalog, monkeypatch):
+    await _carts(catalog, [timedelta(days=40)] * 5 + [timedelta(days=1)])
+    writer = get_db_writer()
+    batches = []
+
+    class CountingWriter:
+        async def run(self, work):
+            batches.append(work)
+            return await writer.run(work)
+
+    monkeypatch.setattr(cart_expiry, "get_db_writer", lambda: CountingWriter())
+
+    totals = await CartExpiry(ttl=timedelta(days=30), batch_size=2).purge_expired(NOW)
+
+    assert totals == {"carts": 5, "lines": 5}
+    assert len(batches) == 3
+    assert await _remaining() == (["s5"], 1)
+
+
+async def test_cart_written_between_select_and_delete_survives(catalog, monkeypatch):
+    await _carts(catalog, [timedelta(days=40)] * 2)
+    writer = get_db_writer()
+
+    class TouchFirst:
+        async def run(self, work):
+            # s0 is written to after the batch picked it, before the batch's delete runs.
+            await writer.run(lambda session: session.execute(
+                update(Cart).where(Cart.session_id == "s0").values(updated_at=NOW)
+            ))
+            return await writer.run(work)
+
+    monkeypatch.setattr(cart_expiry, "get_db_writer", lambda: TouchFirst())
+
+    totals = await CartExpiry(ttl=timedelta(days=30)).purge_expired(NOW)
+
+    assert totals == {"carts": 1, "lines": 1}
+    assert await _remaining() == (["s0"], 1)
+
+
+async def test_empty_carts_expire_on_their_own_shorter_ttl(catalog):
+    await _carts(catalog, [timedelta(days=2), timedelta(hours=1)], lines=False)
+    await _carts(catalog, [timedelta(days=2)])
+
+    totals = await CartExpiry(ttl=timedelta(days=30), empty_ttl=timedelta(hours=24)).purge_expired(NOW)
+
+    assert totals == {"carts": 1, "lines": 0}
+    assert await _remaining() == (["empty1", "s0"], 1)
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from routes import cart as cart_routes
+from services.cart_service import CartService
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_first_add_to_a_migrated_legacy_cart_keeps_its_items(database, catalog):
+    # A cart from before cart_items and carts.version: lines in the JSON column, no version.
+    async with database.engine.begin() as conn:
+        await conn.execute(text("DROP TABLE carts"))
+        await conn.execute(text(
+            "CREATE TABLE carts (id INTEGER PRIMARY KEY, session_id VARCHAR UNIQUE, items JSON, "
+            "created_at DATETIME, updated_at DATETIME)"
+        ))
+        await conn.execute(
+            text("INSERT INTO carts (session_id, items, created_at, updated_at) VALUES ('legacy', :items, :now, :now)"),
+            {"items": json.dumps([{"product_id": catalog.product_id, "variant_id": catalog.variants[0], "quantity": 2}]),
+             "now": "2024-01-01 00:00:00"},
+        )
+    await database.init_db()
+    service = CartService()
+
+    cart = await service.add_item_to_cart("legacy", catalog.product_id, catalog.variants[1], 1)
+
+    expected = {catalog.variants[0]: 2, catalog.variants[1]: 1}
+    assert {i["variant_id"]: i["quantity"] for i in cart["items"]} == expected
+    fresh = await CartService().get_cart("legacy")
+    assert {i["variant_id"]: i["quantity"] for i in fresh["items"]} == expected
+    assert (await service.get_cart("legacy"))["items"] == fresh["items"]
+
+
+async def test_add_operation_with_explicit_zero_quantity_is_rejected(catalog):
+    service = CartService()
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[0], 2)
+
+    with pytest.raises(ValueError, match="at least 1"):
+        await service.apply_operations("s1", [
+            {"op": "add", "variant_id": catalog.variants[1], "quantity": 1},
+            {"op": "add", "variant_id": catalog.variants[0], "quantity": 0},
+        ])
+
+    cart = await service.get_cart("s1")
+    assert {i["variant_id"]: i["quantity"] for i in cart["items"]} == {catalog.variants[0]: 2}
+
+
+async def test_batch_set_without_quantity_removes_the_line(catalog, api_client, monkeypatch):
+    class NoShopifySync:
+        def schedule_sync(self, session_id):
+            pass
+
+    service = CartService()
+    monkeypatch.setattr(cart_routes, "get_cart_service", lambda: service)
+    monkeypatch.setattr(cart_routes, "get_shopify_cart_service", NoShopifySync)
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[0], 2)
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[1], 1)
+
+    response = await api_client.post(
+        "/api/cart/items/batch",
+        headers={"x-session-id": "s1"},
+        json={"operations": [{"op": "set", "variant_id": catalog.variants[0]}]},
+    )
+
+    assert response.status_code == 200
+    assert {i["variant_id"]: i["quantity"] for i in response.json()["cart"]["items"]} == {catalog.variants[1]: 1}
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import select
+
+from models.product import ProductVariant
+from services.catalog_store import load_products, save_products
+
+pytestmark = pytest.mark.anyio
+
+PRODUCT_ID = "gid://shopify/Product/5"
+VARIANT_ID = "gid://shopify/ProductVariant/50"
+
+
+def _product(name, updated_at, status="active"):
+    return {
+        "shopify_id": PRODUCT_ID,
+        "name": name,
+        "price": 5.0,
+        "status": status,
+        "updated_at": updated_at,
+        "variants": [{"shopify_id": VARIANT_ID, "price": 5.0, "available": True}],
+    }
+
+
+async def _listed():
+    return [p["name"] for p in await load_products()]
+
+
+async def _variant_ids(database):
+    async with database.ReadSessionLocal() as session:
+        return (await session.execute(select(ProductVariant.shopify_id))).scalars().all()
+
+
+async def test_older_payload_does_not_overwrite_newer_product(database):
+    await save_products([_product("Current", "2025-01-01T00:00:00Z")])
+
+    await save_products([_product("Late webhook", "2020-01-01T00:00:00-05:00")])
+
+    assert await _listed() == ["Current"]
+
+
+async def test_inactive_status_hides_product_until_active_again(database):
+    await save_products([_product("Shirt", "2025-01-01T00:00:00Z")])
+
+    await save_products([_product("Shirt", "2025-02-01T00:00:00Z", status="draft")])
+    assert await _listed() == []
+    assert await _variant_ids(database) == []
+
+    await save_products([_product("Shirt", "2025-03-01T00:00:00Z", status="ACTIVE")])
+    assert await _listed() == ["Shirt"]
+    assert await _variant_ids(database) == [VARIANT_ID]
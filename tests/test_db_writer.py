@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from services.db_writer import DatabaseWriter
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_writes_arriving_during_stop_still_commit(database):
+    writer = DatabaseWriter()
+    writer.start()
+
+    async def job(session):
+        return (await session.execute(text("SELECT 1"))).scalar()
+
+    async def slow_job(session):
+        await asyncio.sleep(0.2)
+        return await job(session)
+
+    # The writer picks up the slow job together with stop()'s marker, so its
+    # last batch is already running when the late write arrives.
+    queued = asyncio.ensure_future(writer.run(slow_job))
+    stopping = asyncio.ensure_future(writer.stop())
+    await asyncio.sleep(0.1)
+    late = asyncio.ensure_future(writer.run(job))
+
+    assert await asyncio.wait_for(asyncio.gather(queued, late, stopping), timeout=5) == [1, 1, None]
+    assert await writer.run(job) == 1
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from models.idempotency import IdempotencyRecord
+from routes import gang_sheets
+from services import idempotency_service
+from services.database import ReadSessionLocal
+from services.idempotency_service import IdempotencyService
+
+pytestmark = pytest.mark.anyio
+
+KEY = "gang-sheet-1"
+
+
+@pytest.fixture
+def gang_sheet(shopify, database, monkeypatch):
+    """Gang sheet creation against the simulator whose first image upload fails (after productCreate)."""
+    client, sim = shopify
+    uploads = []
+
+    async def flaky_upload(encoded):
+        uploads.append(encoded)
+        if len(uploads) == 1:
+            raise HTTPException(status_code=400, detail="Image upload failed after multiple retries.")
+        return "https://i.ibb.co/sheet.png"
+
+    async def visible(variant_gid, **_):
+        return True
+
+    async def checkout(variant_gid, quantity, **_):
+        return f"https://checkout.test/{variant_gid}"
+
+    monkeypatch.setattr(gang_sheets, "get_shopify_client", lambda: client)
+    monkeypatch.setattr(gang_sheets, "SHOPIFY_ONLINE_CHANNEL_ID", "")
+    monkeypatch.setattr(gang_sheets, "upload_to_imgbb_with_retry", flaky_upload)
+    monkeypatch.setattr(gang_sheets, "wait_for_variant_in_storefront", visible)
+    monkeypatch.setattr(gang_sheets, "create_shopify_checkout", checkout)
+    monkeypatch.setattr(idempotency_service, "IDEMPOTENCY_POLL_INTERVAL", 0.01)
+
+    def work():
+        return gang_sheets._create_gang_sheet(None, "Sheet", "<p>Sheet</p>", 12.5, b"png", None, 1)
+
+    return sim, work
+
+
+async def _stored(key):
+    async with ReadSessionLocal() as session:
+        return (await session.execute(select(IdempotencyRecord).where(IdempotencyRecord.key == key))).scalars().first()
+
+
+async def test_duplicate_resumes_a_failed_attempt_instead_of_creating_another_product(gang_sheet):
+    sim, work = gang_sheet
+    before = set(sim.products)
+
+    # Two workers (separate services) get the same request; whichever claims the key fails after productCreate.
+    outcomes = await asyncio.gather(
+        IdempotencyService().run(KEY, "fp", work),
+        IdempotencyService().run(KEY, "fp", work),
+        return_exceptions=True,
+    )
+
+    assert sorted(type(o).__name__ for o in outcomes) == ["HTTPException", "tuple"]
+    result, _ = next(o for o in outcomes if isinstance(o, tuple))
+    created = set(sim.products) - before
+    assert len(created) == 1
+    assert result["product_id"] == sim.products[created.pop()].gid()
+    assert result["image_url"] == "https://i.ibb.co/sheet.png"
+
+
+async def test_client_retry_resumes_from_the_created_product(gang_sheet):
+    sim, work = gang_sheet
+    before = set(sim.products)
+    service = IdempotencyService()
+
+    with pytest.raises(HTTPException):
+        await service.run(KEY, "fp", work)
+    failed = await _stored(KEY)
+    assert failed.status == "failed" and failed.progress["product_id"]
+
+    result, replayed = await service.run(KEY, "fp", work)
+
+    assert not replayed
+    assert result["product_id"] == failed.progress["product_id"]
+    assert len(set(sim.products) - before) == 1
+    assert (await _stored(KEY)).status == "completed"
+
+
+async def test_failure_before_any_side_effect_releases_the_key(database):
+    async def work():
+        raise HTTPException(status_code=400, detail="bad input")
+
+    with pytest.raises(HTTPException):
+        await IdempotencyService().run(KEY, "fp", work)
+
+    assert await _stored(KEY) is None
@@ -0,0 +1,169 @@
+import pytest
+from sqlalchemy import select
+
+from models.cart import Cart, CartItem, CartLogEntry
+from services.cart_service import CartService
+from services.database import ReadSessionLocal
+from services.in_memory_cart_service import InMemoryCartService
+
+pytestmark = pytest.mark.anyio
+
+
+def _lines(cart):
+    return [(i["variant_id"], i["quantity"], i["name"], i["price"]) for i in cart["items"]]
+
+
+async def _log():
+    async with ReadSessionLocal() as session:
+        entries = (await session.execute(select(CartLogEntry).order_by(CartLogEntry.id))).scalars().all()
+    return [(entry.session_id, entry.version, entry.changes) for entry in entries]
+
+
+async def _rows(session_id):
+    async with ReadSessionLocal() as session:
+        rows = (await session.execute(
+            select(CartItem).join(Cart, Cart.id == CartItem.cart_id).where(Cart.session_id == session_id).order_by(CartItem.id)
+        )).scalars().all()
+    return {row.variant_id: (row.id, row.quantity) for row in rows}
+
+
+async def test_flushed_log_replays_into_a_fresh_instance(catalog):
+    service = InMemoryCartService(shards=4)
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[0], 2)
+    await service.apply_operations("s1", [
+        {"op": "add", "variant_id": catalog.variants[1], "quantity": 3},
+        {"op": "set", "variant_id": catalog.variants[0], "quantity": 5},
+    ])
+    await service.add_item_to_cart("s2", catalog.product_id, catalog.variants[2], 1)
+    await service.clear_cart("s2")
+
+    # Two creations and four changes; nothing in the snapshot tables yet.
+    assert await service.flush() == 6
+    assert await service.flush() == 0
+    assert await CartService().get_cart("s1") is None
+
+    fresh = InMemoryCartService(shards=4)
+    for session_id in ("s1", "s2"):
+        before, after = await service.get_cart(session_id), await fresh.get_cart(session_id)
+        assert {k: after[k] for k in ("items", "version")} == {k: before[k] for k in ("items", "version")}
+    assert fresh.stats["loads"] == 2
+
+    assert await service.compact() == 6
+    assert await _log() == []
+    assert (await service.get_cart("s1"))["id"] is not None
+    # The snapshot is the same cart the SQLite backend sees.
+    assert _lines(await CartService().get_cart("s1")) == _lines(await service.get_cart("s1"))
+    assert (await CartService().get_cart("s2"))["items"] == []
+
+
+async def test_flush_appends_only_changed_lines_and_compaction_upserts_them(catalog):
+    service = InMemoryCartService(shards=4)
+    for gid in catalog.variants:
+        await service.add_item_to_cart("s1", catalog.product_id, gid, 1)
+    await service.flush()
+    await service.compact()
+    before = await _rows("s1")
+
+    await service.apply_operations("s1", [
+        {"op": "set", "variant_id": catalog.variants[1], "quantity": 4},
+        {"op": "remove", "variant_id": catalog.variants[0]},
+    ])
+    await service.flush()
+
+    [(session_id, version, changes)] = await _log()
+    assert (session_id, version) == ("s1", 4)
+    assert changes == {catalog.variants[1]: (await service.get_cart("s1"))["items"][0], catalog.variants[0]: None}
+
+    # Crash recovery: the snapshot plus the log since.
+    expected = _lines(await service.get_cart("s1"))
+    assert _lines(await InMemoryCartService().get_cart("s1")) == expected
+
+    await service.compact()
+    after = await _rows("s1")
+    assert after == {catalog.variants[1]: (before[catalog.variants[1]][0], 4), catalog.variants[2]: before[catalog.variants[2]]}
+    assert _lines(await InMemoryCartService().get_cart("s1")) == expected
+
+
+async def test_trim_evicts_only_clean_carts(catalog):
+    service = InMemoryCartService(shards=1, max_carts=2)
+    for n in range(4):
+        await service.add_item_to_cart(f"s{n}", catalog.product_id, catalog.variants[0], n + 1)
+
+    # Over the limit, but nothing is on disk yet, so nothing may go.
+    shard = service._shards[0]
+    assert len(shard.carts) == 4
+    assert service.stats["evicted"] == 0
+
+    await service.flush()
+    assert len(shard.carts) == 2
+    assert service.stats["evicted"] == 2
+
+    # A dirty cart survives being the least recently used one.
+    await service.add_item_to_cart("s4", catalog.product_id, catalog.variants[0], 1)
+    oldest = next(iter(shard.carts))
+    await service.add_item_to_cart(oldest, catalog.product_id, catalog.variants[1], 1)
+    shard.carts.move_to_end(oldest, last=False)
+    await service.add_item_to_cart("s5", catalog.product_id, catalog.variants[0], 1)
+    assert oldest in shard.carts
+
+    # Evicted carts come back from the log unchanged.
+    for n in range(4):
+        cart = await service.get_cart(f"s{n}")
+        assert [(i["variant_id"], i["quantity"]) for i in cart["items"]][:1] == [(catalog.variants[0], n + 1)]
+
+
+async def test_matches_the_sqlite_cart_service(catalog):
+    memory, sqlite = InMemoryCartService(shards=4), CartService()
+    steps = [
+        ("add", (catalog.product_id, catalog.variants[0], 2)),
+        ("add", (catalog.product_id, catalog.variants[1], 1)),
+        ("add", (catalog.product_id, catalog.variants[0], 3)),
+        ("ops", [{"op": "add", "variant_id": catalog.variants[2], "quantity": 4}, {"op": "set", "variant_id": catalog.variants[1], "quantity": 6}]),
+        ("ops", [{"op": "set", "variant_id": catalog.variants[0]}, {"op": "remove", "variant_id": catalog.variants[2]}]),
+        ("ops", [{"op": "remove", "variant_id": catalog.variants[0]}, {"op": "add", "variant_id": catalog.variants[0]}]),
+    ]
+
+    for kind, args in steps:
+        if kind == "add":
+            carts = [await service.add_item_to_cart("s1", *args) for service in (memory, sqlite)]
+        else:
+            carts = [await service.apply_operations("s1", args) for service in (memory, sqlite)]
+        assert _lines(carts[0]) == _lines(carts[1])
+
+    assert await memory.add_item_to_cart("s1", "gid://shopify/Product/999", catalog.variants[0], 1) is None
+    assert await sqlite.add_item_to_cart("s1", "gid://shopify/Product/999", catalog.variants[0], 1) is None
+    bad_batches = [
+        [{"op": "add", "variant_id": "gid://shopify/ProductVariant/999", "quantity": 1}],
+        [{"op": "add", "variant_id": catalog.variants[0], "quantity": 0}],
+        [{"op": "set", "variant_id": catalog.variants[0], "quantity": -1}],
+        [],
+    ]
+    for operations in bad_batches:
+        errors = []
+        for service in (memory, sqlite):
+            with pytest.raises(ValueError) as error:
+                await service.apply_operations("s1", operations)
+            errors.append(str(error.value))
+        assert errors[0] == errors[1]
+    assert _lines(await memory.get_cart("s1")) == _lines(await sqlite.get_cart("s1"))
+
+
+async def test_expiry_spares_carts_with_uncompacted_changes(catalog, monkeypatch):
+    from datetime import datetime, timedelta
+
+    from services import cart_expiry
+    from services.cart_expiry import CartExpiry
+
+    service = InMemoryCartService(shards=1)
+    monkeypatch.setattr(cart_expiry, "get_cart_service", lambda: service)
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[0], 1)
+    await service.flush()
+    await service.compact()
+    await service.add_item_to_cart("s1", catalog.product_id, catalog.variants[1], 1)
+    await service.flush()
+
+    later = datetime.utcnow() + timedelta(days=365)
+    assert (await CartExpiry().purge_expired(later))["carts"] == 0
+
+    await service.compact()
+    assert (await CartExpiry().purge_expired(later))["carts"] == 1
@@ -0,0 +1,17 @@
+from services.pricing import GANG_SHEET_DESIGN_FEE, PricingEngine
+
+
+def test_no_quantity_breaks_by_default():
+    priced = PricingEngine().price_cart([{"variant_id": "v1", "quantity": 30, "price": 9.99}])
+
+    assert priced["lines"][0]["unit_price"] == 9.99
+    assert priced["subtotal"] == 299.70
+
+
+def test_gang_sheet_design_fee_follows_quantity_breaks():
+    engine = PricingEngine([(1, 0.0), (10, 0.10)])
+
+    small, large = engine.price_gang_sheets([(20.0, [2, 3]), (20.0, [4, 6])])
+
+    assert small == round(20.0 + 5 * GANG_SHEET_DESIGN_FEE, 2)
+    assert large == round(20.0 + 10 * GANG_SHEET_DESIGN_FEE * 0.9, 2)
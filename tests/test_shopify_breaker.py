@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services import shopify_breaker
+from services.shopify_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(shopify_breaker, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _opened(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", min_calls=2, open_seconds=30.0)
+    for _ in range(2):
+        breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_open_breaker_lets_one_probe_through_after_open_seconds(clock):
+    breaker = _opened(clock)
+    assert breaker.allow() is None
+
+    clock.now += 30
+    probe = breaker.allow()
+
+    assert probe is not None and breaker.state == HALF_OPEN
+    assert breaker.allow() is None
+
+
+@pytest.mark.parametrize("success, state", [(True, CLOSED), (False, OPEN)])
+def test_probe_outcome_closes_or_reopens(clock, success, state):
+    breaker = _opened(clock)
+    clock.now += 30
+    probe = breaker.allow()
+
+    breaker.record(probe, success, 0.1)
+
+    assert breaker.state == state
+
+
+@pytest.mark.parametrize("success", [True, False])
+def test_call_from_before_the_open_cannot_decide_the_probe(clock, success):
+    breaker = CircuitBreaker("test", min_calls=2, open_seconds=30.0)
+    straggler = breaker.allow()
+    for _ in range(2):
+        breaker.record(breaker.allow(), False, 0.1)
+    clock.now += 30
+    probe = breaker.allow()
+
+    breaker.record(straggler, success, 25.0)
+    assert breaker.state == HALF_OPEN
+
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_only_the_probe_frees_the_probe_slot(clock):
+    breaker = CircuitBreaker("test", min_calls=2, open_seconds=30.0)
+    straggler = breaker.allow()
+    for _ in range(2):
+        breaker.record(breaker.allow(), False, 0.1)
+    clock.now += 30
+    probe = breaker.allow()
+
+    breaker.abandon(straggler)
+    assert breaker.allow() is None
+
+    breaker.abandon(probe)
+    assert breaker.allow() is not None
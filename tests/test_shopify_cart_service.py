@@ -0,0 +1,97 @@
+import pytest
+
+from services import shopify_cart_service as module
+from services.shopify_cart_service import ShopifyCartService, desired_lines
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def carts(shopify, database, monkeypatch):
+    client, sim = shopify
+    monkeypatch.setattr(module, "get_shopify_client", lambda: client)
+    variant = next(iter(sim.products.values())).variants[0]
+    return ShopifyCartService(), sim, {f"gid://shopify/ProductVariant/{variant['id']}": 2}
+
+
+async def test_unchanged_cart_reuses_checkout_url_without_calling_shopify(carts):
+    service, sim, lines = carts
+    url = await service.checkout_url("s1", lines)
+    requests = sim.stats["requests"]
+
+    assert await service.checkout_url("s1", lines) == url
+    assert sim.stats["requests"] == requests
+
+
+async def test_checked_out_cart_is_replaced_once_verification_is_due(carts, monkeypatch):
+    service, sim, lines = carts
+    url = await service.checkout_url("s1", lines)
+    # The customer completed that checkout: Shopify no longer returns the cart.
+    sim.carts.clear()
+
+    monkeypatch.setattr(module, "SHOPIFY_CART_VERIFY_SECONDS", -1)
+    new_url = await service.checkout_url("s1", lines)
+
+    assert new_url != url
+    assert len(sim.carts) == 1
+
+
+async def test_verified_cart_keeps_its_checkout_url(carts, monkeypatch):
+    service, sim, lines = carts
+    url = await service.checkout_url("s1", lines)
+
+    monkeypatch.setattr(module, "SHOPIFY_CART_VERIFY_SECONDS", -1)
+    assert await service.checkout_url("s1", lines) == url
+    assert len(sim.carts) == 1
+
+
+def test_desired_lines_drops_explicit_zero_quantities():
+    lines = desired_lines([
+        {"variant_id": "1", "quantity": 0},
+        {"variant_id": "2"},
+        {"variant_id": "3", "quantity": "2"},
+    ])
+
+    assert lines == {"gid://shopify/ProductVariant/2": 1, "gid://shopify/ProductVariant/3": 2}
+
+
+@pytest.mark.parametrize("quantity", [None, [2], {"n": 2}, "two"])
+def test_desired_lines_rejects_quantities_that_are_not_whole_numbers(quantity):
+    with pytest.raises(ValueError, match="invalid quantity"):
+        desired_lines([{"variant_id": "1", "quantity": quantity}])
+
+
+@pytest.mark.parametrize("session", [{"x-session-id": "s1"}, {}])
+@pytest.mark.parametrize("quantity", [None, [2], 0, -1, "two"])
+async def test_cart_create_rejects_bad_quantities_before_calling_shopify(carts, api_client, session, quantity):
+    _, sim, lines = carts
+    requests = sim.stats["requests"]
+
+    response = await api_client.post(
+        "/api/shopify/cart/create",
+        headers=session,
+        json={"items": [{"variant_id": next(iter(lines)), "quantity": quantity}]},
+    )
+
+    assert response.status_code == 400
+    assert sim.stats["requests"] == requests
+
+
+@pytest.mark.parametrize("extras", [
+    {"attributes": [["gift", "yes"]]},
+    {"attributes": {"gift": 1}},
+    {"discount_codes": "SAVE10"},
+    {"discount_codes": ["SAVE10", 5]},
+])
+async def test_cart_create_rejects_malformed_attributes_and_discount_codes(carts, api_client, extras):
+    _, sim, lines = carts
+    requests = sim.stats["requests"]
+
+    response = await api_client.post(
+        "/api/shopify/cart/create",
+        headers={"x-session-id": "s1"},
+        json={"variant_id": next(iter(lines)), "quantity": 1, **extras},
+    )
+
+    assert response.status_code == 400
+    assert sim.stats["requests"] == requests
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from services import shopify_client
+from services.shopify_client import ShopifyClient
+from services.shopify_throttle import Priority
+
+pytestmark = pytest.mark.anyio
+
+QUERY = "query { shop { name } }"
+
+
+def _client(handler) -> ShopifyClient:
+    client = ShopifyClient(store="http://shopify.test", access_token="test", storefront_token="test")
+    client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://shopify.test")
+    return client
+
+
+@pytest.fixture
+def slow_first_response(monkeypatch):
+    """A handler whose first request hangs until cancelled; later ones answer at once."""
+    monkeypatch.setattr(shopify_client, "SHOPIFY_HEDGE_DEFAULT_DELAY", 0.05)
+    calls = {"sent": 0, "cancelled": 0}
+
+    async def handler(request):
+        calls["sent"] += 1
+        if calls["sent"] == 1:
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                calls["cancelled"] += 1
+                raise
+        return httpx.Response(200, json={"data": {"shop": {"name": "Hedged"}}})
+
+    return calls, handler
+
+
+async def test_slow_storefront_read_sends_one_hedge_and_cancels_the_loser(slow_first_response):
+    calls, handler = slow_first_response
+    client = _client(handler)
+
+    data = await client.storefront_graphql(QUERY)
+    await asyncio.sleep(0)
+
+    assert data == {"shop": {"name": "Hedged"}}
+    assert client.hedges_sent == 1
+    assert calls == {"sent": 2, "cancelled": 1}
+    await client.aclose()
+
+
+@pytest.mark.parametrize("call", [
+    lambda client: client.admin_graphql(QUERY),
+    lambda client: client.rest("GET", "shop.json"),
+    lambda client: client.storefront_graphql("mutation { noop }"),
+    lambda client: client.storefront_graphql(QUERY, priority=Priority.SYNC),
+])
+async def test_bucketed_calls_mutations_and_sync_reads_are_not_hedged(slow_first_response, call):
+    calls, handler = slow_first_response
+    client = _client(handler)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(call(client), timeout=0.3)
+
+    assert client.hedges_sent == 0
+    assert calls["sent"] == 1
+    await client.aclose()
+
+
+async def test_storefront_throttle_holds_back_storefront_calls_through_the_bucket(monkeypatch):
+    monkeypatch.setattr(shopify_client, "SHOPIFY_STOREFRONT_THROTTLE_SECONDS", 0.1)
+    sent = []
+
+    async def handler(request):
+        sent.append(time.monotonic())
+        if len(sent) == 1:
+            return httpx.Response(200, json={"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}]})
+        return httpx.Response(200, json={"data": {"shop": {"name": "Ok"}}})
+
+    client = _client(handler)
+    first = asyncio.create_task(client.storefront_graphql(QUERY))
+    while not sent:
+        await asyncio.sleep(0.01)
+    # Another caller arriving during the throttle queues on the bucket too.
+    second = asyncio.create_task(client.storefront_graphql(QUERY, priority=Priority.CHECKOUT))
+
+    assert await first == await second == {"shop": {"name": "Ok"}}
+    assert len(sent) == 3
+    assert min(sent[1:]) - sent[0] >= 0.09
+    await client.aclose()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services import shopify_throttle
+from services.shopify_throttle import LeakyBucket, Priority
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(shopify_throttle, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+async def test_checkout_is_served_before_sync_that_queued_first():
+    bucket = LeakyBucket("test", 10, 100)
+    bucket.drain()
+    served = []
+
+    async def acquire(name, priority):
+        await bucket.acquire(5, priority)
+        served.append(name)
+
+    sync = asyncio.create_task(acquire("sync", Priority.SYNC))
+    await asyncio.sleep(0)
+    checkout = asyncio.create_task(acquire("checkout", Priority.CHECKOUT))
+    await asyncio.gather(sync, checkout)
+
+    assert served == ["checkout", "sync"]
+
+
+async def test_settle_refunds_or_charges_the_difference_to_shopifys_level(clock):
+    bucket = LeakyBucket("test", 100, 10)
+    first = await bucket.acquire(10)
+    second = await bucket.acquire(20)
+    assert bucket.available == 70
+
+    # The query cost less than estimated; Shopify's level doesn't count the call still in flight.
+    bucket.settle(first, available=95)
+    assert bucket.available == 75
+
+    # It cost more than estimated.
+    bucket.settle(second, available=60)
+    assert bucket.available == 60
+
+    # Without a report, the estimate stays charged and the bucket refills at its rate.
+    bucket.settle(await bucket.acquire(10))
+    clock.now += 1
+    assert bucket.available == 60
+
+
+async def test_waiter_is_woken_by_the_timer_once_the_bucket_has_refilled():
+    bucket = LeakyBucket("test", 10, 100)
+    bucket.drain()
+
+    started = time.monotonic()
+    await asyncio.wait_for(bucket.acquire(5), timeout=1)
+
+    # 5 units at 100/s: woken after about 50ms, not polled for or slept past.
+    assert 0.04 <= time.monotonic() - started < 0.5
+
+
+async def test_waiter_is_woken_early_when_shopify_reports_a_refill():
+    bucket = LeakyBucket("test", 10, 0.1)
+    bucket.drain()
+    waiter = asyncio.create_task(bucket.acquire(5))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    bucket.settle(0, available=10)
+
+    assert await asyncio.wait_for(waiter, timeout=0.5) == 5
@@ -0,0 +1,42 @@
+import pytest
+
+from services import variant_availability as module
+from services.catalog_cache import CATALOG_CACHE_TTL_SECONDS
+from services.variant_availability import VariantAvailabilityCache
+
+PRODUCT = {"shopify_id": "gid://shopify/Product/1", "variants": [{"shopify_id": "gid://shopify/ProductVariant/10", "available": True}]}
+
+
+def test_synced_entries_outlive_a_catalog_refresh_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(module.time, "monotonic", lambda: now[0])
+    cache = VariantAvailabilityCache(ttl=120)
+    cache.record_products([PRODUCT])
+    cache.record("gid://shopify/ProductVariant/20", True)
+
+    now[0] += CATALOG_CACHE_TTL_SECONDS + 1
+
+    assert cache.is_available("gid://shopify/ProductVariant/10") is True
+    assert cache.is_available("gid://shopify/ProductVariant/20") is None
+
+
+@pytest.mark.anyio
+async def test_loaded_availability_lets_permalink_checkout_skip_shopify(catalog, shopify, monkeypatch):
+    from services import shopify_cart_service
+    from services.shopify_cart_service import ShopifyCartService
+
+    client, sim = shopify
+    cache = VariantAvailabilityCache()
+    monkeypatch.setattr(module, "get_shopify_client", lambda: client)
+    monkeypatch.setattr(shopify_cart_service, "get_shopify_client", lambda: client)
+    monkeypatch.setattr(shopify_cart_service, "get_variant_availability", lambda: cache)
+
+    # A restarted worker: nothing recorded in memory until the table is loaded.
+    assert await cache.load() == 3
+    assert cache.is_available(catalog.variants[0]) is True
+    requests = sim.stats["requests"]
+
+    result = await ShopifyCartService().checkout("s1", {catalog.variants[0]: 2}, mode="permalink")
+
+    assert result["via"] == "permalink"
+    assert sim.stats["requests"] == requests
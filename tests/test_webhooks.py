@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from routes import webhooks
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "webhook-secret"
+
+
+class RecordingUpdater:
+    def __init__(self):
+        self.upserts, self.deletes = [], []
+
+    def submit_upsert(self, product):
+        self.upserts.append(product)
+
+    def submit_delete(self, shopify_id):
+        self.deletes.append(shopify_id)
+
+
+@pytest.fixture
+def post_webhook(api_client, monkeypatch):
+    updater = RecordingUpdater()
+    monkeypatch.setattr(webhooks, "SHOPIFY_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(webhooks, "get_catalog_updater", lambda: updater)
+
+    async def post(topic, payload):
+        body = json.dumps(payload).encode()
+        signature = base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+        return await api_client.post(
+            "/api/webhooks/shopify/products",
+            content=body,
+            headers={"x-shopify-topic": topic, "x-shopify-hmac-sha256": signature},
+        )
+
+    return updater, post
+
+
+async def test_delete_is_queued_by_product_gid(post_webhook):
+    updater, post = post_webhook
+
+    response = await post("products/delete", {"id": 42})
+
+    assert response.status_code == 200
+    assert updater.deletes == ["gid://shopify/Product/42"]
+
+
+@pytest.mark.parametrize("topic", ["products/delete", "products/update"])
+@pytest.mark.parametrize("payload", [{}, {"title": "No id"}, [{"id": 42}]])
+async def test_payload_without_an_id_is_rejected(post_webhook, topic, payload):
+    updater, post = post_webhook
+
+    response = await post(topic, payload)
+
+    assert response.status_code == 400
+    assert updater.upserts == updater.deletes == []